@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import datetime
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+import numpy as np
+
+from server_process import launch, stop, wait_port, wait_ready
+
+sys.path.append("server")
+
+parser = argparse.ArgumentParser(description="Time each stage of /classify and the full HTTP path, results saved as JSON")
+parser.add_argument("--server", choices=["lite", "big"], default="lite", help="server module whose app and helpers are measured")
+parser.add_argument("--data-dirs", type=Path, nargs="+", default=[Path("./AUDIO_DATA/"), Path("./clean/AUDIO_DATA/")])
+parser.add_argument("--limit", type=int, default=0, help="use only the first N recordings of each directory (0 = all)")
+parser.add_argument("--model-stem", default="model_v2_(0.51, 0.89)_", help="server_models/<stem>.keras and <stem>.onnx are compared")
+parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+parser.add_argument("--requests", type=int, default=200, help="/classify requests per concurrency level")
+parser.add_argument("--output-dir", type=Path, default=Path("./reports/benchmarks/"))
+parser.add_argument("--compare", type=Path, help="previous result file to print the p50 differences against")
+parser.add_argument("--startup-runs", type=int, default=3, help="cold starts of the server process timed (0 = skip)")
+parser.add_argument("--startup-port", type=int, default=5099)
+parser.add_argument("--cache", action="store_true", help="keep the server's result cache, off by default so every /classify is timed through the pipeline")
+args = parser.parse_args()
+
+class Recording:
+    def __init__(self, path: Path):
+        self.path = path
+        self.data = path.read_bytes()
+        # AUDIO_DATA holds the phone's mp4 recordings under a .wav name, clean/ has real WAVs
+        self.content_type = "audio/wav" if self.data[:4] == b"RIFF" else "audio/mp4"
+
+    def file_storage(self):
+        from quart.datastructures import FileStorage
+        return FileStorage(io.BytesIO(self.data), filename=self.path.name, content_type=self.content_type)
+
+def summarize(seconds: list[float], wall: float | None = None) -> dict[str, float]:
+    ms = np.array(seconds) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        # sequential stages: one call at a time, HTTP: requests completed over the wall time
+        "throughput_per_s": round(len(ms) / (wall if wall is not None else ms.sum() / 1000), 2),
+    }
+
+def timed(fn: Callable[..., Any], *fn_args: Any) -> tuple[float, Any]:
+    start = time.perf_counter()
+    out = fn(*fn_args)
+    return time.perf_counter() - start, out
+
+async def timed_async(coro: Awaitable[Any]) -> tuple[float, Any]:
+    start = time.perf_counter()
+    out = await coro
+    return time.perf_counter() - start, out
+
+def git_commit() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = "unknown", False
+    return {"commit": commit, "dirty": dirty}
+
+async def bench_stages(server, recordings: list[Recording]) -> dict[str, dict[str, float]]:
+    from quart import request
+    from quart.testing import make_test_body_with_headers
+    from features import compute_mfcc, get_mfcc_fixed
+    from executors import featurize
+
+    times: dict[str, list[float]] = {stage: [] for stage in ["upload_parsing", "save_conversion", "load_audio", "compute_mfcc", "get_mfcc_fixed_redim", "featurize_in_memory"]}
+    # the first recording runs twice, its first pass pays the lazy imports and caches
+    for i, recording in enumerate([recordings[0], *recordings]):
+        record = (lambda stage, seconds: times[stage].append(seconds)) if i else (lambda stage, seconds: None)
+        body, headers = make_test_body_with_headers(files={"audio": recording.file_storage()})
+        async with server.app.test_request_context("/classify", method="POST", headers=headers, data=body):
+            seconds, files = await timed_async(request.files)
+            record("upload_parsing", seconds)
+            seconds, converted = await timed_async(server.save_conversion(files["audio"]))
+            record("save_conversion", seconds)
+
+        seconds, (y, sr) = timed(server.load_audio, str(converted))
+        record("load_audio", seconds)
+        os.remove(converted)
+        seconds, mfcc = timed(compute_mfcc, y, sr)
+        record("compute_mfcc", seconds)
+        seconds, _ = timed(lambda: server.redim(get_mfcc_fixed(mfcc)))
+        record("get_mfcc_fixed_redim", seconds)
+        # what /classify does by default since the uploads are decoded in memory
+        seconds, _ = timed(featurize, recording.data)
+        record("featurize_in_memory", seconds)
+    return {stage: summarize(seconds) for stage, seconds in times.items()}
+
+def bench_inference(x: np.ndarray) -> dict[str, dict[str, float]]:
+    models_dir = Path("server/server_models")
+    runners: dict[str, Callable[[np.ndarray], Any]] = {}
+    onnx_file = models_dir / f"{args.model_stem}.onnx"
+    keras_file = models_dir / f"{args.model_stem}.keras"
+    if onnx_file.exists():
+        from ort_session import load_session
+        session = load_session(onnx_file)
+        input_name = session.get_inputs()[0].name
+        runners["onnx"] = lambda batch: session.run(None, {input_name: batch})
+    if keras_file.exists():
+        import keras
+        model = keras.saving.load_model(keras_file)
+        runners["keras"] = model.predict_on_batch # type: ignore
+
+    results = {}
+    for name, run in runners.items():
+        # warm-up, keras traces a new function for each batch shape
+        run(x[:1])
+        run(x[:16])
+        single = [timed(run, x[i:i + 1])[0] for i in range(len(x))]
+        results[f"inference_{name}_batch1"] = summarize(single)
+        batched = [timed(run, np.roll(x, -i, axis=0)[:16])[0] for i in range(0, max(len(x), 16 * 8), 16)]
+        stats = summarize(batched)
+        stats["throughput_per_s"] = round(stats["throughput_per_s"] * len(x[:16]), 2) # inputs, not batches
+        results[f"inference_{name}_batch16"] = stats
+    return results
+
+async def bench_http(server, recordings: list[Recording]) -> dict[str, dict[str, Any]]:
+    results = {}
+    async with server.app.test_app() as test_app:
+        client = test_app.test_client()
+
+        async def classify(recording: Recording, semaphore: asyncio.Semaphore, latencies: list[float], statuses: dict[int, int]):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/classify", files={"audio": recording.file_storage()})
+                await response.get_data()
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await classify(recordings[0], asyncio.Semaphore(1), [], {}) # warm-up
+        for concurrency in args.concurrency:
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies: list[float] = []
+            statuses: dict[int, int] = {}
+            start = time.perf_counter()
+            await asyncio.gather(*[classify(recordings[i % len(recordings)], semaphore, latencies, statuses) for i in range(args.requests)])
+            wall = time.perf_counter() - start
+            results[f"classify_c{concurrency}"] = {**summarize(latencies, wall), "statuses": {str(k): v for k, v in sorted(statuses.items())}}
+            print(f"  /classify c={concurrency}: {results[f'classify_c{concurrency}']}")
+    return results
+
+async def bench_startup(recording: Recording) -> dict[str, dict[str, float]]:
+    """Cold starts of `python <server>_server.py`: port open, /ready answering 200, first /classify answered"""
+    from quart.testing import make_test_body_with_headers
+    body, headers = make_test_body_with_headers(files={"audio": recording.file_storage()})
+    base_url = f"http://127.0.0.1:{args.startup_port}"
+    times: dict[str, list[float]] = {"port_open": [], "ready": [], "first_classify": []}
+
+    async def since(start: float, fn: Callable[..., Any], *fn_args: Any) -> float:
+        await asyncio.to_thread(fn, *fn_args)
+        return time.perf_counter() - start
+
+    for _ in range(args.startup_runs):
+        start = time.perf_counter()
+        process = launch(f"{args.server}_server.py", {**os.environ, "DURIAN_PORT": str(args.startup_port)})
+        try:
+            times["port_open"].append(await since(start, wait_port, args.startup_port, [process]))
+            # a request sent as soon as the port opens, /ready is polled meanwhile
+            request = urllib.request.Request(f"{base_url}/classify", data=body, headers=dict(headers))
+            ready, first = await asyncio.wait_for(asyncio.gather(
+                since(start, wait_ready, base_url, [process]),
+                since(start, lambda: urllib.request.urlopen(request).read()),
+            ), timeout=120)
+            times["ready"].append(ready)
+            times["first_classify"].append(first)
+        finally:
+            stop([process], args.startup_port)
+    results = {f"startup_{stage}": summarize(seconds) for stage, seconds in times.items()}
+    for stage, stats in results.items():
+        print(f"  {stage:<32} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f}")
+    return results
+
+def compare(current: dict, previous_file: Path):
+    previous = json.loads(previous_file.read_text())
+    print(f"\nComparaison avec {previous_file.name} ({previous['meta']['commit']}) :")
+    for section in ["stages", "http", "startup"]:
+        for name, stats in current.get(section, {}).items():
+            old = previous.get(section, {}).get(name)
+            if old is None:
+                continue
+            delta = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+            print(f"  {name:<32} p50 {old['p50_ms']:>9.2f} -> {stats['p50_ms']:>9.2f} ms ({delta:+.1f}%)")
+
+async def main():
+    if not args.cache:
+        # read by the server at import, here and in the processes bench_startup starts
+        os.environ["DURIAN_RESULT_CACHE_SIZE"] = "0"
+    server = importlib.import_module(f"{args.server}_server")
+    recordings = []
+    for data_dir in args.data_dirs:
+        paths = sorted(data_dir.glob("*.wav"))
+        recordings += [Recording(path) for path in (paths[:args.limit] if args.limit else paths)]
+    print(f"{len(recordings)} enregistrements, serveur {args.server}")
+
+    results: dict[str, Any] = {
+        "meta": {
+            **git_commit(),
+            "timestamp": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "server": args.server,
+            "recordings": len(recordings),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "env": {k: v for k, v in os.environ.items() if k.startswith("DURIAN_")},
+        },
+    }
+
+    # save_conversion runs its conversion on the server's pool. The pool forked at import
+    # serves every stage: stopped here, the app's startup would fork a new one after
+    # keras and ONNX Runtime started their threads. The app's shutdown stops it.
+    server.pipeline.start()
+    results["stages"] = await bench_stages(server, recordings)
+
+    from executors import featurize
+    x = np.stack([featurize(recording.data)[0] for recording in recordings])[..., np.newaxis].astype(np.float32)
+    results["stages"].update(bench_inference(x))
+    for stage, stats in results["stages"].items():
+        print(f"  {stage:<32} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f}  p99 {stats['p99_ms']:>9.2f}  {stats['throughput_per_s']:>8.1f}/s")
+
+    results["http"] = await bench_http(server, recordings)
+    if args.startup_runs:
+        results["startup"] = await bench_startup(recordings[0])
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    output_file = args.output_dir / f"{results['meta']['timestamp'].replace(':', '-')}_{results['meta']['commit']}.json"
+    output_file.write_text(json.dumps(results, indent=2))
+    print(f"✅ Sauvegardé dans : {output_file}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+asyncio.run(main())
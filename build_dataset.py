@@ -0,0 +1,199 @@
+"""
+Builds the training dataset of data_augmentation_train_only.ipynb without the
+notebook loops: the recordings are decoded, augmented in memory with the same
+audiomentations Compose, featurized with the server's MFCC engine and written
+as sharded .npy arrays (np.load(..., mmap_mode="r")) listed in manifest.json,
+read back by server/training_data.py (shard_sources).
+
+    python build_dataset.py --data-dir AUDIO_DATA --out dataset --copies 5
+
+Interrupted builds resume from the last written shard, new recordings in the
+data directories are added on the next run, the existing shards are kept.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent / "server"))
+from features import compute_mfcc_batch, get_mfcc_fixed
+from feature_store import feature_config
+from resample import load_canonical
+
+manifest_name = "manifest.json"
+# same label as data_preparation.ipynb and the servers: 1 = 75-85% = "mature", 0 = 95% ripe
+mature_tag = "75-85"
+
+def augment_config() -> list[dict[str, Any]]:
+    # the Compose of data_augmentation_train_only.ipynb
+    return [
+        {"transform": "AddGaussianNoise", "min_amplitude": 0.001, "max_amplitude": 0.015, "p": 0.5},
+        {"transform": "TimeStretch", "min_rate": 0.9, "max_rate": 1.1, "p": 0.5},
+        {"transform": "PitchShift", "min_semitones": -1, "max_semitones": 1, "p": 0.5},
+        {"transform": "Shift", "min_shift": -0.1, "max_shift": 0.1, "p": 0.5},
+    ]
+
+def build_augment():
+    import audiomentations
+    return audiomentations.Compose([
+        getattr(audiomentations, t["transform"])(**{k: v for k, v in t.items() if k != "transform"})
+        for t in augment_config()
+    ])
+
+def get_label(name: str) -> int:
+    return int(re.split("_|%", name)[3] == mature_tag)
+
+def file_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def split_for(digest: str, test_size: float, seed: int) -> str:
+    # a hash, not train_test_split: adding recordings never moves the existing ones
+    position = int(hashlib.sha256(f"{seed}:{digest}".encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return "test" if position < test_size else "train"
+
+# --- worker processes
+
+_augment = None
+
+def _init_worker():
+    global _augment
+    _augment = build_augment()
+
+def featurize_recording(job: tuple[str, str, str, int, int]) -> tuple[str, str, str, int, np.ndarray]:
+    """One recording -> its MFCC and those of its augmented copies, (1 + copies, 40, max_t)"""
+    path, digest, split, copies, seed = job
+    y, sr = load_canonical(Path(path).read_bytes())
+    clips = [(y, sr)]
+    if split == "train" and copies > 0:
+        # audiomentations draws from the global generators, seeded per recording so a rebuild is identical
+        seed_value = int(digest[:8], 16) ^ seed
+        random.seed(seed_value)
+        np.random.seed(seed_value)
+        clips += [(_augment(samples=y, sample_rate=sr), sr) for _ in range(copies)] # type: ignore
+    x = np.stack([get_mfcc_fixed(m) for m in compute_mfcc_batch(clips)])
+    return path, digest, split, get_label(Path(path).name), x
+
+# ---
+
+class ShardWriter:
+    """Buffers rows per split and writes them out as X/y shard pairs, the manifest is rewritten after each shard"""
+
+    def __init__(self, out_dir: Path, manifest: dict[str, Any], shard_size: int, dtype: np.dtype):
+        self.out_dir = out_dir
+        self.manifest = manifest
+        self.shard_size = shard_size
+        self.dtype = dtype
+        self.buffers: dict[str, list[tuple[str, dict[str, Any], np.ndarray, np.ndarray]]] = {"train": [], "test": []}
+
+    def add(self, digest: str, entry: dict[str, Any], x: np.ndarray, y: np.ndarray):
+        buffer = self.buffers[entry["split"]]
+        buffer.append((digest, entry, x, y))
+        if sum(len(rows) for _, _, rows, _ in buffer) >= self.shard_size:
+            self.flush(entry["split"])
+
+    def flush(self, split: str):
+        buffer = self.buffers[split]
+        if not buffer:
+            return
+        name = f"{split}_{len(self.manifest['shards']):05d}"
+        x = np.concatenate([rows for _, _, rows, _ in buffer]).astype(self.dtype)
+        y = np.concatenate([labels for _, _, _, labels in buffer]).astype(np.int8)
+        for array, prefix in ((x, "X"), (y, "y")):
+            tmp_path = self.out_dir / f"{prefix}_{name}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, self.out_dir / f"{prefix}_{name}.npy")
+
+        row = 0
+        for digest, entry, rows, _ in buffer:
+            self.manifest["files"][digest] = {**entry, "shard": name, "rows": [row, row + len(rows)]}
+            row += len(rows)
+        self.manifest["shards"].append({"name": name, "split": split, "rows": len(x), "x": f"X_{name}.npy", "y": f"y_{name}.npy"})
+        # the manifest only lists complete shards, a build killed before this line redoes the shard
+        write_manifest(self.out_dir, self.manifest)
+        buffer.clear()
+
+def read_manifest(out_dir: Path) -> dict[str, Any] | None:
+    path = out_dir / manifest_name
+    return json.loads(path.read_text()) if path.exists() else None
+
+def write_manifest(out_dir: Path, manifest: dict[str, Any]):
+    tmp_path = out_dir / f"{manifest_name}.tmp"
+    tmp_path.write_text(json.dumps(manifest, indent=1))
+    os.replace(tmp_path, out_dir / manifest_name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the sharded MFCC dataset (originals + in-memory augmentations)")
+    parser.add_argument("--data-dir", type=Path, action="append", help="directory of labelled recordings, can be repeated (default AUDIO_DATA)")
+    parser.add_argument("--out", type=Path, default=Path("dataset"))
+    parser.add_argument("--copies", type=int, default=5, help="augmented copies per training recording")
+    parser.add_argument("--test-size", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--shard-size", type=int, default=512, help="rows per shard")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rebuild", action="store_true", help="start over when the settings changed since the last build")
+    args = parser.parse_args()
+
+    data_dirs: list[Path] = args.data_dir or [Path("AUDIO_DATA")]
+    args.out.mkdir(parents=True, exist_ok=True)
+    config = {
+        "features": feature_config(),
+        "augment": augment_config(),
+        "copies": args.copies,
+        "test_size": args.test_size,
+        "seed": args.seed,
+        "dtype": args.dtype,
+        "mature_tag": mature_tag,
+    }
+
+    manifest = read_manifest(args.out)
+    if manifest is not None and manifest["config"] != config:
+        if not args.rebuild:
+            sys.exit(f"{args.out} was built with other settings, run with --rebuild to start over")
+        for shard in manifest["shards"]:
+            for key in ("x", "y"):
+                (args.out / shard[key]).unlink(missing_ok=True)
+        manifest = None
+    if manifest is None:
+        manifest = {"config": config, "shards": [], "files": {}}
+        write_manifest(args.out, manifest)
+
+    jobs = []
+    seen: set[str] = set()
+    for data_dir in data_dirs:
+        for path in sorted(data_dir.glob("*.wav")):
+            digest = file_digest(path.read_bytes())
+            # already in a shard, or the same recording under another name
+            if digest in manifest["files"] or digest in seen:
+                continue
+            seen.add(digest)
+            jobs.append((str(path), digest, split_for(digest, args.test_size, args.seed), args.copies, args.seed))
+    print(f"{len(manifest['files'])} enregistrements déjà dans {args.out}, {len(jobs)} à traiter")
+    if not jobs:
+        return
+
+    writer = ShardWriter(args.out, manifest, args.shard_size, np.dtype(args.dtype))
+    start = time.perf_counter()
+    # fork keeps the worker start-up cheap, spawn re-imports this module (fine as well)
+    with multiprocessing.Pool(args.workers, initializer=_init_worker) as pool:
+        for done, (path, digest, split, label, x) in enumerate(pool.imap_unordered(featurize_recording, jobs), start=1):
+            entry = {"name": Path(path).name, "split": split, "label": label}
+            writer.add(digest, entry, x, np.full(len(x), label))
+            print(f"\r{done}/{len(jobs)} {Path(path).name}", end="", flush=True)
+    writer.flush("train")
+    writer.flush("test")
+
+    rows = {split: sum(s["rows"] for s in manifest["shards"] if s["split"] == split) for split in ("train", "test")}
+    print(f"\n✅ {len(jobs)} enregistrements en {time.perf_counter() - start:.1f}s, train {rows['train']} lignes, test {rows['test']} lignes")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,113 @@
+import argparse
+import json
+import re
+import sys
+import time
 import tf2onnx
 from pathlib import Path
 import keras
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
 import tensorflow as tf
 
-input_dir = Path("./models/")
-output_dir = Path("./server/server_models/")
-output_dir.mkdir(parents=True, exist_ok=True)
+sys.path.append("server")
+import cascade
+from cascade import Cascade
+from features import compute_mfcc_batch, get_mfcc_fixed
+from ort_session import load_session, session_options
+from resample import load_canonical
+from segmentation import combine, segment_mfcc
 
-for path in input_dir.glob("*.keras"):
-    print(f"Conversion de : {path.name}")
+parser = argparse.ArgumentParser(description="Export the .keras models to ONNX (fp32, int8) and ORT, and compare the variants")
+parser.add_argument("--input-dir", type=Path, default=Path("./models/"))
+parser.add_argument("--output-dir", type=Path, default=Path("./server/server_models/"))
+parser.add_argument("--data-dir", type=Path, default=Path("./AUDIO_DATA/"), help="labelled recordings used for calibration and evaluation")
+parser.add_argument("--calibration-size", type=int, default=32)
+parser.add_argument("--max-accuracy-drop", type=float, default=0.01, help="accuracy a variant may lose against fp32 and still be recommended")
+parser.add_argument("--repeats", type=int, default=200, help="single-input runs timed per variant")
+parser.add_argument("--cascade-accuracy", type=float, default=cascade.target_accuracy, help="accuracy the fast stage must keep on the recordings it answers alone")
+parser.add_argument("--cascade-folds", type=int, default=5, help="folds of the out-of-fold scores the fast stage threshold is calibrated on")
+args = parser.parse_args()
 
-    # Load model
-    model: keras.models.Model = keras.models.load_model(path) # type: ignore
+def load_dataset(data_dir: Path) -> tuple[np.ndarray, np.ndarray]:
+    """(n, 40, max_t, 1) MFCCs of the recordings, labelled 1 for 75-85% (mature) like data_preparation"""
+    paths = sorted(data_dir.glob("*.wav"))
+    clips = [load_canonical(path.read_bytes()) for path in paths]
+    x = np.stack([get_mfcc_fixed(m) for m in compute_mfcc_batch(clips)])[..., np.newaxis].astype(np.float32)
+    y = np.array([re.split("_|%", path.name)[3] == "75-85" for path in paths], dtype=np.int64)
+    return x, y
+
+def load_windows(data_dir: Path) -> tuple[list[np.ndarray], list[np.ndarray], np.ndarray]:
+    """Knock windows of each recording and their weights, as /classify featurizes them, and the labels"""
+    paths = sorted(data_dir.glob("*.wav"))
+    segmented = [segment_mfcc(*load_canonical(path.read_bytes())) for path in paths]
+    y = np.array([re.split("_|%", path.name)[3] == "75-85" for path in paths], dtype=np.int64)
+    return [windows.astype(np.float32) for windows, _ in segmented], [weights for _, weights in segmented], y
+
+def fit_cascade(windows: list[np.ndarray], weights: list[np.ndarray], y: np.ndarray) -> tuple[Cascade, np.ndarray]:
+    """
+    Fast stage fitted on every window (labelled with its recording), its threshold
+    calibrated on out-of-fold recording scores: the accuracy target holds on
+    recordings the logistic regression has not seen. Returns the out-of-fold scores.
+    """
+    stats = [cascade.pooled_stats(w) for w in windows]
+    def fit(rows: np.ndarray) -> dict[str, np.ndarray]:
+        return cascade.fit_logistic(
+            np.concatenate([stats[i] for i in rows]),
+            np.concatenate([np.full(len(stats[i]), y[i]) for i in rows]),
+            np.concatenate([weights[i] for i in rows]).astype(np.float64),
+        )
+
+    folds = np.random.default_rng(0).permutation(len(y)) % args.cascade_folds
+    scores = np.zeros(len(y))
+    for k in range(args.cascade_folds):
+        params = fit(np.flatnonzero(folds != k))
+        for i in np.flatnonzero(folds == k):
+            scores[i] = combine(cascade.predict_logistic(params, stats[i]), weights[i])
+    threshold = cascade.calibrate(scores, y, args.cascade_accuracy)
+    return Cascade(fit(np.arange(len(y))), threshold), scores
+
+def evaluate_cascade(fast: Cascade, scores: np.ndarray, model_file: Path, windows: list[np.ndarray], weights: list[np.ndarray], y: np.ndarray) -> dict:
+    """Accuracy and per-recording cost of fast stage + `model_file` against `model_file` alone"""
+    session = load_session(model_file)
+    input_name = session.get_inputs()[0].name
+    full, fast_seconds, full_seconds = [], [], []
+    for w, weight in zip(windows, weights):
+        start = time.perf_counter()
+        fast.scores(w)
+        fast_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        full.append(combine(session.run(None, {input_name: w[..., np.newaxis]})[0][:, 0], weight))
+        full_seconds.append(time.perf_counter() - start)
+    full, fast_seconds, full_seconds = np.array(full), np.array(fast_seconds), np.array(full_seconds)
+
+    # out-of-fold fast scores: what the fast stage answers for recordings it was not fitted on
+    exited = np.maximum(scores, 1 - scores) >= fast.threshold
+    combined = np.where(exited, scores, full)
+    ms_full = float(full_seconds.mean()) * 1000
+    ms_cascade = float((fast_seconds + np.where(exited, 0, full_seconds)).mean()) * 1000
+    return {
+        "full_model": model_file.name,
+        "target_accuracy": args.cascade_accuracy,
+        "threshold": fast.threshold,
+        "exit_rate": round(float(exited.mean()), 4),
+        "accuracy_full": float(np.mean((full > 0.5) == y)),
+        "accuracy_fast": float(np.mean((scores > 0.5) == y)),
+        "accuracy_cascade": float(np.mean((combined > 0.5) == y)),
+        "accuracy_exited": float(np.mean(((scores > 0.5) == y)[exited])) if exited.any() else None,
+        "agreement": float(np.mean((combined > 0.5) == (full > 0.5))),
+        "ms_per_recording_full": round(ms_full, 3),
+        "ms_per_recording_cascade": round(ms_cascade, 3),
+        "savings": round(1 - ms_cascade / ms_full, 4),
+    }
 
-    # Extract layer signature 
+def export_onnx(model: keras.models.Model, output_file: Path):
+    # Extract layer signature, batch axis left free for the MicroBatcher
     input_signature = [
-        tf.TensorSpec(shape=inp.shape, dtype=inp.dtype, name=inp.name.split(":")[0]) # type: ignore
+        tf.TensorSpec(shape=(None, *inp.shape[1:]), dtype=inp.dtype, name=inp.name.split(":")[0]) # type: ignore
         for inp in model.inputs
     ]
 
@@ -28,9 +120,119 @@ for path in input_dir.glob("*.keras"):
         opset=13
     )
 
-    # Save
-    output_file = output_dir / (path.stem + ".onnx")
-    with open(output_file, "wb") as f:
-        f.write(onnx_model.SerializeToString())
+    # tf2onnx names the free dimension "unk__N", give it a stable name
+    for tensor in [*onnx_model.graph.input, *onnx_model.graph.output]:
+        tensor.type.tensor_type.shape.dim[0].dim_param = "batch"
+
+    onnx.save(onnx_model, output_file)
+
+class MfccCalibrationReader(CalibrationDataReader):
+    def __init__(self, x: np.ndarray, input_name: str, batch_size: int = 8):
+        self.batches = iter([{input_name: x[i:i + batch_size]} for i in range(0, len(x), batch_size)])
+
+    def get_next(self):
+        return next(self.batches, None)
+
+def export_int8_static(onnx_file: Path, output_file: Path, x_calibration: np.ndarray):
+    preprocessed = output_file.with_suffix(".pre.onnx")
+    quant_pre_process(str(onnx_file), str(preprocessed))
+    input_name = onnx.load(preprocessed).graph.input[0].name
+    quantize_static(
+        str(preprocessed), str(output_file),
+        MfccCalibrationReader(x_calibration, input_name),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    preprocessed.unlink()
+
+def export_ort(onnx_file: Path, output_file: Path):
+    # "extended" stays portable, "all" adds layout changes tied to the building CPU
+    options = session_options(graph_optimization="extended")
+    options.optimized_model_filepath = str(output_file)
+    options.add_session_config_entry("session.save_model_format", "ORT")
+    load_session(onnx_file, options)
+
+def evaluate(model_file: Path, x: np.ndarray, y: np.ndarray, repeats: int) -> tuple[dict, np.ndarray]:
+    session = load_session(model_file)
+    input_name = session.get_inputs()[0].name
+    probs = np.concatenate([session.run(None, {input_name: x[i:i + 16]})[0] for i in range(0, len(x), 16)]).ravel()
+
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        session.run(None, {input_name: x[i % len(x)][np.newaxis]})
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(max(1, repeats // 16)):
+        session.run(None, {input_name: x[:16]})
+    batch_seconds = (time.perf_counter() - start) / max(1, repeats // 16)
+
+    report = {
+        "file": model_file.name,
+        "size_mb": round(model_file.stat().st_size / 1e6, 3),
+        "accuracy": float(np.mean((probs > 0.5) == y)),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "batch16_ms": round(batch_seconds * 1000, 3),
+    }
+    return report, probs
+
+def compare(stem: str, variants: list[Path], x: np.ndarray, y: np.ndarray) -> dict:
+    reports = []
+    reference: np.ndarray | None = None
+    for model_file in variants:
+        report, probs = evaluate(model_file, x, y, args.repeats)
+        if reference is None:
+            reference = probs
+        report["max_prob_diff"] = round(float(np.abs(probs - reference).max()), 5)
+        report["agreement"] = float(np.mean((probs > 0.5) == (reference > 0.5)))
+        reports.append(report)
+
+    fp32 = reports[0]
+    for report in reports:
+        report["accuracy_diff"] = round(report["accuracy"] - fp32["accuracy"], 4)
+        report["speedup"] = round(fp32["latency_ms_p50"] / report["latency_ms_p50"], 2)
+    # cheapest variant that stays within the accuracy budget
+    eligible = [r for r in reports if r["accuracy_diff"] >= -args.max_accuracy_drop]
+    recommended = min(eligible, key=lambda r: r["latency_ms_p50"])["file"]
+    return {"model": stem, "samples": len(y), "max_accuracy_drop": args.max_accuracy_drop, "recommended": recommended, "variants": reports}
+
+args.output_dir.mkdir(parents=True, exist_ok=True)
+
+x, y = load_dataset(args.data_dir)
+# calibrate on a fixed subset, the report still covers every recording
+x_calibration = x[np.random.default_rng(0).permutation(len(x))[:args.calibration_size]]
+print(f"Dataset : {len(y)} enregistrements ({int(y.sum())} mature)")
+windows, weights, y_windows = load_windows(args.data_dir)
+
+for path in args.input_dir.glob("*.keras"):
+    print(f"Conversion de : {path.name}")
+
+    # Load model
+    model: keras.models.Model = keras.models.load_model(path) # type: ignore
+
+    onnx_file = args.output_dir / (path.stem + ".onnx")
+    dynamic_file = args.output_dir / (path.stem + ".int8-dynamic.onnx")
+    static_file = args.output_dir / (path.stem + ".int8-static.onnx")
+    ort_file = args.output_dir / (path.stem + ".ort")
+
+    export_onnx(model, onnx_file)
+    quantize_dynamic(str(onnx_file), str(dynamic_file), weight_type=QuantType.QInt8)
+    export_int8_static(onnx_file, static_file, x_calibration)
+    export_ort(onnx_file, ort_file)
+
+    report = compare(path.stem, [onnx_file, dynamic_file, static_file, ort_file], x, y)
+    # the fast stage and its threshold are shared by every variant, timed against the recommended one
+    fast, scores = fit_cascade(windows, weights, y_windows)
+    report["cascade"] = evaluate_cascade(fast, scores, args.output_dir / report["recommended"], windows, weights, y_windows)
+    fast.save(args.output_dir / (path.stem + ".cascade.json"), **report["cascade"])
+    report_file = args.output_dir / (path.stem + ".report.json")
+    report_file.write_text(json.dumps(report, indent=2))
 
-    print(f"✅ Sauvegardé dans : {output_file}")
+    for variant in report["variants"]:
+        print(f"  {variant['file']:<45} acc {variant['accuracy']:.3f} ({variant['accuracy_diff']:+.3f})  p50 {variant['latency_ms_p50']:.2f} ms  x{variant['speedup']:.2f}  {variant['size_mb']:.2f} MB")
+    c = report["cascade"]
+    print(f"  cascade : {c['exit_rate']:.0%} des enregistrements sans le modèle complet, acc {c['accuracy_cascade']:.3f} (complet {c['accuracy_full']:.3f})  {c['ms_per_recording_cascade']:.2f} ms au lieu de {c['ms_per_recording_full']:.2f} ms")
+    print(f"✅ Sauvegardé dans : {args.output_dir}, recommandé : DURIAN_MODEL=\"{report['recommended']}\"")
@@ -7,7 +7,7 @@ import { Badge } from "@/components/ui/badge"
 import { Collapsible, CollapsibleContent, CollapsibleTrigger } from "@/components/ui/collapsible"
 import { Alert, AlertDescription } from "@/components/ui/alert"
 import { ChevronDown, ChevronRight, Play, Plus, Loader2, AlertCircle, WifiOff } from "lucide-react"
-import { getPhases, trainPhase, type Phase } from "@/services/training"
+import { getPhases, trainPhase, watchTrainingJob, type Phase, type TrainingJob } from "@/services/training"
 import { useMobile } from "@/hooks/use-mobile"
 import { useNetworkStatus } from "@/hooks/use-network-status"
 import AudioUploadForm from "@/components/audio-upload-form"
@@ -18,6 +18,7 @@ export default function TrainingDataList() {
   const [phases, setPhases] = useState<Phase[]>([])
   const [loading, setLoading] = useState(true)
   const [training, setTraining] = useState(false)
+  const [trainingJob, setTrainingJob] = useState<TrainingJob | null>(null)
   const [openPhases, setOpenPhases] = useState<string[]>([])
   const [showUploadForm, setShowUploadForm] = useState(false)
   const [error, setError] = useState<string | null>(null)
@@ -67,12 +68,15 @@ export default function TrainingDataList() {
     setError(null)
     try {
       const result = await trainPhase()
-      console.log("Training completed:", result.message)
+      setTrainingJob(result.job)
+      const job = await watchTrainingJob(result.job.id, setTrainingJob)
+      console.log("Training completed:", job.result.model)
       await fetchPhases() // Recharger les phases après entraînement
     } catch (error) {
       setError(error instanceof Error ? error.message : "Failed to train model")
     } finally {
       setTraining(false)
+      setTrainingJob(null)
     }
   }
 
@@ -163,7 +167,9 @@ export default function TrainingDataList() {
           {training ? (
             <>
               <Loader2 className="w-4 h-4 mr-2 animate-spin" />
-              Training...
+              {trainingJob && trainingJob.epoch > 0
+                ? `Training... epoch ${trainingJob.epoch}/${trainingJob.epochs}`
+                : "Training..."}
             </>
           ) : (
             <>
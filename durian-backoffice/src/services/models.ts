@@ -1,8 +1,17 @@
 import { buildApiUrl } from "@/lib/config"
 
+export interface ModelVersion {
+  version: number
+  file: string
+  metrics: { loss?: number; accuracy?: number }
+  created_at: string
+  active: boolean
+}
+
 export interface ModelsResponse {
   models: string[]
   current: string
+  versions: ModelVersion[]
 }
 
 // Service pour les modèles
@@ -49,3 +58,15 @@ export async function downloadModel(modelName: string): Promise<void> {
     throw error instanceof Error ? error : new Error("Failed to download model")
   }
 }
+
+export async function activateModel(version: number): Promise<string> {
+  const response = await fetch(buildApiUrl(`/activate-model?version=${version}`), { method: "PUT" })
+
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({ error: "Unknown error" }))
+    throw new Error(errorData.error || `HTTP error! status: ${response.status}`)
+  }
+
+  const data: { current: string } = await response.json()
+  return data.current
+}
@@ -6,16 +6,34 @@ export interface SubmittedFile {
   label: "mature" | "overripe"
   size: number
   link: string
+  phase: number
+  digest: string | null
+  duplicates: number
 }
 
 export interface Phase {
   name: string
+  count: number
   files: SubmittedFile[]
 }
 
+export interface TrainingJob {
+  id: string
+  phase: number
+  status: "queued" | "running" | "completed" | "failed" | "cancelled"
+  epoch: number
+  epochs: number
+  logs: Record<string, number>
+  error: string | null
+  result: { model?: string }
+  created_at: string
+  finished_at: string | null
+}
+
 export interface TrainingResponse {
   phase: string
   message: string
+  job: TrainingJob
 }
 
 export interface AddTrainingDataResponse {
@@ -82,6 +100,38 @@ export async function trainPhase(epochs = 10): Promise<TrainingResponse> {
   }
 }
 
+// Suit un job d'entraînement via SSE, résout quand le job est terminé
+export function watchTrainingJob(jobId: string, onProgress: (job: TrainingJob) => void): Promise<TrainingJob> {
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(buildApiUrl(`/train-jobs/${jobId}/events`))
+
+    const handle = (event: MessageEvent) => {
+      const job: TrainingJob = JSON.parse(event.data).job
+      onProgress(job)
+      if (job.status === "completed") {
+        source.close()
+        resolve(job)
+      } else if (job.status === "failed" || job.status === "cancelled") {
+        source.close()
+        reject(new Error(job.error || `Training ${job.status}`))
+      }
+    }
+    source.addEventListener("status", handle)
+    source.addEventListener("epoch", handle)
+    source.onerror = () => {
+      source.close()
+      reject(new Error("Lost connection to the training job"))
+    }
+  })
+}
+
+export async function cancelTrainingJob(jobId: string): Promise<void> {
+  const response = await fetch(buildApiUrl(`/train-jobs/${jobId}`), { method: "DELETE" })
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`)
+  }
+}
+
 export async function getAudio(url: string): Promise<string> {
   try {
     const response = await fetch(buildApiUrl(`/get-audio?url=${encodeURIComponent(url)}`))
@@ -0,0 +1,282 @@
+"""
+Open-loop load test of /classify: a fleet of phones sends the recordings of
+AUDIO_DATA at each of `--rates` requests per second (Poisson arrivals), in the
+formats the app and the backoffice send. Prints the latency/throughput curve
+and the saturation point, and exits with 1 when the SLO is breached:
+
+    python load_fleet.py --server lite --rates 2 5 10 20 --duration 20 --slo-p95-ms 1500
+    python load_fleet.py --url http://192.168.1.20:5000 --rates 1 2 4 --slo-rate 2
+
+Latencies run from when a request was due, not when a connection was free to
+send it: a saturated server shows up as growing latency, not as a lower rate.
+"""
+import argparse
+import asyncio
+import datetime
+import http.client
+import json
+import os
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+from server_process import launch, stop, wait_ready
+
+parser = argparse.ArgumentParser(description="/classify latency against the arrival rate of a simulated fleet of durian-app clients")
+parser.add_argument("--server", choices=["lite", "big"], default="lite", help="server started for the test")
+parser.add_argument("--mode", choices=["localhost", "inprocess"], default="localhost", help="HTTP to a started server process, or the Quart test client in this process")
+parser.add_argument("--url", help="server already running, nothing is started")
+parser.add_argument("--port", type=int, default=5097)
+parser.add_argument("--data-dirs", type=Path, nargs="+", default=[Path("./AUDIO_DATA/"), Path("./clean/AUDIO_DATA/")])
+parser.add_argument("--mix", default="app=0.6,m4a=0.2,wav=0.2",
+                    help="share of each upload kind: app = phone mp4 sent as audio/wav (what durian-app does), m4a = audio/x-m4a, wav = real WAV")
+parser.add_argument("--rates", type=float, nargs="+", default=[1, 2, 5, 10, 20], help="requests per second, one step each")
+parser.add_argument("--duration", type=float, default=20, help="seconds of arrivals per step")
+parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+parser.add_argument("--connections", type=int, default=64, help="phones with a request in flight at most, the others wait their turn")
+parser.add_argument("--no-reuse", action="store_true", help="a new TCP connection per request instead of keep-alive")
+parser.add_argument("--timeout", type=float, default=60, help="seconds before a request counts as failed")
+parser.add_argument("--cache", action="store_true", help="keep the server's result cache, off by default so every request is classified")
+parser.add_argument("--saturation-ratio", type=float, default=0.9, help="a step is saturated below this share of the offered rate")
+parser.add_argument("--slo-p95-ms", type=float, default=2000)
+parser.add_argument("--slo-error-rate", type=float, default=0.01)
+parser.add_argument("--slo-rate", type=float, help="the SLO must hold up to this rate (default: every step)")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output-dir", type=Path, default=Path("./reports/load/"))
+
+# upload kind -> (is the recording a real WAV, content type, file suffix)
+kinds = {
+    "app": (False, "audio/wav", ".wav"),
+    "m4a": (False, "audio/x-m4a", ".m4a"),
+    "wav": (True, "audio/wav", ".wav"),
+}
+
+def parse_mix(mix: str) -> dict[str, float]:
+    shares = {kind: float(share) for kind, share in (item.split("=") for item in mix.split(","))}
+    if unknown := set(shares) - set(kinds):
+        raise SystemExit(f"Unknown upload kinds {sorted(unknown)}, expected {list(kinds)}")
+    total = sum(shares.values())
+    return {kind: share / total for kind, share in shares.items() if share > 0}
+
+def load_uploads(data_dirs: list[Path], mix: dict[str, float]) -> dict[str, list[tuple[bytes, dict[str, str]]]]:
+    """Multipart bodies and headers of every recording, per upload kind of the mix"""
+    from quart.datastructures import FileStorage
+    from quart.testing import make_test_body_with_headers
+    import io
+    recordings = [path.read_bytes() for data_dir in data_dirs for path in sorted(data_dir.glob("*.wav"))]
+    uploads: dict[str, list[tuple[bytes, dict[str, str]]]] = {}
+    for kind in mix:
+        is_wav, content_type, suffix = kinds[kind]
+        # AUDIO_DATA holds the phone's mp4 recordings under a .wav name, clean/ has real WAVs
+        matching = [data for data in recordings if (data[:4] == b"RIFF") == is_wav]
+        if not matching:
+            raise SystemExit(f"No recording for the {kind} uploads in {[str(d) for d in data_dirs]}")
+        uploads[kind] = []
+        for i, data in enumerate(matching):
+            body, headers = make_test_body_with_headers(files={"audio": FileStorage(io.BytesIO(data), filename=f"recording_{i}{suffix}", content_type=content_type)})
+            uploads[kind].append((body, dict(headers)))
+    return uploads
+
+class HttpTarget:
+    """POSTs over http.client from `connections` threads, each keeping its connection alive unless told not to"""
+
+    def __init__(self, base_url: str, connections: int, reuse: bool, timeout: float):
+        url = urllib.parse.urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.reuse = reuse
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(connections, thread_name_prefix="phone")
+        self.local = threading.local()
+
+    def _post(self, body: bytes, headers: dict[str, str]) -> int:
+        conn = getattr(self.local, "conn", None) if self.reuse else None
+        try:
+            if conn is None:
+                raise ConnectionError
+            response = self._send(conn, body, headers)
+        except (ConnectionError, http.client.RemoteDisconnected):
+            # the server closed the idle keep-alive connection, phones resend on a new one
+            if conn is not None:
+                conn.close()
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                response = self._send(conn, body, headers)
+            except Exception:
+                conn.close()
+                self.local.conn = None
+                raise
+        if self.reuse and not response.will_close:
+            self.local.conn = conn
+        else:
+            conn.close()
+        return response.status
+
+    @staticmethod
+    def _send(conn: http.client.HTTPConnection, body: bytes, headers: dict[str, str]) -> http.client.HTTPResponse:
+        conn.request("POST", "/classify", body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response
+
+    async def post(self, body: bytes, headers: dict[str, str]) -> int:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._post, body, headers)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class InProcessTarget:
+    """The server's Quart app in this event loop, no sockets: the server's own cost without the network"""
+
+    def __init__(self, client, connections: int):
+        self.client = client
+        self.slots = asyncio.Semaphore(connections)
+
+    async def post(self, body: bytes, headers: dict[str, str]) -> int:
+        async with self.slots:
+            response = await self.client.post("/classify", data=body, headers=headers)
+            await response.get_data()
+            return response.status_code
+
+    def close(self):
+        pass
+
+async def run_step(target, uploads: dict[str, list[tuple[bytes, dict[str, str]]]], mix: dict[str, float], rate: float, args: argparse.Namespace, rng: np.random.Generator) -> dict:
+    n = max(1, round(rate * args.duration))
+    # n Poisson arrivals over the step are n uniform times, sorted
+    due = np.sort(rng.uniform(0, args.duration, n)) if args.arrivals == "poisson" else np.arange(n) / rate
+    picked = rng.choice(list(mix), n, p=list(mix.values()))
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    results: list[tuple[str, float, float]] = []
+
+    async def phone(at: float, kind: str):
+        await asyncio.sleep(max(0.0, start + at - loop.time()))
+        body, headers = uploads[kind][int(rng.integers(len(uploads[kind])))]
+        try:
+            status = str(await asyncio.wait_for(target.post(body, headers), args.timeout))
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except Exception as e:
+            status = type(e).__name__
+        end = loop.time()
+        results.append((status, end - (start + at), end - start))
+
+    await asyncio.gather(*[phone(float(at), str(kind)) for at, kind in zip(due, picked)])
+
+    statuses: dict[str, int] = {}
+    for status, _, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    ok_ms = np.array([seconds for status, seconds, _ in results if status == "200"]) * 1000
+    errors = len(results) - len(ok_ms)
+    wall = max(args.duration, *(end for _, _, end in results))
+    percentile = lambda q: round(float(np.percentile(ok_ms, q)), 1) if len(ok_ms) else None
+    return {
+        "offered_per_s": rate,
+        "throughput_per_s": round(len(ok_ms) / wall, 2),
+        "requests": n,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "error_rate": round(errors / n, 4),
+        "statuses": statuses,
+    }
+
+def saturated(step: dict, args: argparse.Namespace) -> bool:
+    return step["throughput_per_s"] < args.saturation_ratio * step["offered_per_s"] or step["error_rate"] > args.slo_error_rate
+
+def slo_breaches(steps: list[dict], args: argparse.Namespace) -> list[str]:
+    breaches = []
+    for step in steps:
+        if args.slo_rate is not None and step["offered_per_s"] > args.slo_rate:
+            continue
+        if step["p95_ms"] is None or step["p95_ms"] > args.slo_p95_ms:
+            breaches.append(f"{step['offered_per_s']:g}/s : p95 {step['p95_ms']} ms > {args.slo_p95_ms:g} ms")
+        if step["error_rate"] > args.slo_error_rate:
+            breaches.append(f"{step['offered_per_s']:g}/s : erreurs {step['error_rate']:.1%} > {args.slo_error_rate:.1%}")
+    return breaches
+
+async def run_curve(target, uploads, mix, args: argparse.Namespace) -> list[dict]:
+    rng = np.random.default_rng(args.seed)
+    # first requests pay the lazy imports and caches of the server, not measured
+    await asyncio.gather(*[target.post(*uploads[kind][0]) for kind in mix])
+    steps = []
+    for rate in sorted(args.rates):
+        step = await run_step(target, uploads, mix, rate, args, rng)
+        steps.append(step)
+        print(f"  {rate:>7g}/s -> {step['throughput_per_s']:>7.2f}/s  p50 {step['p50_ms']} ms  p95 {step['p95_ms']} ms  p99 {step['p99_ms']} ms  {step['statuses']}")
+    return steps
+
+async def run_inprocess(uploads, mix, args: argparse.Namespace) -> list[dict]:
+    sys.path.append("server")
+    server = __import__(f"{args.server}_server")
+    async with server.app.test_app() as test_app:
+        target = InProcessTarget(test_app.test_client(), args.connections)
+        if hasattr(server, "ready"):
+            # the lite server warms up in the background
+            await asyncio.to_thread(server.ready.wait, args.timeout)
+        return await run_curve(target, uploads, mix, args)
+
+def main():
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+    uploads = load_uploads(args.data_dirs, mix)
+    if not args.cache:
+        # read by the server at import, in this process or the one started below
+        os.environ["DURIAN_RESULT_CACHE_SIZE"] = "0"
+    print(f"{sum(len(u) for u in uploads.values())} envois préparés ({', '.join(f'{k} {v:.0%}' for k, v in mix.items())}), "
+          f"{args.connections} connexions{' sans keep-alive' if args.no_reuse else ''}, {os.cpu_count()} cœurs")
+
+    process = None
+    if args.url is None and args.mode == "inprocess":
+        target_name = f"{args.server}_server (in-process)"
+        steps = asyncio.run(run_inprocess(uploads, mix, args))
+    else:
+        base_url = args.url
+        if base_url is None:
+            base_url = f"http://127.0.0.1:{args.port}"
+            process = launch(f"{args.server}_server.py", {**os.environ, "DURIAN_PORT": str(args.port)})
+        target_name = base_url if args.url else f"{args.server}_server ({base_url})"
+        target = HttpTarget(base_url, args.connections, not args.no_reuse, args.timeout)
+        try:
+            if process is not None:
+                wait_ready(base_url, [process])
+            steps = asyncio.run(run_curve(target, uploads, mix, args))
+        finally:
+            target.close()
+            if process is not None:
+                stop([process], args.port)
+
+    sustainable = [step["offered_per_s"] for step in steps if not saturated(step, args)]
+    saturation = next((step["offered_per_s"] for step in steps if saturated(step, args)), None)
+    breaches = slo_breaches(steps, args)
+    print(f"Débit soutenu max : {max(sustainable):g}/s" if sustainable else "Saturé dès le premier palier")
+    print(f"Saturation à : {saturation:g}/s" if saturation is not None else "Pas de saturation sur les paliers testés")
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H-%M-%SZ")
+    output_file = args.output_dir / f"{timestamp}_fleet.json"
+    output_file.write_text(json.dumps({
+        "target": target_name,
+        "cpu_count": os.cpu_count(),
+        "mix": mix,
+        "arrivals": args.arrivals,
+        "connections": args.connections,
+        "reuse": not args.no_reuse,
+        "steps": steps,
+        "max_sustainable_per_s": max(sustainable) if sustainable else None,
+        "saturation_per_s": saturation,
+        "slo": {"p95_ms": args.slo_p95_ms, "error_rate": args.slo_error_rate, "up_to_rate": args.slo_rate, "breaches": breaches},
+    }, indent=2))
+    print(f"✅ Sauvegardé dans : {output_file}")
+
+    if breaches:
+        print("❌ SLO non respecté :")
+        for breach in breaches:
+            print(f"  {breach}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Load test of the lite server scaled out over inference workers: for each worker
+count the server runs with DURIAN_WORK_QUEUE and that many inference_worker.py
+processes, and /classify is sent `--requests` recordings with `--concurrency`
+requests in flight. 0 workers is the single process server for reference.
+
+    python load_test.py --workers 0 1 2 4 --concurrency 16 --requests 400
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+from server_process import launch, stop, wait_ready
+
+parser = argparse.ArgumentParser(description="/classify throughput of the lite server for several inference worker counts")
+parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="inference_worker.py processes, 0 = no queue")
+parser.add_argument("--data-dirs", type=Path, nargs="+", default=[Path("./clean/AUDIO_DATA/")])
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--requests", type=int, default=400)
+parser.add_argument("--port", type=int, default=5098)
+parser.add_argument("--output-dir", type=Path, default=Path("./reports/load/"))
+
+def multipart(path: Path) -> tuple[bytes, dict[str, str]]:
+    from quart.datastructures import FileStorage
+    from quart.testing import make_test_body_with_headers
+    data = path.read_bytes()
+    # AUDIO_DATA holds the phone's mp4 recordings under a .wav name, clean/ has real WAVs
+    content_type = "audio/wav" if data[:4] == b"RIFF" else "audio/mp4"
+    body, headers = make_test_body_with_headers(files={"audio": FileStorage(io.BytesIO(data), filename=path.name, content_type=content_type)})
+    return body, dict(headers)
+
+def post(url: str, body: bytes, headers: dict[str, str]) -> tuple[int, float]:
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body, headers=headers)) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+def run(workers: int, uploads: list[tuple[bytes, dict[str, str]]], args: argparse.Namespace) -> dict:
+    queue_dir = tempfile.mkdtemp(prefix="durian-queue-")
+    env = {
+        **os.environ,
+        "DURIAN_PORT": str(args.port),
+        # every request has to go through the pipeline
+        "DURIAN_RESULT_CACHE_SIZE": "0",
+        # one thread per process, the processes are what scales
+        "DURIAN_ORT_INTRA_THREADS": os.environ.get("DURIAN_ORT_INTRA_THREADS", "1"),
+    }
+    if workers:
+        env["DURIAN_WORK_QUEUE"] = str(Path(queue_dir) / "queue.sqlite3")
+    processes = [launch(script, env) for script in ["lite_server.py", *["inference_worker.py"] * workers]]
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url, processes)
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            # warm-up, one request per worker
+            list(pool.map(lambda upload: post(f"{base_url}/classify", *upload), uploads[:max(workers, args.concurrency)]))
+            start = time.perf_counter()
+            results = list(pool.map(lambda i: post(f"{base_url}/classify", *uploads[i % len(uploads)]), range(args.requests)))
+            wall = time.perf_counter() - start
+    finally:
+        stop(processes, args.port)
+        shutil.rmtree(queue_dir, ignore_errors=True)
+
+    ms = np.array([seconds for _, seconds in results]) * 1000
+    statuses: dict[str, int] = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "workers": workers,
+        "throughput_per_s": round(len(results) / wall, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "statuses": statuses,
+    }
+
+def main():
+    args = parser.parse_args()
+    paths = [path for data_dir in args.data_dirs for path in sorted(data_dir.glob("*.wav"))]
+    uploads = [multipart(path) for path in paths]
+    print(f"{len(uploads)} enregistrements, {args.requests} requêtes, concurrence {args.concurrency}, {os.cpu_count()} cœurs")
+
+    runs = []
+    for workers in args.workers:
+        runs.append(run(workers, uploads, args))
+        result = runs[-1]
+        speedup = result["throughput_per_s"] / runs[0]["throughput_per_s"]
+        print(f"  workers {workers:>2}: {result['throughput_per_s']:>8.1f}/s (x{speedup:.2f})  p50 {result['p50_ms']:>8.1f} ms  p95 {result['p95_ms']:>8.1f} ms  {result['statuses']}")
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H-%M-%SZ")
+    output_file = args.output_dir / f"{timestamp}_workers.json"
+    output_file.write_text(json.dumps({"cpu_count": os.cpu_count(), "concurrency": args.concurrency, "requests": args.requests, "runs": runs}, indent=2))
+    print(f"✅ Sauvegardé dans : {output_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, NamedTuple
+import numpy as np
+
+import audio_io
+from feature_store import feature_config
+from resample import canonical_sr, load_canonical
+
+# a phase is packed once it is closed (the next one started), DURIAN_ARCHIVE_PHASES=0 keeps its files
+archive_phases = os.environ.get("DURIAN_ARCHIVE_PHASES", "1") == "1"
+
+pcm_name    = "archive.pcm"   # int16 samples of every clip, end to end
+mfcc_name   = "mfcc.npy"      # (clips, n_mfcc, max_t) float16, row i = clip i
+labels_name = "labels.npy"    # 1 = mature, same rows, together a training_data.ShardSource
+index_name  = "index.json"    # where each clip starts, written last: no index, no archive
+
+class ClipRef(NamedTuple):
+    """A clip of a phase archive: samples [offset, offset + frames) of pcm_path"""
+    pcm_path: str
+    offset: int
+    frames: int
+    sr: int
+
+@lru_cache
+def archive_rate(phase_dir: Path) -> int:
+    return json.loads((phase_dir / index_name).read_text())["sample_rate"]
+
+def clip_ref(phase_dir: Path, offset: int, frames: int) -> ClipRef:
+    return ClipRef(str(phase_dir / pcm_name), offset, frames, archive_rate(phase_dir))
+
+def clip_pcm(ref: ClipRef) -> np.ndarray:
+    # a view on the page cache, only the pages of this clip are read
+    return np.memmap(ref.pcm_path, dtype="<i2", mode="r", offset=ref.offset * 2, shape=(ref.frames,))
+
+def clip_wav(ref: ClipRef) -> bytes:
+    pcm = clip_pcm(ref)
+    return audio_io.wav_header(pcm.nbytes, ref.sr) + pcm.tobytes()
+
+def wav_size(frames: int) -> int:
+    return 44 + frames * 2
+
+# --- run in the worker processes
+
+def load_source(source: str | ClipRef) -> tuple[np.ndarray, int]:
+    """Canonical signal of a stored file (its path) or of an archived clip"""
+    if isinstance(source, ClipRef):
+        return clip_pcm(source).astype(np.float32) / 32768, source.sr
+    return load_canonical(Path(source).read_bytes())
+
+# ---
+
+def pack_phase(phase_dir: Path, entries: list[dict[str, Any]], paths: list[Path], mfcc_paths: list[Path]) -> list[dict[str, Any]]:
+    """
+    Packs the stored files of a closed phase into phase_dir: their samples as int16
+    at the canonical rate in one file, their MFCCs (feature store files) in one
+    array. Returns the catalog entries with the "offset" and "frames" of their clip,
+    the files are left for the caller to remove once the catalog points at the archive.
+    """
+    tmp = {name: phase_dir / f"{name}.tmp" for name in (pcm_name, mfcc_name, labels_name, index_name)}
+    clips = []
+    offset = 0
+    with open(tmp[pcm_name], "wb") as f:
+        for entry, path in zip(entries, paths):
+            y, _ = load_canonical(path.read_bytes())
+            pcm = (np.clip(y, -1, 1) * 32767).astype("<i2")
+            f.write(pcm.tobytes())
+            clips.append({**entry, "offset": offset, "frames": len(pcm), "size": wav_size(len(pcm))})
+            offset += len(pcm)
+
+    first = np.load(mfcc_paths[0], mmap_mode="r")
+    mfcc = np.lib.format.open_memmap(tmp[mfcc_name], mode="w+", dtype=first.dtype, shape=(len(mfcc_paths), *first.shape))
+    for i, mfcc_path in enumerate(mfcc_paths):
+        mfcc[i] = np.load(mfcc_path)
+    mfcc.flush()
+    del mfcc
+    with open(tmp[labels_name], "wb") as f:
+        np.save(f, np.array([1 if entry["label"] == "mature" else 0 for entry in entries], dtype=np.int8))
+    tmp[index_name].write_text(json.dumps({"sample_rate": canonical_sr, "feature_config": feature_config(), "clips": clips}, indent=1))
+
+    for name, path in tmp.items():
+        os.replace(path, phase_dir / name)
+    archive_rate.cache_clear()
+    return clips
+
+def read_index(phase_dir: Path) -> list[dict[str, Any]] | None:
+    """Catalog entries of an archived phase, None if it has no archive"""
+    if not (phase_dir / index_name).exists():
+        return None
+    return json.loads((phase_dir / index_name).read_text())["clips"]
+
+def mfcc_current(phase_dir: Path) -> bool:
+    """The MFCC block was computed with the current feature parameters"""
+    return json.loads((phase_dir / index_name).read_text())["feature_config"] == feature_config()
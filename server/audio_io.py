@@ -0,0 +1,163 @@
+import hashlib
+import io
+import os
+from pathlib import PurePosixPath
+import struct
+import subprocess
+import tarfile
+import zipfile
+import numpy as np
+from quart.datastructures import FileStorage
+
+supported_file_types = ["wav", "m4a", "mp4", "wave", "x-m4a"]
+ffmpeg_binary = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+archive_file_types = ["zip", "x-zip-compressed", "x-tar", "gzip", "x-gzip", "x-gtar"]
+archive_suffixes = (".zip", ".tar", ".tar.gz", ".tgz")
+# raw PCM accepted from streaming clients: name -> (WAV format tag, bits)
+stream_encodings = {"s16le": (1, 16), "s24le": (1, 24), "s32le": (1, 32), "f32le": (3, 32)}
+# uncompressed audio read out of one archive, a crate of 50 recordings is ~50 MB
+max_archive_bytes = int(os.environ.get("DURIAN_ARCHIVE_MAX_BYTES", 512 * 1024 * 1024))
+
+class AudioDecodeError(Exception):
+    pass
+
+def file_type(file: FileStorage) -> str:
+    file_type: str = (file.content_type or "/").split("/")[1]
+    if file_type not in supported_file_types:
+        raise AudioDecodeError(f'File type {file_type} is not supported. \nSupported types : [{', '.join(supported_file_types)}]')
+    return file_type
+
+def is_archive(file: FileStorage) -> bool:
+    return (file.content_type or "/").split("/")[1] in archive_file_types or (file.filename or "").lower().endswith(archive_suffixes)
+
+def _is_audio_entry(name: str) -> bool:
+    path = PurePosixPath(name)
+    # macOS zips carry __MACOSX/._name resource forks next to every file
+    if path.name.startswith(".") or "__MACOSX" in path.parts:
+        return False
+    return path.suffix[1:].lower() in supported_file_types
+
+def unpack_archive(data: bytes, max_bytes: int = max_archive_bytes) -> list[tuple[str, str, bytes]]:
+    """(name, file type, content) of the audio files in a zip or tar(.gz) archive, in archive order"""
+    buf = io.BytesIO(data)
+    if zipfile.is_zipfile(buf):
+        with zipfile.ZipFile(buf) as archive:
+            entries = [info for info in archive.infolist() if not info.is_dir() and _is_audio_entry(info.filename)]
+            if sum(info.file_size for info in entries) > max_bytes:
+                raise AudioDecodeError(f"Archive holds more than {max_bytes} bytes of audio")
+            return [(info.filename, PurePosixPath(info.filename).suffix[1:].lower(), archive.read(info)) for info in entries]
+    buf.seek(0)
+    try:
+        with tarfile.open(fileobj=buf, mode="r:*") as archive:
+            members = [member for member in archive.getmembers() if member.isfile() and _is_audio_entry(member.name)]
+            if sum(member.size for member in members) > max_bytes:
+                raise AudioDecodeError(f"Archive holds more than {max_bytes} bytes of audio")
+            return [(member.name, PurePosixPath(member.name).suffix[1:].lower(), archive.extractfile(member).read()) for member in members] # type: ignore
+    except tarfile.TarError:
+        raise AudioDecodeError("Archive is neither a zip nor a tar file")
+
+def decode(data: bytes) -> tuple[np.ndarray, int]:
+    """
+    Decode an uploaded file to a mono float32 signal at its native sample rate,
+    the same output as `librosa.load(path, sr=None)`, without touching the disk.
+    The content is sniffed: some phones send m4a with a .wav name/content type.
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return decode_wav(data)
+    return decode_ffmpeg(data)
+
+def decode_wav(data: bytes) -> tuple[np.ndarray, int]:
+    buf = memoryview(data)
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id = bytes(buf[pos:pos + 4])
+        (size,) = struct.unpack_from("<I", buf, pos + 4)
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", buf, body)
+            if fmt[0] == 0xFFFE:  # WAVE_FORMAT_EXTENSIBLE, real format in the sub-format GUID
+                (sub_format,) = struct.unpack_from("<H", buf, body + 24)
+                fmt = (sub_format, *fmt[1:])
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise AudioDecodeError("WAV data chunk found before fmt chunk")
+            # streamed WAVs (e.g. ffmpeg writing to a pipe) don't know their size
+            if size == 0 or size == 0xFFFFFFFF or body + size > len(buf):
+                size = len(buf) - body
+            return _pcm_to_float(buf[body:body + size], fmt)
+        pos = body + size + (size & 1)
+    raise AudioDecodeError("No data chunk in WAV file")
+
+def _pcm_to_float(pcm: memoryview, fmt: tuple) -> tuple[np.ndarray, int]:
+    audio_format, channels, sr, _, _, bits = fmt
+    width = bits // 8
+    pcm = pcm[:len(pcm) - len(pcm) % (width * channels)]
+    # np.frombuffer is a view on the request body, the only copy is the float conversion
+    if audio_format == 3 and bits in (32, 64):
+        y = np.frombuffer(pcm, dtype=f"<f{width}").astype(np.float32)
+    elif audio_format == 1 and bits == 8:
+        y = (np.frombuffer(pcm, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif audio_format == 1 and bits in (16, 32):
+        y = np.frombuffer(pcm, dtype=f"<i{width}").astype(np.float32) / float(1 << (bits - 1))
+    elif audio_format == 1 and bits == 24:
+        raw = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3)
+        as_int = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int8).astype(np.int32) << 16))
+        y = as_int.astype(np.float32) / float(1 << 23)
+    else:
+        raise AudioDecodeError(f"Unsupported WAV encoding (format {audio_format}, {bits} bits)")
+    if channels > 1:
+        y = y.reshape(-1, channels).mean(axis=1)
+    return y, sr
+
+def pcm_digest(y: np.ndarray, sr: int) -> str:
+    """Digest of a decoded signal, shared by the same audio sent in another container or with other metadata"""
+    h = hashlib.blake2b(np.ascontiguousarray(y, dtype=np.float32), digest_size=16)
+    h.update(sr.to_bytes(4, "little"))
+    return h.hexdigest()
+
+def encode_wav(y: np.ndarray, sr: int) -> bytes:
+    """Mono float signal -> 16-bit PCM WAV bytes, the format decode_wav reads fastest"""
+    pcm = (np.clip(y, -1, 1) * 32767).astype("<i2").tobytes()
+    return wav_header(len(pcm), sr) + pcm
+
+def wav_header(n_bytes: int, sr: int, audio_format: int = 1, width: int = 2) -> bytes:
+    """44 bytes in front of `n_bytes` of mono PCM to make a WAV file"""
+    return (
+        b"RIFF" + struct.pack("<I", 36 + n_bytes) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, audio_format, 1, sr, sr * width, width, width * 8)
+        + b"data" + struct.pack("<I", n_bytes)
+    )
+
+class PcmStream:
+    """Raw little-endian PCM in arbitrary chunks -> mono float32, a sample split across two chunks waits for the next one"""
+
+    def __init__(self, encoding: str = "s16le", channels: int = 1):
+        if encoding not in stream_encodings or channels < 1:
+            raise AudioDecodeError(f'Encoding {encoding} is not supported. \nSupported encodings : [{', '.join(stream_encodings)}]')
+        audio_format, bits = stream_encodings[encoding]
+        self.fmt = (audio_format, channels, 0, 0, 0, bits)
+        self.frame_bytes = bits // 8 * channels
+        self.pending = b""
+
+    def decode(self, data: bytes) -> np.ndarray:
+        data = self.pending + data
+        usable = len(data) - len(data) % self.frame_bytes
+        self.pending = data[usable:]
+        y, _ = _pcm_to_float(memoryview(data)[:usable], self.fmt)
+        return y
+
+def decode_ffmpeg(data: bytes) -> tuple[np.ndarray, int]:
+    # ffmpeg keeps the native rate and channels, we downmix like librosa does
+    try:
+        proc = subprocess.run(
+            [ffmpeg_binary, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-f", "wav", "-acodec", "pcm_s16le", "pipe:1"],
+            input=data,
+            capture_output=True,
+            check=False,
+        )
+    except FileNotFoundError:
+        raise AudioDecodeError(f"{ffmpeg_binary} is required to decode compressed audio")
+    if proc.returncode != 0 or not proc.stdout:
+        raise AudioDecodeError(f"ffmpeg could not decode the file: {proc.stderr.decode(errors='replace').strip()}")
+    return decode_wav(proc.stdout)
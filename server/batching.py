@@ -0,0 +1,107 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Callable
+import numpy as np
+
+import metrics
+
+queue_depth = metrics.Gauge("durian_batcher_queue_depth", "Inputs waiting for the next inference batch")
+batch_size_hist = metrics.Histogram("durian_batcher_batch_size", "Number of inputs per inference call", buckets=(1, 2, 4, 8, 16, 32, 64))
+batch_latency = metrics.Histogram("durian_batcher_inference_seconds", "Duration of one batched inference call", buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+batches_total = metrics.Counter("durian_batcher_batches_total", "Number of batched inference calls")
+inputs_total = metrics.Counter("durian_batcher_inputs_total", "Number of inputs classified through the batcher")
+
+max_batch_size = int(os.environ.get("DURIAN_BATCH_SIZE", 16))
+max_wait_ms = float(os.environ.get("DURIAN_BATCH_WAIT_MS", 5))
+
+class MicroBatcher:
+    """
+    Collects (n, 40, 273, 1) inputs from concurrent requests and runs them through
+    `predict_fn` as a single batch on a dedicated inference thread.
+    A batch is sent as soon as it holds `max_batch_size` rows or the oldest input
+    waited `max_wait_ms`.
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray], max_batch_size: int = max_batch_size, max_wait_ms: float = max_wait_ms):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self._queue: asyncio.Queue[tuple[np.ndarray, asyncio.Future]] | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        while self._queue is not None and not self._queue.empty():
+            _, fut = self._queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(RuntimeError("Batcher stopped"))
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, x: np.ndarray) -> np.ndarray:
+        """Queue `x` (first axis = rows) and wait for its predictions."""
+        if self._queue is None:
+            raise RuntimeError("Batcher not started")
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((x, fut))
+        queue_depth.set(self._queue.qsize())
+        return await fut
+
+    async def _collect(self) -> list[tuple[np.ndarray, asyncio.Future]]:
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        first = await self._queue.get()
+        batch = [first]
+        rows = first[0].shape[0]
+        deadline = loop.time() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            rows += item[0].shape[0]
+        queue_depth.set(self._queue.qsize())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # requests whose client went away don't need to be computed
+            batch = [(x, fut) for x, fut in batch if not fut.done()]
+            if not batch:
+                continue
+            xs = np.concatenate([x for x, _ in batch])
+            start = loop.time()
+            try:
+                preds = await loop.run_in_executor(self.executor, self.predict_fn, xs)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            batch_latency.observe(loop.time() - start)
+            batch_size_hist.observe(xs.shape[0])
+            batches_total.inc()
+            inputs_total.inc(xs.shape[0])
+
+            offset = 0
+            for x, fut in batch:
+                n = x.shape[0]
+                if not fut.done():
+                    fut.set_result(preds[offset:offset + n])
+                offset += n
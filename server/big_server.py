@@ -1,67 +1,112 @@
 from argparse import Action
 from ast import Tuple
+import asyncio
 from datetime import timezone
 import datetime
+import io
 from pathlib import Path
+import json
 import typing
-import keras
 import numpy as np
 import os
 from typing import Literal, override
-import librosa
 import numpy as np
-from quart import Quart, jsonify, make_response, request, send_file
-from pydub import AudioSegment
+from executors import Overloaded, Pipeline, canonical_wav, convert_to_wav, featurize, featurize_segments, load_audio, pcm_mfcc
+# the CPU pool forks before TensorFlow is imported and any thread started (see Pipeline.fork)
+pipeline = Pipeline()
+pipeline.fork()
+import keras
+from quart import Quart, jsonify, make_response, request, send_file, websocket
 from quart.datastructures import FileStorage
-from tqdm import tqdm
 from werkzeug.datastructures import MultiDict
-from quart_cors import cors
+from quart_cors import cors, cors_exempt
+from audio_archive import ClipRef, archive_phases, clip_ref, clip_wav, index_name, labels_name, mfcc_current, mfcc_name, pack_phase, read_index
+from batching import MicroBatcher
+from cascade import cascade_enabled, cascade_mtime, cascade_path, load_cascade
+from catalog import Catalog
+from dedup import Deduplicator, duplicate_policy
+import metrics
+import audio_io
+from features import max_t, n_mfcc
+from feature_store import FeatureStore
+from fine_tuning import fine_tune, holdout_files, replay_rows, restored_metrics
+from model_registry import ModelRegistry
+from result_cache import ResultCache, upload_digest
+from training_data import FileSource, RowsSource, ShardSource, Source
+from training_jobs import JobRunner, ProgressCallback, TrainingJob
+from segmentation import combine
+from streaming import StreamSession
+import tracing
+import uuid
 
 BASE_DIR = Path(__file__).resolve().parent
 print(f"Base directory: {BASE_DIR}")
+# DURIAN_DATA_DIR: where the uploads, their catalog and the temporary files are kept, the catalog links are relative to it
+DATA_DIR = Path(os.environ.get("DURIAN_DATA_DIR", BASE_DIR)).resolve()
 models_dir = BASE_DIR / "server_models"
 
-def model_path(new=False) -> os.PathLike:
-    # use the last version
-    files = [(i.name, i.name.split("_v")[1].split('_')[0]) for i in os.scandir(models_dir)]
-    # filter keras models
-    files = [i for i in files if i[0].endswith(".keras")]
-    sorted_files = sorted(files, key=lambda x : x[1])
-    
-    if new:
-        last_version = int(sorted_files[-1][1])
-        new_version = last_version + 1
-        new_filename = f"model_v{new_version}_(0.,0.)_.keras"
-        return models_dir / new_filename
-
-    return models_dir / sorted_files[-1][0]
+(train_submit_dir := DATA_DIR / "train_submitted").mkdir(parents=True, exist_ok=True)
+(tmp_dir := DATA_DIR / "tmp").mkdir(exist_ok=True)
 
-(train_submit_dir := Path(BASE_DIR) / "train_submitted").mkdir(exist_ok=True)
-(tmp_dir := BASE_DIR / "tmp").mkdir(exist_ok=True)
+catalog = Catalog(train_submit_dir / "catalog.sqlite3")
 
 def training_phase() -> int:
-    files = list(os.scandir(train_submit_dir))
-    if files == []:
-        return 0
-    return int(sorted([f.name for f in files])[-1].split("_")[-1])
+    phase = catalog.current_phase()
+    return 0 if phase is None else phase
+
+def warmup(model: keras.models.Sequential):
+    # the first call builds the TF graph, it must not land on a user request
+    model.predict_on_batch(np.zeros((1, n_mfcc, max_t, 1), dtype=np.float32))
+
+# load the model marked active in server_models/manifest.json (the last version by default)
+registry = ModelRegistry(models_dir, ".keras", load=keras.saving.load_model, warmup=warmup)
+registry.activate(registry.manifest_active) # type: ignore
 
-# load model
-model: keras.models.Sequential = keras.saving.load_model(model_path()) # type: ignore
+def predict(x: np.ndarray) -> np.ndarray:
+    # one read of the (version, model) pair, a swap between the two can't mislabel the span
+    version, model = registry.get()
+    with tracing.span("inference", model_version=version):
+        return model.predict_on_batch(x)
+
+batcher = MicroBatcher(predict)
+# keyed with the model version: a newly activated model never serves the previous one's results
+result_cache = ResultCache()
+feature_store = FeatureStore(DATA_DIR / "feature_store")
+training_jobs = JobRunner()
 
 # handle global server variables
-nb_tmp = 0
-max_t = 273 # value found in the data_preparation.py notebook
+# DURIAN_TEMP_FILES=1 keeps the old save -> convert -> librosa.load path on /classify (debugging)
+use_temp_files = os.environ.get("DURIAN_TEMP_FILES") == "1"
+# DURIAN_SEGMENT=0 classifies the first max_t frames only instead of the knock windows
+use_segments = os.environ.get("DURIAN_SEGMENT", "1") == "1"
+# recordings accepted by one /classify-batch call (parts or archive entries)
+max_batch_files = int(os.environ.get("DURIAN_BATCH_MAX_FILES", 100))
 
 app = Quart(__name__)
+tracing.install(app)
 
 app = cors(
     app,
     allow_origin="http://localhost:5173",
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Authorization"],
 )
 
+@app.before_serving
+async def start_workers():
+    pipeline.start()
+    await batcher.start()
+    await dedup.start(pipeline)
+    app.archive_task = asyncio.create_task(archive_closed_phases()) # type: ignore
+
+@app.after_serving
+async def stop_workers():
+    app.archive_task.cancel() # type: ignore
+    await dedup.stop()
+    await batcher.stop()
+    pipeline.stop()
+
 class DateUtils:
     datetime_storage_pattern = "%Y-%m-%d_%H-%M-%S"
     datetime_response_pattern = "%Y-%m-%dT%H:%M:%SZ"
@@ -69,41 +114,71 @@ class DateUtils:
 class LabelUtils:
     type LabelType = Literal["mature", "overripe"] 
     allowed_labels = ["mature", "overripe"] 
+    threshold = 0.5
+    @staticmethod
+    def from_score(result: float) -> tuple[LabelType, float]:
+        """model output (probability of mature) -> label and confidence"""
+        durian_class: LabelUtils.LabelType = "mature" if (result > LabelUtils.threshold) else "overripe"
+        return durian_class, max(result, 1-result)
     @staticmethod
     def get_label(file_name: Path) -> tuple[LabelType, int]:
         return {
             "mature": ("mature", 0),
             "overripe": ("overripe", 1)
         }[file_name.stem.split("_")[-1]] # type: ignore
-        
-def load_audio(path: str):
-    y, sr = librosa.load(path, sr=None)
-    return y, sr
-
-def compute_mfcc(y, sr):
-    n_mfcc     = 40        # number of coefficients
-    n_fft      = 2048      # window size STFT
-    hop_length = 512
-    mfcc_features = librosa.feature.mfcc(
-        y=y, sr=sr, 
-        n_mfcc=n_mfcc, 
-        n_fft=n_fft, 
-        hop_length=hop_length
-        )
-    return librosa.util.normalize(mfcc_features, axis=1)
-
-def get_mfcc_fixed(m: np.ndarray):
-    T_i = m.shape[1]
-    if T_i < max_t:
-        pad_width = max_t - T_i
-        m2 = np.pad(m,
-                    pad_width=((0,0),
-                    (0,pad_width)), 
-                    mode='constant',
-                    constant_values=0)
-    else:
-        m2 = m[:, :max_t]
-    return m2
+
+def submission_entry(path: Path, phase: int) -> dict[str, typing.Any]:
+    """Catalog row of a stored training file, named <storage date>_<content hash>_<label>.wav (older ones without the hash)"""
+    infos = path.stem.split("_")
+    dt = datetime.datetime.strptime('_'.join(infos[:2]), DateUtils.datetime_storage_pattern).replace(tzinfo=timezone.utc)
+    return {
+        "name": path.name,
+        "date": dt.strftime(DateUtils.datetime_response_pattern),
+        "label": infos[-1],
+        "size": path.stat().st_size,
+        "link": str(path.relative_to(DATA_DIR)),
+        "phase": phase,
+    }
+
+if catalog.current_phase() is None:
+    # first start with a catalog: index the files the directory scans used to list
+    phase_dirs = [(int(d.name.split("_")[1]), d) for d in train_submit_dir.glob("phase_*") if d.is_dir()]
+    catalog.add([submission_entry(path, phase) for phase, d in phase_dirs for path in d.glob("*.wav")])
+    for phase, d in phase_dirs:
+        catalog.add_phase(phase)
+        if (clips := read_index(d)) is not None:
+            catalog.add(clips)
+            catalog.set_archived(clips)
+
+def clip_source(link: str) -> str | ClipRef:
+    """Where the audio of a submission is read from: its file, or its clip once the phase is archived"""
+    if (clip := catalog.clip(link)) is None:
+        return str(DATA_DIR / link)
+    phase, offset, frames = clip
+    return clip_ref(train_submit_dir / f"phase_{phase}", offset, frames)
+
+# files indexed without a fingerprint get one in the background once serving
+dedup = Deduplicator(catalog, DATA_DIR, clip_source)
+archive_lock = asyncio.Lock()
+
+def listing_query() -> tuple[dict[str, typing.Any], int | None, int]:
+    """?phase=&label=&since=&until= filters and ?limit=&offset= page of the listings, ValueError if malformed"""
+    filters: dict[str, typing.Any] = {}
+    if (phase := request.args.get("phase")) is not None:
+        filters["phase"] = int(phase)
+    if (label := request.args.get("label")) is not None:
+        if label not in LabelUtils.allowed_labels:
+            raise ValueError(f"label must be in : [{", ".join(LabelUtils.allowed_labels)}]")
+        filters["label"] = label
+    for bound in ("since", "until"):
+        if (value := request.args.get(bound)) is not None:
+            # same format as the "date" of the responses
+            filters[bound] = datetime.datetime.strptime(value, DateUtils.datetime_response_pattern).strftime(DateUtils.datetime_response_pattern)
+    limit = request.args.get("limit", type=int)
+    offset = request.args.get("offset", 0, type=int)
+    if (limit is not None and limit < 0) or offset < 0:
+        raise ValueError("limit and offset must be positive integers")
+    return filters, limit, offset
 
 def redim(mfcc_fixed):
     # The model expects shape (batch_size, 40, 273, 1) not (batch_size, 1, 40, 273, 1)
@@ -111,41 +186,91 @@ def redim(mfcc_fixed):
     result = mfcc_fixed[..., np.newaxis]  # Add channel dimension at the end
     return result
 
-async def exec_full_data_pipeline(file: str | FileStorage, delete=True):
-    global nb_tmp
+@tracing.traced("exec_full_data_pipeline")
+async def exec_full_data_pipeline(file: str | FileStorage, delete=True, file_type: str = "wav"):
     if (isinstance(file, str)):
         file_path = Path(file)
     else:
-        file_path = BASE_DIR / "tmp" / f"tmp_{nb_tmp}.wav"
+        file_path = tmp_dir / f"tmp_{uuid.uuid4().hex}.wav"
         await file.save(file_path)
         
-    y, sr = load_audio(str(file_path))
+    y, sr = await pipeline.run("decode", load_audio, str(file_path))
+    tracing.count_input(file_type, sr)
     if delete:
         os.remove(file_path)
-    nb_tmp+=1
-    mfcc = compute_mfcc(y, sr)
-    fixed = get_mfcc_fixed(mfcc)
-    return redim(fixed)
-
-async def save_conversion(file: FileStorage, out_dir: Path = tmp_dir, label: str = "") -> Path:
-    global nb_tmp
-    supported_file_types = ["wav", "m4a", "mp4", "wave", "x-m4a"]
-    file_type: str = file.content_type.split("/")[1] # type: ignore
-    if file_type not in supported_file_types:
-        raise Exception(f'File type {file_type} is not supported are supported. \nSupported types : [{', '.join(supported_file_types)}]')
+    return redim(await pipeline.run("mfcc", pcm_mfcc, y, sr))
+
+async def featurize_upload(data: bytes) -> tuple[np.ndarray, np.ndarray, int, str]:
+    """(n_windows, 40, max_t, 1) model inputs of a recording, the weights combining their scores, the sample rate and the digest of the decoded signal"""
+    if use_segments:
+        windows, weights, sr, digest = await pipeline.run("featurize", featurize_segments, data)
+        return windows[..., np.newaxis], weights, sr, digest
+    mfcc, sr, digest = await pipeline.run("featurize", featurize, data)
+    return redim(mfcc)[np.newaxis], np.ones(1), sr, digest
+
+def fast_stage(version: int | None) -> tuple[Path, int] | None:
+    """
+    File and modification time of the fast stage in front of `version`: its own,
+    or the newest of an older version. The fast stage is fitted on the labels, not
+    on the model's outputs, a fine-tuned phase keeps the one convert.py calibrated
+    for the checkpoint it started from.
+    """
+    if not cascade_enabled or version not in registry.versions:
+        return None
+    for v in sorted((v for v in registry.versions if v <= version), reverse=True):
+        path = cascade_path(registry.path(v))
+        if (mtime_ns := cascade_mtime(path)) is not None:
+            return path, mtime_ns
+    return None
+
+def cache_version(version: int | None) -> tuple[int | None, tuple[Path, int] | None]:
+    """Results are cached per model version and fast stage: a cascade file convert.py rewrites no longer serves its predecessor's answers"""
+    return version, fast_stage(version)
+
+def cached_result(kind: str, digest: str, file_type: str, version: tuple[int | None, typing.Any]) -> dict[str, typing.Any] | None:
+    """Response already sent for this recording by `version` (a cache_version), counted like a new one"""
+    if (cached := result_cache.get(kind, digest, version)) is None:
+        return None
+    resp, sr = cached
+    if kind == "upload":
+        tracing.count_input(file_type, sr)
+    tracing.count_prediction(resp['type'], version[0], resp.get('stage', 'full'))
+    return resp
+
+def fast_result(x: np.ndarray, weights: np.ndarray, version: tuple[int | None, tuple[Path, int] | None]) -> dict[str, typing.Any] | None:
+    """Response of the cascade's fast stage in front of `version` (a cache_version), None when the recording needs the full model"""
+    model_version, stage = version
+    if stage is None or (cascade := load_cascade(*stage)) is None or (score := cascade.decide(x, weights)) is None:
+        return None
+    durian_class, confidence = LabelUtils.from_score(score)
+    tracing.count_prediction(durian_class, model_version, "fast")
+    return {'type': durian_class, 'confidence': confidence, 'segments': len(weights), 'model_version': model_version, 'stage': 'fast'}
+
+@tracing.traced("save_conversion")
+async def save_conversion(file: FileStorage, out_dir: Path = tmp_dir, label: str = "", digest: str = "") -> Path:
+    file_type = audio_io.file_type(file)
 
     now = datetime.datetime.now(datetime.UTC)
-    file_path: Path = (out_dir / f"{now.strftime(DateUtils.datetime_storage_pattern)}_{label}").with_suffix(f".{file_type}")
-    nb_tmp+=1
+    # temporary conversions have no label, a random suffix keeps concurrent requests apart,
+    # training files carry their content hash so two uploads in the same second keep their own name
+    suffix = f"{digest[:16]}_{label}" if label else uuid.uuid4().hex
+    file_path: Path = (out_dir / f"{now.strftime(DateUtils.datetime_storage_pattern)}_{suffix}").with_suffix(f".{file_type}")
     if file_type not in ["wav", "wave"]:
         await file.save(file_path)
-        sound = AudioSegment.from_file(file_path, format=file_type)
-        os.remove(file_path)
-        sound.export(file_path.with_suffix(".wav"), format='wav')
+        await pipeline.run("conversion", convert_to_wav, str(file_path), str(file_path.with_suffix(".wav")), file_type)
     else:
         await file.save(file_path.with_suffix(".wav"))
     return file_path.with_suffix(".wav")
 
+@tracing.traced("save_canonical")
+async def save_canonical(data: bytes, out_dir: Path, label: str, digest: str) -> Path:
+    """Training upload stored once as 16-bit WAV at the canonical rate, training reads it without resampling"""
+    wav = await pipeline.run("conversion", canonical_wav, data)
+    now = datetime.datetime.now(datetime.UTC)
+    out_path = out_dir / f"{now.strftime(DateUtils.datetime_storage_pattern)}_{digest[:16]}_{label}.wav"
+    await asyncio.to_thread(out_path.write_bytes, wav)
+    return out_path
+
 @app.route('/classify', methods=['POST'])
 async def upload():
     files = await request.files
@@ -153,28 +278,174 @@ async def upload():
         return jsonify({'error': 'No files received'}), 400
 
     file: FileStorage = files['audio']
+    pinned: int | None = request.args.get("model", type=int)
+    version_key = cache_version(registry.active_version if pinned is None else pinned)
+    # digests the result is cached under, the temporary files path has none
+    keys: dict[str, str] = {}
     try:
-        converted = await save_conversion(file)
+        file_type = audio_io.file_type(file)
+        if use_temp_files:
+            converted = await save_conversion(file)
+            x, weights = (await exec_full_data_pipeline(str(converted), file_type=file_type))[np.newaxis], np.ones(1)
+        else:
+            data = file.read()
+            # a resend of the same bytes skips the decoding and the model
+            keys["upload"] = upload_digest(data)
+            if (resp := cached_result("upload", keys["upload"], file_type, version_key)) is not None:
+                return resp, 200
+            x, weights, sr, keys["pcm"] = await featurize_upload(data)
+            tracing.count_input(file_type, sr)
+            # the same audio in another container or with other tags skips the model
+            if (resp := cached_result("pcm", keys["pcm"], file_type, version_key)) is not None:
+                result_cache.put(keys, version_key, (resp, sr))
+                return resp, 200
+            if (resp := fast_result(x, weights, version_key)) is not None:
+                result_cache.put(keys, version_key, (resp, sr))
+                return resp, 200
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
-        return jsonify({'error': e}), 400
-    
-    x = await exec_full_data_pipeline(str(converted))
-
-    pred: np.ndarray = model.predict(x) # type: ignore
-    result = float(pred[0][0])
+        return jsonify({'error': str(e)}), 400
 
-    durian_class: LabelUtils.LabelType | None = None
-    
-    durian_class = "mature" if (result > 0.5) else "overripe"    
-
-    confidence = max(result, 1-result)
+    if pinned is None or pinned == registry.active_version:
+        version = registry.active_version
+        pred: np.ndarray = await batcher.submit(x)
+    else:
+        # pinned versions skip the batcher but still run on the inference thread
+        try:
+            version, pinned_model = await asyncio.to_thread(registry.get, pinned)
+        except KeyError as e:
+            return jsonify({'error': e.args[0]}), 404
+        def predict_pinned(x: np.ndarray) -> np.ndarray:
+            with tracing.span("inference", model_version=version):
+                return pinned_model.predict_on_batch(x)
+        pred = await asyncio.get_running_loop().run_in_executor(batcher.executor, predict_pinned, x)
+    # one score per knock window
+    result = combine(pred[:, 0], weights)
+
+    durian_class, confidence = LabelUtils.from_score(result)
+    tracing.count_prediction(durian_class, version)
 
     resp = {
         'type': durian_class,
-        'confidence': confidence
+        'confidence': confidence,
+        'segments': len(weights),
+        'model_version': version,
+        'stage': 'full'
     }
+    if keys:
+        result_cache.put(keys, cache_version(version), (resp, sr))
     return resp, 200
 
+@app.post('/classify-batch')
+async def classify_batch():
+    files = await request.files
+    # (name, file type, content) of every recording, archives are unpacked in memory
+    items: list[tuple[str, str, bytes]] = []
+    try:
+        for file in files.getlist('audio'):
+            if audio_io.is_archive(file):
+                items += await asyncio.to_thread(audio_io.unpack_archive, file.read())
+            else:
+                items.append((file.filename or f"audio_{len(items)}", audio_io.file_type(file), file.read()))
+    except audio_io.AudioDecodeError as e:
+        return jsonify({'error': str(e)}), 400
+    if not items:
+        return jsonify({'error': 'No files received'}), 400
+    if len(items) > max_batch_files:
+        return jsonify({'error': f'At most {max_batch_files} recordings per batch, got {len(items)}'}), 413
+
+    # one crate keeps at most one job per worker in the pool, other requests still get in
+    slots = asyncio.Semaphore(pipeline.workers)
+    version_key = cache_version(registry.active_version)
+
+    async def featurize_item(index: int, name: str, file_type: str, data: bytes):
+        """index, name, (inputs, weights, sample rate, cache keys) or the cached response, error"""
+        keys = {"upload": await asyncio.to_thread(upload_digest, data)}
+        if (resp := cached_result("upload", keys["upload"], file_type, version_key)) is not None:
+            return index, name, resp, None
+        async with slots:
+            try:
+                x, weights, sr, keys["pcm"] = await featurize_upload(data)
+            except Exception as e:
+                return index, name, None, e
+        tracing.count_input(file_type, sr)
+        if (resp := cached_result("pcm", keys["pcm"], file_type, version_key)) is not None or (resp := fast_result(x, weights, version_key)) is not None:
+            result_cache.put(keys, version_key, (resp, sr))
+            return index, name, resp, None
+        return index, name, (x, weights, sr, keys), None
+
+    def ndjson(**fields: typing.Any) -> str:
+        return json.dumps(fields) + "\n"
+
+    async def results():
+        tasks = [asyncio.create_task(featurize_item(index, *item)) for index, item in enumerate(items)]
+        featurized: list[tuple[int, str, tuple[np.ndarray, np.ndarray, int, dict[str, str]]]] = []
+        errors = 0
+        try:
+            # failures, cached results and the fast stage's are known before the inference, they are sent first
+            for next_done in asyncio.as_completed(tasks):
+                index, name, inputs, error = await next_done
+                if isinstance(inputs, dict):
+                    yield ndjson(index=index, file=name, **inputs)
+                elif error is None:
+                    featurized.append((index, name, inputs))
+                else:
+                    errors += 1
+                    yield ndjson(index=index, file=name, error=str(error), status=503 if isinstance(error, Overloaded) else 400)
+            if featurized:
+                version = registry.active_version
+                # a single inference call for the whole crate
+                preds: np.ndarray = await batcher.submit(np.concatenate([x for _, _, (x, *_) in featurized]))
+                splits = np.cumsum([len(weights) for _, _, (_, weights, *_) in featurized])[:-1]
+                for (index, name, (_, weights, sr, keys)), pred in zip(featurized, np.split(preds[:, 0], splits)):
+                    durian_class, confidence = LabelUtils.from_score(combine(pred, weights))
+                    tracing.count_prediction(durian_class, version)
+                    resp = {'type': durian_class, 'confidence': confidence, 'segments': len(weights), 'model_version': version, 'stage': 'full'}
+                    result_cache.put(keys, cache_version(version), (resp, sr))
+                    yield ndjson(index=index, file=name, **resp)
+            yield ndjson(done=True, count=len(items), errors=errors)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return results(), 200, {"Content-Type": "application/x-ndjson"}
+
+@app.websocket('/classify-stream')
+# the mobile app isn't a browser and sends no Origin, the stream carries no credentials
+@cors_exempt
+async def classify_stream():
+    # binary messages: raw PCM as it is recorded, any text message (e.g. "end") ends the recording
+    encoding = websocket.args.get("encoding", "s16le")
+    try:
+        session = StreamSession(websocket.args.get("sample_rate", 44100, type=int), encoding, websocket.args.get("channels", 1, type=int))
+    except audio_io.AudioDecodeError as e:
+        await websocket.send(json.dumps({"event": "error", "error": str(e)}))
+        return
+    tracing.count_input(encoding, session.sr)
+
+    async def send_score(event: str):
+        x, weights = session.inputs()
+        version = registry.active_version
+        pred: np.ndarray = await batcher.submit(x)
+        durian_class, confidence = LabelUtils.from_score(combine(pred[:, 0], weights))
+        if event == "final":
+            tracing.count_prediction(durian_class, version)
+        await websocket.send(json.dumps(dict(event=event, type=durian_class, confidence=confidence, knocks=session.knocks, segments=len(weights), seconds=round(session.seconds, 3), model_version=version)))
+
+    while not session.full:
+        message = await websocket.receive()
+        if isinstance(message, str):
+            break
+        # STFT of the new frames only, a few hundred microseconds per chunk
+        if session.feed(message):
+            await send_score("provisional")
+    session.finish()
+    if session.mfcc.n_samples == 0:
+        await websocket.send(json.dumps({"event": "error", "error": "No audio received"}))
+        return
+    await send_score("final")
+
 @app.post('/add-training-data')
 async def add_training_data():
     form: MultiDict[typing.Any, typing.Any] = await request.form
@@ -186,40 +457,69 @@ async def add_training_data():
     
     if label not in LabelUtils.allowed_labels:
         return {"error": f"label must be in : [{", ".join(LabelUtils.allowed_labels)}]"}, 400
-        
-    out_dir: Path = train_submit_dir / f"phase_{training_phase()}"
-    out_dir.mkdir(exist_ok=True)
-    converted: Path = await save_conversion(content, out_dir=out_dir, label=label)
+
+    data = content.read()
+    # checked and stored under the lock, two copies sent together can't both get in
+    async with dedup.lock:
+        try:
+            digest, fingerprint, duplicate = await dedup.find(data, pipeline)
+        except Overloaded as e:
+            return {"error": str(e)}, 503
+        except audio_io.AudioDecodeError as e:
+            return {"error": str(e)}, 400
+        if duplicate is not None:
+            dedup.record(duplicate)
+            body = {"duplicate_of": duplicate.entry, "similarity": duplicate.similarity, "exact": duplicate.exact}
+            if duplicate_policy == "link":
+                return {"message": "duplicate of a stored file, linked to it", **body}, 200
+            return {"error": "duplicate of a stored file", **body}, 409
+
+        phase = training_phase()
+        out_dir: Path = train_submit_dir / f"phase_{phase}"
+        out_dir.mkdir(exist_ok=True)
+        try:
+            converted: Path = await save_canonical(data, out_dir, label, digest)
+        except Overloaded as e:
+            return {"error": str(e)}, 503
+        except audio_io.AudioDecodeError as e:
+            return {"error": str(e)}, 400
+        # featurized now so /train-phase only has to read the stored MFCCs
+        try:
+            await feature_store.add(converted, pipeline, digest)
+        except Overloaded:
+            pass # /train-phase featurizes what is missing from the store
+        except audio_io.AudioDecodeError as e:
+            converted.unlink()
+            return {"error": str(e)}, 400
+        entry = submission_entry(converted, phase)
+        catalog.add([{**entry, "digest": digest, "fingerprint": fingerprint.tobytes()}]) # type: ignore
+        dedup.add(entry["link"], fingerprint) # type: ignore
     return {"message": "file successfully created"}, 200
 
 @app.get('/submitted-training-data')
 async def get_submitted_data():
-    mature_files = train_submit_dir.glob("*_mature.wav")
-    overripe_files = train_submit_dir.glob("*_overripe.wav")
-    
-    def process_file(path: Path):
-        infos = path.stem.split("_")
-        dt = '_'.join(infos[:-1])
-        dt = datetime.datetime.strptime(dt, DateUtils.datetime_storage_pattern).replace(tzinfo=timezone.utc)
-        label = infos[-1]
-        return {
-            "name": path.name,
-            "date": dt.strftime(DateUtils.datetime_response_pattern),
-            "label": label,
-            "size": path.stat().st_size,
-            "link": str(path.relative_to(BASE_DIR))
-        }
-    return [process_file(file) for file in [*mature_files, *overripe_files]], 200
+    try:
+        filters, limit, offset = listing_query()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    entries, total = catalog.submissions(limit, offset, **filters)
+    return entries, 200, {"X-Total-Count": str(total)}
 
 @app.get("/get-audio")
 async def get_file():
     file_path: str | None = request.args.get("url")
     if file_path is None:
         return {"error": f"Missing query parameter \"url\""}, 400
-    full_path = BASE_DIR / Path(file_path)
+    full_path = DATA_DIR / Path(file_path)
     if not full_path.resolve().is_relative_to(train_submit_dir.resolve()):
         return {"error": f"Resource access not allowed for \"{file_path}\""}, 400
-    return await send_file(full_path)
+    # the links of archived submissions keep working, their WAV is cut out of the phase archive
+    source = clip_source(str(full_path.resolve().relative_to(DATA_DIR)))
+    if isinstance(source, ClipRef):
+        wav = await asyncio.to_thread(clip_wav, source)
+        return await send_file(io.BytesIO(wav), mimetype="audio/wav", conditional=True)
+    # conditional: Range requests, the backoffice player seeks without downloading the whole file
+    return await send_file(full_path, conditional=True)
 
 @app.put("/train-phase")
 async def train():
@@ -228,57 +528,152 @@ async def train():
             "Access-Control-Allow-Origin": "http://localhost:5173",
             "Access-Control-Allow-Credentials": "true",
             "Access-Control-Allow-Headers": "Content-Type, Authorization",
-            "Access-Control-Allow-Methods": "GET, POST, PUT, OPTIONS",
+            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
         }
     nb_epochs: int = int(request.args.get("epochs", 10))
     if nb_epochs <= 0:
         return {"error": "epochs must be a positive integer"}, 400
 
-    x_arrays = []
-    y_values = []
-    phase_dir = train_submit_dir / f"phase_{training_phase()}"
-    for entry in tqdm(list(os.scandir(phase_dir))):
-        x_arrays.append(await exec_full_data_pipeline(str(Path(entry.path).absolute()), delete=False))
-        y_values.append(1 if "mature" in entry.name else 0)
-
-    if len(x_arrays) > 0:
-        x = np.array(x_arrays)
-        y = np.array(y_values)
-        def train_model():
-            model.fit(x, y, epochs=nb_epochs, verbose="auto")
-            (train_submit_dir / f"phase_{training_phase() + 1}").mkdir(exist_ok=True)
-        train_model()
-        model.save(model_path(new=True))
-        return {"phase": "complete", "message": "Training complete"}, 200
-    else:
+    if training_jobs.current is not None:
+        return {"error": "A training job is already running", "job": training_jobs.current.to_dict()}, 409
+
+    phase = training_phase()
+    entries, _ = catalog.submissions(phase=phase)
+    paths = [(DATA_DIR / entry["link"]).absolute() for entry in entries]
+    digests = [entry["digest"] for entry in entries]
+    if len(paths) == 0:
         return {"error": "No training data found in the current phase"}, 400
 
-@app.get("/get-phases")
-async def get_phases():
-    def process_file(path: Path):
-        infos = path.stem.split("_")
-        dt = '_'.join(infos[:-1])
-        dt = datetime.datetime.strptime(dt, DateUtils.datetime_storage_pattern).replace(tzinfo=timezone.utc)
-        label = infos[-1]
-        return {
-            "name": path.name,
-            "date": dt.strftime(DateUtils.datetime_response_pattern),
-            "label": label,
-            "size": path.stat().st_size,
-            "link": str(path.relative_to(BASE_DIR))
-        }
+    job = TrainingJob(phase, nb_epochs)
+    training_jobs.start(job, lambda job: train_phase(job, paths, digests))
+    return {"phase": "queued", "message": "Training started", "job": job.to_dict()}, 202
+
+async def archive_phase(phase: int):
+    entries, _ = catalog.submissions(phase=phase)
+    if not entries:
+        return
+    paths = [DATA_DIR / entry["link"] for entry in entries]
+    mfcc_paths = await feature_store.ensure(paths, pipeline, [entry["digest"] for entry in entries])
+    clips = await pipeline.run_training(pack_phase, train_submit_dir / f"phase_{phase}", entries, paths, mfcc_paths)
+    # the catalog points at the archive before the files go away
+    catalog.set_archived(clips)
+    for path in paths:
+        path.unlink(missing_ok=True)
+    print(f"Archived phase {phase}: {len(clips)} clips")
+
+async def archive_closed_phases():
+    """Packs the phases that no longer take submissions, one at a time"""
+    if not archive_phases:
+        return
+    # the fingerprints are computed from the files
+    await dedup.backfilled()
+    async with archive_lock:
+        for phase in catalog.unarchived_phases(below=training_phase()):
+            try:
+                await archive_phase(phase)
+            except Exception as e:
+                print(f"❌ Archiving phase {phase} failed: {e!r}")
+
+async def replay_sources(phase: int, n_new: int) -> list[Source]:
+    """A bounded sample of the submissions of the phases before `phase`, read from their archive or the feature store"""
+    # an archiving phase would remove its files while they are read
+    async with archive_lock:
+        older = [(p, count) for p, count in catalog.phases() if p < phase]
+        sources: list[Source] = []
+        for (p, _), rows in zip(older, replay_rows([count for _, count in older], n_new)):
+            if not len(rows):
+                continue
+            phase_dir = train_submit_dir / f"phase_{p}"
+            if (phase_dir / index_name).exists():
+                if mfcc_current(phase_dir):
+                    sources.append(RowsSource(ShardSource(phase_dir / mfcc_name, phase_dir / labels_name), rows))
+                else:
+                    print(f"Phase {p} archived with other MFCC parameters, not replayed")
+                continue
+            entries, _ = catalog.submissions(phase=p)
+            picked = [DATA_DIR / entries[i]["link"] for i in rows]
+            stored = await feature_store.ensure(picked, pipeline, [entries[i]["digest"] for i in rows])
+            sources.append(FileSource(stored, np.array([1 if "mature" in path.name else 0 for path in picked])))
+    return sources
+
+async def holdout_sources() -> list[Source]:
+    paths, labels = holdout_files()
+    if not paths:
+        print("No held-out recordings, training without early stopping")
+        return []
+    # featurized once, the next phases read them from the store
+    return [FileSource(await feature_store.ensure(paths, pipeline), labels)]
+
+@tracing.traced("train_phase")
+async def train_phase(job: TrainingJob, paths: list[Path], digests: list[str | None]) -> dict[str, typing.Any]:
+    # stored MFCCs, the files featurized by an older config go through the CPU pool,
+    # fit then streams them from the store instead of holding the phase in memory
+    stored = await feature_store.ensure(paths, pipeline, digests)
+    y = np.array([1 if "mature" in path.name else 0 for path in paths])
+    replay = await replay_sources(job.phase, len(paths))
+    holdout = await holdout_sources()
+    job.check_cancelled()
+
+    def train_model():
+        # fine-tune a fresh copy of the active checkpoint, /classify keeps serving the current weights meanwhile
+        trainee: keras.models.Sequential = keras.saving.load_model(registry.path(registry.active_version)) # type: ignore
+        history = fine_tune(trainee, [FileSource(stored, y), *replay], holdout, job.epochs, [ProgressCallback(job)])
+        job.check_cancelled()
+        (train_submit_dir / f"phase_{job.phase + 1}").mkdir(exist_ok=True)
+        catalog.add_phase(job.phase + 1)
+        new_file = registry.new_path()
+        trainee.save(new_file)
+        scores = restored_metrics(history)
+        version = registry.register(new_file, scores)
+        # warmed up here, the batcher picks it up on its next batch
+        registry.activate(version, trainee)
+        return {"model": new_file.name, "version": version, "epochs_run": len(history.epoch), "replayed": sum(len(source) for source in replay), "metrics": scores}
+    result = await pipeline.run_training(train_model)
+    # the phase just trained is closed
+    app.archive_task = asyncio.create_task(archive_closed_phases()) # type: ignore
+    return result
 
-    # Trier les dossiers par leur numéro de phase
-    dirs = sorted(
-        [d for d in train_submit_dir.iterdir() if d.is_dir()],
-        key=lambda p: int(p.name.split("_")[1])
-    )
+@app.get("/train-jobs")
+async def get_train_jobs():
+    return [job.to_dict() for job in training_jobs.jobs.values()], 200
+
+@app.get("/train-jobs/<job_id>")
+async def get_train_job(job_id: str):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}, 404
+    return job.to_dict(), 200
+
+@app.delete("/train-jobs/<job_id>")
+async def cancel_train_job(job_id: str):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}, 404
+    training_jobs.cancel(job)
+    return job.to_dict(), 202
+
+@app.get("/train-jobs/<job_id>/events")
+async def train_job_events(job_id: str):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}, 404
+    response = await make_response(job.stream(), {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    response.timeout = None # type: ignore
+    return response
 
+@app.get("/get-phases")
+async def get_phases():
+    try:
+        filters, limit, offset = listing_query()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    # the page applies to the files of each phase, "count" is the number of matching files
     phases = []
-    for d in dirs:
-        files = [process_file(f) for f in d.glob("*.wav")]
+    for phase, count in catalog.phases(**filters):
+        files, _ = catalog.submissions(limit, offset, **{**filters, "phase": phase})
         phases.append({
-            "name": d.name,
+            "name": f"phase_{phase}",
+            "count": count,
             "files": files
         })
 
@@ -286,9 +681,20 @@ async def get_phases():
 
 @app.get("/get-models")
 async def get_models():
-    models = [f.name for f in models_dir.iterdir() if f.is_file() and f.name.endswith(".keras")]
-    current_model = Path(model_path()).name
-    return {"models": models, "current": current_model}, 200
+    versions = registry.describe()
+    current_model = registry.path(registry.active_version).name # type: ignore
+    return {"models": [v["file"] for v in versions], "current": current_model, "versions": versions}, 200
+
+@app.put("/activate-model")
+async def activate_model():
+    version: int | None = request.args.get("version", type=int)
+    if version is None:
+        return {"error": "Missing query parameter 'version'"}, 400
+    if version not in registry.versions:
+        return {"error": "Model not found"}, 404
+    # loading and warm-up take a few seconds, /classify keeps the old model until the swap
+    await asyncio.to_thread(registry.activate, version)
+    return {"current": registry.path(version).name}, 200
 
 @app.get("/get-model")
 async def get_model():
@@ -300,12 +706,17 @@ async def get_model():
         return {"error": "Model not found"}, 404
     return await send_file(model_path)
 
+@app.get("/metrics")
+async def get_metrics():
+    return tracing.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
 @app.get("/")
 async def home():
     return await send_file(BASE_DIR / "front/index.html")
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+    # the reloader would import and load everything twice, DURIAN_RELOAD=1 for development
+    app.run(host='0.0.0.0', port=int(os.environ.get("DURIAN_PORT", 5001)), use_reloader=os.environ.get("DURIAN_RELOAD") == "1")
 
 
 
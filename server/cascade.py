@@ -0,0 +1,95 @@
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+import numpy as np
+
+from segmentation import combine
+
+# DURIAN_CASCADE=0 sends every recording to the full model
+cascade_enabled = os.environ.get("DURIAN_CASCADE", "1") == "1"
+# the fast stage answers alone where its out-of-fold accuracy is at least this
+target_accuracy = float(os.environ.get("DURIAN_CASCADE_ACCURACY", 0.97))
+
+def pooled_stats(x: np.ndarray) -> np.ndarray:
+    """(n, n_mfcc, max_t[, 1]) MFCC windows -> (n, 2 * n_mfcc) mean and standard deviation of each coefficient over time"""
+    x = x.reshape(len(x), x.shape[1], -1)
+    return np.concatenate([x.mean(axis=2), x.std(axis=2)], axis=1).astype(np.float32)
+
+def fit_logistic(f: np.ndarray, y: np.ndarray, sample_weight: np.ndarray | None = None, l2: float = 1e-2, steps: int = 2000, lr: float = 0.5) -> dict[str, np.ndarray]:
+    """L2-regularized logistic regression by full-batch gradient descent on standardized features"""
+    mean, scale = f.mean(axis=0), f.std(axis=0) + 1e-6
+    z = (f - mean) / scale
+    sw = np.ones(len(y)) if sample_weight is None else sample_weight / sample_weight.mean()
+    w, b = np.zeros(z.shape[1]), 0.0
+    for _ in range(steps):
+        p = 1 / (1 + np.exp(-(z @ w + b)))
+        error = (p - y) * sw
+        w -= lr * (z.T @ error / len(y) + l2 * w)
+        b -= lr * error.mean()
+    return {"mean": mean, "scale": scale, "weights": w, "bias": np.array(b)}
+
+def predict_logistic(params: dict[str, np.ndarray], f: np.ndarray) -> np.ndarray:
+    z = (f - params["mean"]) / params["scale"]
+    return 1 / (1 + np.exp(-(z @ params["weights"] + params["bias"])))
+
+def calibrate(scores: np.ndarray, y: np.ndarray, target: float = target_accuracy) -> float:
+    """Lowest confidence from which the scores are at least `target` accurate, 1.0 (never confident) if none is"""
+    confidence = np.maximum(scores, 1 - scores)
+    correct = (scores > 0.5) == y
+    order = np.argsort(-confidence)
+    # accuracy of the k most confident recordings, for every k
+    running = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+    passing = np.flatnonzero(running >= target)
+    if len(passing) == 0:
+        return 1.0
+    # ties: every recording at the threshold confidence is answered
+    return float(confidence[order][passing[-1]])
+
+class Cascade:
+    """
+    First stage of /classify: a logistic regression on pooled MFCC statistics
+    answers the recordings it is confident about (threshold calibrated by
+    convert.py), only the others go through the full model.
+    """
+
+    def __init__(self, params: dict[str, np.ndarray], threshold: float):
+        self.params = params
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, path: Path) -> "Cascade | None":
+        if not path.exists():
+            return None
+        saved = json.loads(path.read_text())
+        return cls({k: np.asarray(saved[k], dtype=np.float64) for k in ("mean", "scale", "weights", "bias")}, saved["threshold"])
+
+    def save(self, path: Path, **report: Any):
+        path.write_text(json.dumps({**{k: v.tolist() for k, v in self.params.items()}, "threshold": self.threshold, **report}, indent=1))
+
+    def scores(self, x: np.ndarray) -> np.ndarray:
+        return predict_logistic(self.params, pooled_stats(x))
+
+    def decide(self, x: np.ndarray, weights: np.ndarray) -> float | None:
+        """Score of the recording whose windows are `x` when the fast stage is confident, None to run the full model"""
+        score = combine(self.scores(x), weights)
+        return score if max(score, 1 - score) >= self.threshold else None
+
+def cascade_path(model_path: Path) -> Path:
+    """<model stem>.cascade.json next to the model, shared by its ONNX, quantized and ORT variants"""
+    stem = re.sub(r"(\.int8-(dynamic|static))?\.(onnx|ort|keras)$", "", model_path.name)
+    return model_path.with_name(f"{stem}.cascade.json")
+
+@lru_cache(maxsize=8)
+def load_cascade(path: Path, mtime_ns: int) -> Cascade | None:
+    # keyed on the modification time: a file convert.py writes or rewrites is picked up without a restart
+    return Cascade.load(path)
+
+def cascade_mtime(path: Path) -> int | None:
+    """Modification time of the fast stage saved at `path`, None when there is none"""
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any
+
+schema = """
+CREATE TABLE IF NOT EXISTS phases (
+    phase INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id         INTEGER PRIMARY KEY,
+    name       TEXT NOT NULL,
+    link       TEXT NOT NULL UNIQUE,
+    phase      INTEGER NOT NULL,
+    label      TEXT NOT NULL,
+    date       TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    digest     TEXT,
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    fingerprint BLOB,
+    clip_offset INTEGER,
+    clip_frames INTEGER
+);
+CREATE INDEX IF NOT EXISTS submissions_phase ON submissions (phase, label, date);
+CREATE INDEX IF NOT EXISTS submissions_label ON submissions (label, date);
+CREATE INDEX IF NOT EXISTS submissions_date ON submissions (date);
+"""
+
+# added after the first catalogs were created
+migrations = {
+    "digest": "ALTER TABLE submissions ADD COLUMN digest TEXT",
+    "duplicates": "ALTER TABLE submissions ADD COLUMN duplicates INTEGER NOT NULL DEFAULT 0",
+    "fingerprint": "ALTER TABLE submissions ADD COLUMN fingerprint BLOB",
+    "clip_offset": "ALTER TABLE submissions ADD COLUMN clip_offset INTEGER",
+    "clip_frames": "ALTER TABLE submissions ADD COLUMN clip_frames INTEGER",
+}
+digest_index = "CREATE INDEX IF NOT EXISTS submissions_digest ON submissions (digest)"
+
+columns = ("name", "link", "phase", "label", "date", "size", "digest", "duplicates")
+
+class Catalog:
+    """
+    Training submissions and phases in SQLite, so the listings are index lookups
+    instead of directory scans. Dates are stored as "%Y-%m-%dT%H:%M:%SZ" strings,
+    which sort chronologically. Shared by the event loop and the training thread.
+    """
+
+    def __init__(self, db_path: Path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(schema)
+            existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(submissions)")}
+            for column, statement in migrations.items():
+                if column not in existing:
+                    self.conn.execute(statement)
+            self.conn.execute(digest_index)
+            # refreshes the planner statistics the indexes are chosen with
+            self.conn.execute("PRAGMA optimize")
+
+    def add_phase(self, phase: int):
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO phases (phase) VALUES (?)", (phase,))
+
+    def add(self, entries: list[dict[str, Any]]):
+        """
+        Submissions with the keys of `columns` (digest, duplicates and a summary
+        "fingerprint" are optional), their phases are created if needed
+        """
+        written = (*columns, "fingerprint")
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO phases (phase) VALUES (?)", {(entry["phase"],) for entry in entries})
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO submissions ({', '.join(written)}) VALUES ({', '.join('?' * len(written))})",
+                [tuple(entry.get(column, 0 if column == "duplicates" else None) for column in written) for entry in entries],
+            )
+            self.conn.execute("COMMIT")
+
+    def _one(self, where: str, value: Any) -> dict[str, Any] | None:
+        with self.lock:
+            row = self.conn.execute(f"SELECT {', '.join(columns)} FROM submissions WHERE {where} = ? LIMIT 1", (value,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(self, digest: str) -> dict[str, Any] | None:
+        return self._one("digest", digest)
+
+    def get(self, link: str) -> dict[str, Any] | None:
+        return self._one("link", link)
+
+    def link_duplicate(self, link: str):
+        with self.lock:
+            self.conn.execute("UPDATE submissions SET duplicates = duplicates + 1 WHERE link = ?", (link,))
+
+    def fingerprints(self) -> list[tuple[str, bytes]]:
+        with self.lock:
+            return [(row[0], row[1]) for row in self.conn.execute("SELECT link, fingerprint FROM submissions WHERE length(fingerprint) > 0")]
+
+    def without_fingerprint(self, limit: int) -> list[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT link FROM submissions WHERE fingerprint IS NULL LIMIT ?", (limit,))]
+
+    def set_fingerprint(self, link: str, digest: str | None, fingerprint: bytes):
+        # archived clips have no file to hash, they keep the digest they were stored with
+        with self.lock:
+            self.conn.execute("UPDATE submissions SET digest = COALESCE(?, digest), fingerprint = ? WHERE link = ?", (digest, fingerprint, link))
+
+    def clip(self, link: str) -> tuple[int, int, int] | None:
+        """(phase, offset, frames) of an archived submission, None while it is a file"""
+        with self.lock:
+            row = self.conn.execute("SELECT phase, clip_offset, clip_frames FROM submissions WHERE link = ? AND clip_frames IS NOT NULL", (link,)).fetchone()
+        return tuple(row) if row is not None else None # type: ignore
+
+    def set_archived(self, clips: list[dict[str, Any]]):
+        """Submissions now read from their phase archive, with the size of the WAV served for them"""
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE submissions SET clip_offset = ?, clip_frames = ?, size = ? WHERE link = ?",
+                [(clip["offset"], clip["frames"], clip["size"], clip["link"]) for clip in clips],
+            )
+
+    def unarchived_phases(self, below: int) -> list[int]:
+        """Closed phases none of whose submissions are archived yet"""
+        with self.lock:
+            rows = self.conn.execute("SELECT phase FROM submissions WHERE phase < ? GROUP BY phase HAVING COUNT(clip_frames) = 0 ORDER BY phase", (below,))
+            return [row[0] for row in rows]
+
+    def current_phase(self) -> int | None:
+        with self.lock:
+            return self.conn.execute("SELECT MAX(phase) FROM phases").fetchone()[0]
+
+    @staticmethod
+    def _filters(phase: int | None = None, label: str | None = None, since: str | None = None, until: str | None = None) -> tuple[list[str], list[Any]]:
+        conditions, params = [], []
+        for condition, value in (("phase = ?", phase), ("label = ?", label), ("date >= ?", since), ("date < ?", until)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return conditions, params
+
+    def submissions(self, limit: int | None = None, offset: int = 0, **filters: Any) -> tuple[list[dict[str, Any]], int]:
+        """A page of the matching submissions, oldest first, and the number of matches"""
+        conditions, params = self._filters(**filters)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM submissions {where}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT {', '.join(columns)} FROM submissions {where} ORDER BY date, id LIMIT ? OFFSET ?",
+                [*params, -1 if limit is None else limit, offset],
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def phases(self, **filters: Any) -> list[tuple[int, int]]:
+        """Every phase, even empty ones, with its number of matching submissions"""
+        conditions, params = self._filters(**{k: v for k, v in filters.items() if k != "phase"})
+        join = "".join(f" AND s.{condition}" for condition in conditions)
+        phase = filters.get("phase")
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT p.phase, COUNT(s.id) FROM phases p LEFT JOIN submissions s ON s.phase = p.phase{join}"
+                f"{' WHERE p.phase = ?' if phase is not None else ''} GROUP BY p.phase ORDER BY p.phase",
+                [*params, *([phase] if phase is not None else [])],
+            ).fetchall()
+        return [(row[0], row[1]) for row in rows]
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+import numpy as np
+
+import audio_io
+import metrics
+from audio_archive import ClipRef, load_source
+from catalog import Catalog
+from executors import Overloaded
+from features import dct_matrix, frame, log_mel_frames, max_t
+from resample import load_canonical
+
+# DURIAN_DUPLICATES=reject answers 409 to a duplicate upload, link counts it on the
+# stored file (catalog "duplicates") and answers 200, neither stores it again
+duplicate_policy = os.environ.get("DURIAN_DUPLICATES", "reject")
+
+# Calibrated on clean/AUDIO_DATA: distinct recordings align at <= 0.89, the same
+# recording re-encoded (aac 64k), at half gain, with noise or trimmed by 50 ms at >= 0.95
+near_threshold   = float(os.environ.get("DURIAN_NEAR_DUPLICATE_THRESHOLD", 0.93))
+floor_db         = 45.0   # below the peak, the noise floor between knocks is left out
+n_coeffs         = 20     # c1..c20, c0 is the loudness
+n_bins           = 8      # time bins of the compact summary
+max_lag          = 8      # frames (~90 ms) of misalignment tolerated by the comparison
+n_candidates     = 5      # nearest summaries compared in full
+coarse_threshold = 0.95   # summary similarity below which a stored file is not a candidate
+backfill_chunk   = 64
+
+duplicates_total = metrics.Counter("durian_duplicates_total", "Training uploads found to duplicate a stored file, by kind (exact, near) and action")
+
+class Duplicate(NamedTuple):
+    entry: dict[str, Any]
+    similarity: float
+    exact: bool
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+# --- functions run in the worker processes
+
+def cepstrum(y: np.ndarray, sr: int) -> np.ndarray:
+    """(frames, n_coeffs) MFCC of the first max_t frames, gain independent and mean removed per coefficient"""
+    log_mel = log_mel_frames([frame(y)], sr)[:max_t]
+    log_mel = np.maximum(log_mel - log_mel.max(), -floor_db)
+    m = (log_mel @ dct_matrix(n_coeffs + 1).T)[:, 1:]
+    return m - m.mean(axis=0)
+
+def summary(m: np.ndarray) -> np.ndarray:
+    """Compact fingerprint: the cepstrum averaged over n_bins spans, unit norm (n_bins * n_coeffs floats)"""
+    edges = np.linspace(0, len(m), n_bins + 1).astype(int)
+    v = np.stack([m[a:max(b, a + 1)].mean(axis=0) for a, b in zip(edges[:-1], edges[1:])]).ravel()
+    v = v - v.mean()
+    norm = np.linalg.norm(v)
+    return (v / norm if norm > 0 else v).astype(np.float32)
+
+def similarity(a: np.ndarray, b: np.ndarray, max_lag: int = max_lag) -> float:
+    """Best cosine of two cepstra over the time shifts up to max_lag frames"""
+    best = -1.0
+    for lag in range(-max_lag, max_lag + 1):
+        x, y = a[max(lag, 0):], b[max(-lag, 0):]
+        n = min(len(x), len(y))
+        if n == 0:
+            continue
+        x, y = x[:n].ravel(), y[:n].ravel()
+        denominator = np.linalg.norm(x) * np.linalg.norm(y)
+        if denominator > 0:
+            best = max(best, float(x @ y / denominator))
+    return best
+
+def fingerprint(data: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """uploaded bytes -> (summary, cepstrum)"""
+    m = cepstrum(*load_canonical(data))
+    return summary(m), m
+
+def compare_files(m: np.ndarray, sources: list[str | ClipRef]) -> list[float]:
+    scores = []
+    for source in sources:
+        try:
+            scores.append(similarity(m, cepstrum(*load_source(source))))
+        except (OSError, audio_io.AudioDecodeError):
+            scores.append(-1.0)
+    return scores
+
+def fingerprint_files(sources: list[str | ClipRef]) -> list[tuple[str | None, np.ndarray] | None]:
+    out = []
+    for source in sources:
+        try:
+            if isinstance(source, ClipRef):
+                # the bytes it was uploaded as are gone, the catalog keeps their digest
+                out.append((None, summary(cepstrum(*load_source(source)))))
+                continue
+            data = Path(source).read_bytes()
+            out.append((content_digest(data), summary(cepstrum(*load_canonical(data)))))
+        except (OSError, audio_io.AudioDecodeError):
+            out.append(None)
+    return out
+
+# ---
+
+class SummaryIndex:
+    """Summaries of the stored files in one growing matrix, searched by cosine similarity"""
+
+    def __init__(self):
+        self.links: list[str] = []
+        self.matrix = np.empty((64, n_bins * n_coeffs), dtype=np.float32)
+
+    def add(self, link: str, vector: np.ndarray):
+        if len(self.links) == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+        self.matrix[len(self.links)] = vector
+        self.links.append(link)
+
+    def nearest(self, vector: np.ndarray, k: int = n_candidates, threshold: float = coarse_threshold) -> list[str]:
+        scores = self.matrix[:len(self.links)] @ vector
+        best = np.argsort(scores)[::-1][:k]
+        return [self.links[i] for i in best if scores[i] >= threshold]
+
+class Deduplicator:
+    """
+    Finds the stored training file an upload duplicates: the same bytes (content
+    hash in the catalog), or the same recording re-encoded, at another gain or
+    slightly trimmed (nearest summaries, then aligned cepstra compared in full).
+    Uploads hold `lock` from the check until they are in the catalog.
+    """
+
+    def __init__(self, catalog: Catalog, base_dir: Path, source: Callable[[str], str | ClipRef] | None = None):
+        self.catalog = catalog
+        self.base_dir = base_dir
+        # where the audio of a catalog link is read from, its file unless told otherwise
+        self.source = source or (lambda link: str(base_dir / link))
+        self.index = SummaryIndex()
+        for link, blob in catalog.fingerprints():
+            self.index.add(link, np.frombuffer(blob, dtype=np.float32))
+        self.lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def find(self, data: bytes, pipeline) -> tuple[str, np.ndarray | None, Duplicate | None]:
+        """(content digest, summary, duplicate or None), raises AudioDecodeError"""
+        digest = content_digest(data)
+        if (entry := self.catalog.find(digest)) is not None:
+            return digest, None, Duplicate(entry, 1.0, True)
+        vector, m = await pipeline.run("fingerprint", fingerprint, data)
+        links = self.index.nearest(vector)
+        if links:
+            scores = await pipeline.run("fingerprint", compare_files, m, [self.source(link) for link in links])
+            best = int(np.argmax(scores))
+            if scores[best] >= near_threshold and (entry := self.catalog.get(links[best])) is not None:
+                return digest, vector, Duplicate(entry, round(scores[best], 4), False)
+        return digest, vector, None
+
+    def record(self, duplicate: Duplicate):
+        duplicates_total.inc(kind="exact" if duplicate.exact else "near", action=duplicate_policy)
+        if duplicate_policy == "link":
+            self.catalog.link_duplicate(duplicate.entry["link"])
+
+    def add(self, link: str, vector: np.ndarray):
+        self.index.add(link, vector)
+
+    async def backfill(self, pipeline):
+        """Digest and summary of the files stored before the catalog had them"""
+        while links := self.catalog.without_fingerprint(backfill_chunk):
+            try:
+                results = await pipeline.run("fingerprint", fingerprint_files, [self.source(link) for link in links])
+            except Overloaded:
+                await asyncio.sleep(1)
+                continue
+            for link, result in zip(links, results):
+                if result is None:
+                    # unreadable or missing, an empty fingerprint keeps it out of the next rounds
+                    self.catalog.set_fingerprint(link, None, b"")
+                    continue
+                digest, vector = result
+                self.catalog.set_fingerprint(link, digest, vector.tobytes())
+                self.index.add(link, vector)
+
+    async def start(self, pipeline):
+        self._task = asyncio.create_task(self.backfill(pipeline))
+
+    async def backfilled(self):
+        """Returns once every stored file has its fingerprint"""
+        if self._task is not None:
+            await asyncio.wait([self._task])
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,165 @@
+import asyncio
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable
+import numpy as np
+
+import audio_io
+import metrics
+from features import compute_mfcc, compute_mfcc_batch, get_mfcc_fixed
+from resample import load_canonical, to_canonical
+from segmentation import segment_mfcc
+
+# DURIAN_EXECUTOR=process|thread, processes need fork: with spawn every worker would
+# re-import the server script and load its model (Windows dev machines get threads)
+executor_kind = os.environ.get("DURIAN_EXECUTOR", "process" if "fork" in multiprocessing.get_all_start_methods() else "thread")
+cpu_workers = int(os.environ.get("DURIAN_CPU_WORKERS", os.cpu_count() or 1))
+# requests waiting for or running in a CPU stage before the server answers 503
+max_pending = int(os.environ.get("DURIAN_MAX_PENDING", 64))
+
+stage_seconds = metrics.Histogram("durian_stage_seconds", "Time spent in each pipeline stage, queueing included", buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 120, 600))
+pending_gauge = metrics.Gauge("durian_pending_jobs", "Jobs waiting for or running on the CPU pool")
+rejected_total = metrics.Counter("durian_rejected_total", "Requests rejected with 503 because the CPU pool was full")
+broken_total = metrics.Counter("durian_pool_broken_total", "Times a CPU worker died and the pool was forked again")
+
+class Overloaded(Exception):
+    pass
+
+# --- functions run in the worker processes, they must stay importable and picklable
+
+def featurize(data: bytes) -> tuple[np.ndarray, int, str]:
+    """uploaded bytes -> (40, max_t) MFCC, the sample rate it was decoded at and the digest of the canonical signal"""
+    y, native_sr = audio_io.decode(data)
+    y, sr = to_canonical(y, native_sr)
+    return get_mfcc_fixed(compute_mfcc(y, sr)), native_sr, audio_io.pcm_digest(y, sr)
+
+def featurize_segments(data: bytes) -> tuple[np.ndarray, np.ndarray, int, str]:
+    """uploaded bytes -> (n_windows, 40, max_t) knock windows, their weights, the sample rate it was decoded at and the digest of the canonical signal"""
+    y, native_sr = audio_io.decode(data)
+    y, sr = to_canonical(y, native_sr)
+    windows, weights = segment_mfcc(y, sr)
+    return windows, weights, native_sr, audio_io.pcm_digest(y, sr)
+
+def featurize_files(paths: list[str]) -> list[np.ndarray]:
+    clips = [load_canonical(Path(path).read_bytes()) for path in paths]
+    return [get_mfcc_fixed(m) for m in compute_mfcc_batch(clips)]
+
+def canonical_wav(data: bytes) -> bytes:
+    """uploaded bytes -> 16-bit PCM WAV at the canonical rate, how training files are stored (and archived)"""
+    return audio_io.encode_wav(*load_canonical(data))
+
+def load_audio(path: str) -> tuple[np.ndarray, int]:
+    """DURIAN_TEMP_FILES path: a converted file read by librosa, at the canonical rate"""
+    # librosa (numba, scipy) is only imported by this path
+    import librosa
+    y, sr = librosa.load(path, sr=None)
+    return to_canonical(y, sr)
+
+def pcm_mfcc(y: np.ndarray, sr: int) -> np.ndarray:
+    """signal -> (40, max_t) MFCC, the model input of the DURIAN_TEMP_FILES path"""
+    return get_mfcc_fixed(compute_mfcc(y, sr))
+
+def convert_to_wav(src: str, dst: str, file_type: str):
+    from pydub import AudioSegment
+    sound = AudioSegment.from_file(src, format=file_type)
+    os.remove(src)
+    sound.export(dst, format='wav')
+
+# ---
+
+class Pipeline:
+    """
+    Runs the CPU bound stages (decode, MFCC, conversion) out of the event loop on a
+    process pool, and training on its own thread. Inference has its own thread in
+    the MicroBatcher. Every call is timed per stage.
+    """
+
+    def __init__(self, workers: int = cpu_workers, max_pending: int = max_pending, kind: str = executor_kind):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.kind = kind
+        self.pool: Executor | None = None
+        self.training = ThreadPoolExecutor(max_workers=1, thread_name_prefix="training")
+        self.pending = 0
+
+    def fork(self):
+        """
+        Forks the worker processes now. The servers call it at import, before the
+        model is loaded and before any thread is started: a fork copies the locks
+        other threads hold (TensorFlow's and ONNX Runtime's thread pools, the
+        batcher, the import lock) and the worker deadlocks on the first it needs.
+        A fork pool starts all its workers on its first job, submitted here.
+        """
+        if self.kind == "process" and self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+            self.pool.submit(os.getpid).result()
+
+    def start(self):
+        self.fork()
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.training.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, stage: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run `fn(*args)` on the CPU pool, raises Overloaded when too many jobs are queued or a worker died"""
+        if self.pending >= self.max_pending:
+            rejected_total.inc()
+            raise Overloaded(f"Server busy, {self.pending} jobs pending")
+        self.pending += 1
+        pending_gauge.set(self.pending)
+        try:
+            pool = self.pool
+            with timed(stage):
+                return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool as e:
+            # a dead worker (killed, out of memory) fails the pool for good: a server fault, not the upload's
+            self.replace(pool)
+            raise Overloaded(f"CPU worker lost, retry: {e}") from e
+        finally:
+            self.pending -= 1
+            pending_gauge.set(self.pending)
+
+    def replace(self, broken: Executor | None):
+        """
+        Forks a new pool in place of a broken one. Unlike at import, the server's
+        threads are running by now (see fork): the lesser evil next to a server
+        that fails every request until restarted.
+        """
+        if broken is None or self.pool is not broken:
+            return  # replaced already by a concurrent request
+        broken_total.inc()
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool = None
+        self.fork()
+
+    async def run_training(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with timed("training"):
+            return await asyncio.get_running_loop().run_in_executor(self.training, fn, *args)
+
+    async def featurize_files(self, paths: list[str]) -> list[np.ndarray]:
+        # one batched MFCC call per worker
+        chunks = [paths[i::self.workers] for i in range(self.workers) if paths[i::self.workers]]
+        results = await asyncio.gather(*[self.run("featurize_files", featurize_files, chunk) for chunk in chunks])
+        # undo the round robin split
+        ordered: list[np.ndarray] = [np.empty(0)] * len(paths)
+        for i, chunk_result in enumerate(results):
+            ordered[i::len(chunks)] = chunk_result
+        return ordered
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
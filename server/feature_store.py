@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any
+import numpy as np
+
+import features
+import metrics
+from resample import canonical_sr
+
+store_dtype = np.dtype(os.environ.get("DURIAN_FEATURE_DTYPE", "float16"))
+
+hits_total = metrics.Counter("durian_feature_store_hits_total", "Training files whose MFCC was read from the feature store")
+misses_total = metrics.Counter("durian_feature_store_misses_total", "Training files featurized because they were not in the store")
+
+def feature_config() -> dict[str, Any]:
+    return {
+        "n_mfcc": features.n_mfcc,
+        "n_fft": features.n_fft,
+        "hop_length": features.hop_length,
+        "n_mels": features.n_mels,
+        "max_t": features.max_t,
+        "sample_rate": canonical_sr,
+    }
+
+def file_digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+class FeatureStore:
+    """
+    MFCCs (n_mfcc, max_t) of the training files, keyed by the audio content hash.
+    Entries live under a directory named after the feature parameters, so changing
+    any of them starts a fresh store and everything is featurized again once.
+    Normalized MFCCs are in [-1, 1], float16 keeps them within ~5e-4.
+    """
+
+    def __init__(self, root: Path, dtype: np.dtype = store_dtype):
+        config = feature_config()
+        config_key = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+        self.dir = root / config_key
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.dtype = dtype
+        (self.dir / "config.json").write_text(json.dumps(config, indent=2))
+
+    def path(self, digest: str) -> Path:
+        return self.dir / digest[:2] / f"{digest}.npy"
+
+    def get(self, digest: str) -> np.ndarray | None:
+        path = self.path(digest)
+        if not path.exists():
+            return None
+        return np.load(path).astype(np.float32)
+
+    def put(self, digest: str, mfcc: np.ndarray):
+        path = self.path(digest)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, mfcc.astype(self.dtype))
+        os.replace(tmp_path, path)
+
+    def lookup(self, paths: list[Path], digests: list[str | None]) -> tuple[list[str], list[int]]:
+        """
+        Digests of `paths` and the indices of those not stored yet. Only the files
+        without a known digest (the catalog's, taken at ingest) are read and hashed:
+        run off the event loop.
+        """
+        digests = [digest or file_digest(path) for path, digest in zip(paths, digests)]
+        return digests, [i for i, digest in enumerate(digests) if not self.path(digest).exists()]
+
+    async def add(self, path: Path, pipeline, digest: str | None = None) -> str:
+        """Featurize a newly accepted file unless the same audio is already stored"""
+        [digest], missing = await asyncio.to_thread(self.lookup, [path], [digest])
+        if missing:
+            [mfcc] = await pipeline.featurize_files([str(path)])
+            await asyncio.to_thread(self.put, digest, mfcc)
+        return digest
+
+    async def ensure(self, paths: list[Path], pipeline, digests: list[str | None] | None = None, chunk_size: int = 64) -> list[Path]:
+        """
+        Store files of the MFCCs of `paths`, featurizing the missing ones chunk by
+        chunk so only `chunk_size` MFCCs are ever held in memory
+        """
+        digests, missing = await asyncio.to_thread(self.lookup, paths, digests or [None] * len(paths))
+        hits_total.inc(len(paths) - len(missing))
+        misses_total.inc(len(missing))
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            computed = await pipeline.featurize_files([str(paths[i]) for i in chunk])
+            await asyncio.to_thread(lambda: [self.put(digests[i], mfcc) for i, mfcc in zip(chunk, computed)])
+        return [self.path(digest) for digest in digests]
+
+    async def features_for(self, paths: list[Path], pipeline, digests: list[str | None] | None = None) -> list[np.ndarray]:
+        """MFCCs of `paths`, only the files missing from the store go through the pipeline"""
+        stored = await self.ensure(paths, pipeline, digests)
+        return await asyncio.to_thread(lambda: [np.load(path).astype(np.float32) for path in stored])
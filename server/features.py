@@ -0,0 +1,245 @@
+from functools import lru_cache
+import numpy as np
+
+# MFCC parameters used to train the models (data_preparation.ipynb)
+n_mfcc     = 40        # number of coefficients
+n_fft      = 2048      # window size STFT
+hop_length = 512
+n_mels     = 128       # librosa default
+top_db     = 80.0      # librosa.power_to_db default
+max_t      = 273       # value found in the data_preparation.py notebook
+
+# max abs difference allowed against librosa.feature.mfcc + librosa.util.normalize
+tolerance = 1e-3
+
+# number of STFT frames sent to one rfft call, keeps the temporary buffers in cache
+frames_per_chunk = 256
+
+# The engine reproduces librosa.feature.mfcc (center=True, constant padding,
+# slaney mel filters, power_to_db with top_db=80, orthonormal DCT-II) as plain
+# matrix products. The window, mel basis and DCT matrix only depend on the
+# parameters above and the sample rate, so they are built once and cached.
+
+@lru_cache
+def fft_module():
+    # imported on first use, scipy.fft alone costs ~0.2s of server start-up
+    try:
+        # scipy's pocketfft keeps float32 and is several times faster than numpy's
+        from scipy import fft
+        return fft
+    except ImportError:
+        return np.fft
+
+@lru_cache
+def hann_window(size: int = n_fft) -> np.ndarray:
+    # periodic Hann window, same as scipy.signal.get_window("hann", size, fftbins=True)
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(size) / size)).astype(np.float32)
+
+def _hz_to_mel(freqs: np.ndarray) -> np.ndarray:
+    # Slaney formula: linear below 1 kHz, logarithmic above
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    mels = freqs / f_sp
+    return np.where(freqs >= min_log_hz, min_log_mel + np.log(np.maximum(freqs, min_log_hz) / min_log_hz) / logstep, mels)
+
+def _mel_to_hz(mels: np.ndarray) -> np.ndarray:
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    freqs = f_sp * mels
+    return np.where(mels >= min_log_mel, min_log_hz * np.exp(logstep * (mels - min_log_mel)), freqs)
+
+@lru_cache
+def mel_basis(sr: int, size: int = n_fft, bands: int = n_mels) -> np.ndarray:
+    fft_freqs = np.linspace(0, sr / 2, 1 + size // 2)
+    mel_f = _mel_to_hz(np.linspace(_hz_to_mel(np.float64(0)), _hz_to_mel(np.float64(sr / 2)), bands + 2))
+    fdiff = np.diff(mel_f)
+    ramps = np.subtract.outer(mel_f, fft_freqs)
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    enorm = 2.0 / (mel_f[2:bands + 2] - mel_f[:bands])
+    return (weights * enorm[:, None]).astype(np.float32)
+
+@lru_cache
+def dct_matrix(n_out: int = n_mfcc, n_in: int = n_mels) -> np.ndarray:
+    # orthonormal DCT-II, same as scipy.fft.dct(type=2, norm="ortho")
+    k = np.arange(n_out)[:, None]
+    n = np.arange(n_in)[None, :]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2 * n_in)) * np.sqrt(2.0 / n_in)
+    basis[0] /= np.sqrt(2.0)
+    return basis.astype(np.float32)
+
+def frame(y: np.ndarray) -> np.ndarray:
+    # centered frames as a strided view on the padded signal: (n_frames, n_fft)
+    padded = np.pad(y.astype(np.float32, copy=False), n_fft // 2)
+    return np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length]
+
+def log_mel_frames(frames: list[np.ndarray], sr: int) -> np.ndarray:
+    """
+    Framed clips (n_frames_i, n_fft) -> (sum n_frames_i, n_mels) log-power mel
+    spectrum, without the top_db clipping. The strided frame views are read chunk
+    by chunk so the frames are never materialized all at once.
+    """
+    window = hann_window()
+    basis_t = mel_basis(sr).T
+    out = np.empty((sum(f.shape[0] for f in frames), basis_t.shape[1]), dtype=np.float32)
+    row = 0
+    for clip_frames in frames:
+        for start in range(0, clip_frames.shape[0], frames_per_chunk):
+            chunk = clip_frames[start:start + frames_per_chunk]
+            spec = fft_module().rfft(chunk * window, axis=1)
+            power = (spec.real ** 2 + spec.imag ** 2).astype(np.float32, copy=False)
+            np.matmul(power, basis_t, out=out[row:row + chunk.shape[0]])
+            row += chunk.shape[0]
+    np.maximum(out, 1e-10, out=out)
+    np.log10(out, out=out)
+    out *= 10.0
+    return out
+
+def compute_mfcc_batch(clips: list[tuple[np.ndarray, int]]) -> list[np.ndarray]:
+    """
+    Normalized MFCCs, shape (n_mfcc, n_frames), for many (signal, sample rate)
+    clips at once. Clips sharing a sample rate go through one STFT/mel/DCT pass.
+    """
+    results: list[np.ndarray] = [np.empty(0)] * len(clips)
+    by_sr: dict[int, list[int]] = {}
+    for i, (_, sr) in enumerate(clips):
+        by_sr.setdefault(int(sr), []).append(i)
+
+    for sr, indices in by_sr.items():
+        frames = [frame(clips[i][0]) for i in indices]
+        counts = np.array([f.shape[0] for f in frames])
+
+        mfcc = mfcc_from_log_mel(log_mel_frames(frames, sr), counts)
+        for i, m in zip(indices, np.split(mfcc, np.cumsum(counts)[:-1])):
+            results[i] = np.ascontiguousarray(m.T)
+    return results
+
+def mfcc_from_log_mel(log_mel: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Stacked log-mel blocks (sum counts, n_mels) -> normalized MFCC frames
+    (sum counts, n_mfcc), each block of `counts[i]` frames clipped and
+    normalized on its own like a separate clip. `log_mel` is modified in place.
+    """
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    # power_to_db clips each clip at top_db below its own maximum
+    clip_max = np.maximum.reduceat(log_mel.max(axis=1), offsets)
+    np.maximum(log_mel, np.repeat(clip_max - top_db, counts)[:, None], out=log_mel)
+
+    mfcc = log_mel @ dct_matrix().T
+    # librosa.util.normalize(axis=1): scale each coefficient by its max over the clip
+    peak = np.maximum.reduceat(np.abs(mfcc), offsets, axis=0)
+    peak[peak < np.finfo(np.float32).tiny] = 1.0
+    mfcc /= np.repeat(peak, counts, axis=0)
+    return mfcc
+
+def compute_mfcc(y: np.ndarray, sr: int) -> np.ndarray:
+    return compute_mfcc_batch([(y, sr)])[0]
+
+class StreamingMfcc:
+    """
+    compute_mfcc for audio arriving in chunks. The STFT frames (n_fft window,
+    hop_length step, centered like librosa) are turned into log-mel rows as soon
+    as their samples are in, only the tail the next frame needs is buffered.
+    The top_db clipping and normalization depend on the whole clip, they are
+    applied when the MFCC is read, which is cheap next to the STFT.
+    """
+
+    def __init__(self, sr: int):
+        self.sr = sr
+        # center=True: the first frame is centered on sample 0
+        self.buffer = np.zeros(n_fft // 2, dtype=np.float32)
+        self.blocks: list[np.ndarray] = []
+        self.n_samples = 0
+        self.finished = False
+
+    @property
+    def n_frames(self) -> int:
+        return sum(len(block) for block in self.blocks)
+
+    def feed(self, y: np.ndarray) -> int:
+        """Append samples, returns the number of new frames"""
+        self.buffer = np.concatenate([self.buffer, y.astype(np.float32, copy=False)])
+        self.n_samples += len(y)
+        return self._advance()
+
+    def finish(self) -> int:
+        """End of the audio: the trailing centre padding completes the last frames"""
+        if self.finished:
+            return 0
+        self.finished = True
+        self.buffer = np.concatenate([self.buffer, np.zeros(n_fft // 2, dtype=np.float32)])
+        return self._advance()
+
+    def _advance(self) -> int:
+        if len(self.buffer) < n_fft:
+            return 0
+        n = (len(self.buffer) - n_fft) // hop_length + 1
+        frames = np.lib.stride_tricks.sliding_window_view(self.buffer, n_fft)[::hop_length][:n]
+        self.blocks.append(log_mel_frames([frames], self.sr))
+        self.buffer = self.buffer[n * hop_length:].copy()
+        return n
+
+    def log_mel(self) -> np.ndarray:
+        """(n_frames, n_mels), same rows as log_mel_frames([frame(y)], sr) once finished"""
+        if len(self.blocks) > 1:
+            self.blocks = [np.concatenate(self.blocks)]
+        return self.blocks[0] if self.blocks else np.empty((0, n_mels), dtype=np.float32)
+
+    def mfcc(self) -> np.ndarray:
+        log_mel = self.log_mel().copy()
+        return np.ascontiguousarray(mfcc_from_log_mel(log_mel, np.array([len(log_mel)])).T)
+
+def get_mfcc_fixed(m: np.ndarray, max_t: int = max_t):
+    T_i = m.shape[1]
+    if T_i < max_t:
+        pad_width = max_t - T_i
+        m2 = np.pad(m,
+                    pad_width=((0,0),
+                    (0,pad_width)),
+                    mode='constant',
+                    constant_values=0)
+    else:
+        m2 = m[:, :max_t]
+    return m2
+
+def librosa_mfcc(y: np.ndarray, sr: int) -> np.ndarray:
+    """Reference implementation the engine is checked against"""
+    import librosa
+    mfcc_features = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length)
+    return librosa.util.normalize(mfcc_features, axis=1)
+
+if __name__ == "__main__":
+    # python server/features.py [audio dir] : accuracy check and clips/sec against librosa
+    import sys
+    import time
+    from pathlib import Path
+    import audio_io
+
+    audio_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent.parent / "clean" / "AUDIO_DATA"
+    clips = [audio_io.decode(p.read_bytes()) for p in sorted(audio_dir.glob("*.wav"))]
+    print(f"{len(clips)} clips from {audio_dir}")
+
+    def best_of(runs: int, fn):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            out = fn()
+            timings.append(time.perf_counter() - start)
+        return out, min(timings)
+
+    librosa_mfcc(*clips[0])  # numba compilation is not part of the benchmark
+    reference, librosa_time = best_of(3, lambda: [librosa_mfcc(y, sr) for y, sr in clips])
+    _, single_time = best_of(3, lambda: [compute_mfcc(y, sr) for y, sr in clips])
+    batched, batch_time = best_of(3, lambda: compute_mfcc_batch(clips))
+
+    error = max(float(np.abs(a - b).max()) for a, b in zip(reference, batched))
+    print(f"librosa        : {len(clips) / librosa_time:8.1f} clips/sec")
+    print(f"engine (single): {len(clips) / single_time:8.1f} clips/sec")
+    print(f"engine (batch) : {len(clips) / batch_time:8.1f} clips/sec")
+    print(f"max abs error  : {error:.2e} (tolerance {tolerance:.0e})")
+    sys.exit(0 if error <= tolerance else 1)
@@ -0,0 +1,53 @@
+import os
+from pathlib import Path
+import keras
+import numpy as np
+
+from training_data import MfccDataset, Source
+
+# rows of the older phases trained again with a new phase, at most replay_size and
+# replay_ratio per new row: the cost of a phase follows its own size, not the total
+replay_size   = int(os.environ.get("DURIAN_REPLAY_SIZE", 512))
+replay_ratio  = float(os.environ.get("DURIAN_REPLAY_RATIO", 1.0))
+# epochs without a better held-out loss before the fit stops, the best weights are kept
+patience      = int(os.environ.get("DURIAN_TRAIN_PATIENCE", 2))
+learning_rate = float(os.environ.get("DURIAN_FINETUNE_LR", 1e-4))  # a tenth of Adam's default the model was trained with
+# recordings the model is checked on after each epoch, never trained on here
+holdout_dir   = Path(os.environ.get("DURIAN_HOLDOUT_DIR", Path(__file__).resolve().parent.parent / "AUDIO_DATA"))
+mature_tag    = "75-85"
+
+def holdout_files() -> tuple[list[Path], np.ndarray]:
+    """The held-out recordings and their labels (1 = 75-85%), none if the directory is missing"""
+    paths = sorted(holdout_dir.glob("*.wav")) if holdout_dir.is_dir() else []
+    return paths, np.array([1 if mature_tag in path.name else 0 for path in paths])
+
+def replay_rows(sizes: list[int], n_new: int, seed: int | None = None) -> list[np.ndarray]:
+    """Rows replayed from each older phase (of `sizes` rows): a uniform sample over all of them"""
+    total = sum(sizes)
+    k = min(replay_size, int(replay_ratio * n_new), total)
+    picks = np.sort(np.random.default_rng(seed).choice(total, k, replace=False))
+    offsets = np.cumsum([0, *sizes])
+    return [picks[(picks >= start) & (picks < end)] - start for start, end in zip(offsets[:-1], offsets[1:])]
+
+def fine_tune(model: keras.Model, train: list[Source], holdout: list[Source], epochs: int, callbacks: list[keras.callbacks.Callback]) -> keras.callbacks.History:
+    """
+    Continues training `model` (the active checkpoint) on `train`, in float32 with
+    the notebook's batch size. The BatchNormalization statistics of the original
+    training set are kept: a phase is a few batches, too few to estimate them. With
+    a held-out set the fit stops once its loss stops improving, at most `epochs`.
+    """
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.BatchNormalization):
+            layer.trainable = False
+    # trainable changes only apply once compiled again, a fresh optimizer fits the lower rate
+    model.compile(optimizer=keras.optimizers.Adam(learning_rate), loss="binary_crossentropy", metrics=["accuracy"])
+    validation = None
+    if holdout:
+        validation = MfccDataset(holdout, shuffle=False)
+        callbacks = [*callbacks, keras.callbacks.EarlyStopping(monitor="val_loss", patience=patience, restore_best_weights=True)]
+    return model.fit(MfccDataset([source for source in train if len(source)]), validation_data=validation, epochs=epochs, verbose=0, callbacks=callbacks)
+
+def restored_metrics(history: keras.callbacks.History) -> dict[str, float]:
+    """Metrics of the weights fine_tune kept: the best held-out epoch's, the last epoch's without a held-out set"""
+    best = int(np.argmin(history.history["val_loss"])) if "val_loss" in history.history else -1
+    return {k: float(values[best]) for k, values in history.history.items() if k in ("loss", "accuracy", "val_loss", "val_accuracy")}
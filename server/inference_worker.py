@@ -0,0 +1,84 @@
+"""
+Inference worker: claims the /classify jobs the lite server puts in the work
+queue (DURIAN_WORK_QUEUE), featurizes them and runs them through the ONNX model
+in batches. Run as many as the host has cores, they share the queue file and
+load the read-only model file once each:
+
+    DURIAN_WORK_QUEUE=tmp/queue.sqlite3 python inference_worker.py
+"""
+import os
+import socket
+import time
+from pathlib import Path
+import numpy as np
+
+import audio_io
+from cascade import cascade_enabled, cascade_mtime, cascade_path, load_cascade
+from executors import featurize, featurize_segments
+from model_registry import parse_filename
+from ort_session import load_session
+from segmentation import combine
+from work_queue import WorkQueue, idle_poll_interval, poll_interval
+
+BASE_DIR = Path(__file__).resolve().parent
+# the same settings as lite_server.py
+model_path = BASE_DIR / "server_models" / os.environ.get("DURIAN_MODEL", "model_v2_(0.51, 0.89)_.onnx")
+use_segments = os.environ.get("DURIAN_SEGMENT", "1") == "1"
+queue_path = os.environ.get("DURIAN_WORK_QUEUE", str(BASE_DIR / "tmp" / "queue.sqlite3"))
+# jobs claimed at once, their windows go through the model in a single call
+batch_jobs = int(os.environ.get("DURIAN_WORKER_BATCH", 16))
+worker_name = f"{socket.gethostname()}-{os.getpid()}"
+
+def featurize_upload(data: bytes) -> tuple[np.ndarray, np.ndarray, int, str]:
+    """(n_windows, 40, max_t, 1) model inputs, their weights, the sample rate and the digest of the decoded signal"""
+    if use_segments:
+        windows, weights, sr, digest = featurize_segments(data)
+        return windows[..., np.newaxis], weights, sr, digest
+    mfcc, sr, digest = featurize(data)
+    return mfcc[np.newaxis, ..., np.newaxis], np.ones(1), sr, digest
+
+def main():
+    session = load_session(model_path)
+    input_name = session.get_inputs()[0].name
+    cascade_file = cascade_path(model_path)
+    model_version = parsed[0] if (parsed := parse_filename(model_path.name)) else model_path.stem
+    # the first featurization pays the scipy import and fills the MFCC caches
+    sample = audio_io.encode_wav(np.random.default_rng(0).normal(0, 0.01, 110250).astype(np.float32), 44100)
+    session.run(None, {input_name: featurize_upload(sample)[0].astype(np.float32)})
+    queue = WorkQueue(queue_path)
+    print(f"Worker {worker_name}: {model_path.name} on {queue_path}")
+
+    idle = poll_interval
+    while True:
+        jobs = queue.claim(worker_name, batch_jobs)
+        if not jobs:
+            time.sleep(idle)
+            idle = min(idle * 2, idle_poll_interval)
+            continue
+        idle = poll_interval
+        # a cascade file convert.py rewrites is used from the next batch on, like by the server
+        cascade = load_cascade(cascade_file, mtime_ns) if cascade_enabled and (mtime_ns := cascade_mtime(cascade_file)) is not None else None
+
+        results: list[tuple[int, dict]] = []
+        featurized = []
+        for job_id, _, payload in jobs:
+            try:
+                inputs, weights, sr, digest = featurize_upload(payload)
+            except Exception as e:
+                # undecodable upload, the server answers 400 like for its own featurization errors
+                results.append((job_id, {"error": str(e), "status": 400}))
+                continue
+            if cascade is not None and (score := cascade.decide(inputs, weights)) is not None:
+                results.append((job_id, {"score": score, "segments": len(weights), "sr": sr, "pcm": digest, "model_version": model_version, "stage": "fast"}))
+            else:
+                featurized.append((job_id, inputs, weights, sr, digest))
+        if featurized:
+            x = np.concatenate([inputs for _, inputs, *_ in featurized]).astype(np.float32)
+            preds = session.run(None, {input_name: x})[0][:, 0] # type: ignore
+            splits = np.cumsum([len(weights) for _, _, weights, *_ in featurized])[:-1]
+            for (job_id, _, weights, sr, digest), scores in zip(featurized, np.split(preds, splits)):
+                results.append((job_id, {"score": combine(scores, weights), "segments": len(weights), "sr": sr, "pcm": digest, "model_version": model_version, "stage": "full"}))
+        queue.finish(results)
+
+if __name__ == "__main__":
+    main()
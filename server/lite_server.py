@@ -1,33 +1,157 @@
+import time
+started_at = time.perf_counter()
+import asyncio
 from datetime import timezone
 import datetime
 from pathlib import Path
+import io
+import json
+import threading
 import typing
-import onnxruntime as ort
 import numpy as np
 import os
 from typing import Literal
-import librosa
 import numpy as np
-from quart import Quart, jsonify, request, send_file
-from pydub import AudioSegment
+from quart import Quart, jsonify, request, send_file, websocket
 from quart.datastructures import FileStorage
 from werkzeug.datastructures import MultiDict
+from batching import MicroBatcher
+from cascade import cascade_enabled, cascade_mtime, cascade_path, load_cascade
+from catalog import Catalog
+from dedup import Deduplicator, duplicate_policy
+import metrics
+import audio_io
+from executors import Overloaded, Pipeline, canonical_wav, convert_to_wav, featurize, featurize_segments, load_audio, max_pending, pcm_mfcc
+# the CPU pool forks before ONNX Runtime is imported and any thread started (see Pipeline.fork)
+pipeline = Pipeline()
+pipeline.fork()
+from features import max_t, n_mfcc
+from model_registry import parse_filename
+from ort_session import load_session
+from result_cache import ResultCache, upload_digest
+from segmentation import combine
+from streaming import StreamSession
+from work_queue import QueueClient, QueueTimeout, WorkQueue
+import tracing
+import uuid
 
 BASE_DIR = Path(__file__).resolve().parent
 print(f"Base directory: {BASE_DIR}")
-model_path = BASE_DIR / "server_models" / "model_v2_(0.51, 0.89)_.onnx"
-(train_submit_dir := Path(BASE_DIR) / "train_submitted").mkdir(exist_ok=True)
-(tmp_dir := BASE_DIR / "tmp").mkdir(exist_ok=True)
+# DURIAN_DATA_DIR: where the uploads, their catalog and the temporary files are kept, the catalog links are relative to it
+DATA_DIR = Path(os.environ.get("DURIAN_DATA_DIR", BASE_DIR)).resolve()
+# any variant written by convert.py: .onnx, .int8-dynamic.onnx, .int8-static.onnx or .ort
+model_path = BASE_DIR / "server_models" / os.environ.get("DURIAN_MODEL", "model_v2_(0.51, 0.89)_.onnx")
+(train_submit_dir := DATA_DIR / "train_submitted").mkdir(parents=True, exist_ok=True)
+# the lite server has no training phases, its submissions are all phase 0
+catalog = Catalog(train_submit_dir / "catalog.sqlite3")
+(tmp_dir := DATA_DIR / "tmp").mkdir(exist_ok=True)
 
-# load onnx model
-session = ort.InferenceSession(model_path)
-input_name = session.get_inputs()[0].name
+# DURIAN_FAST_START=1 opens the port first: the ONNX session is created and the
+# feature path warmed up in the background, /ready answers 200 once done and
+# requests sent before then wait for the session. 0 does it all before serving.
+fast_start = os.environ.get("DURIAN_FAST_START", "1") == "1"
+# seconds spent in each start-up step, reported by /ready
+startup: dict[str, float] = {}
+session_loaded = threading.Event()
+ready = threading.Event()
+model_version = parsed[0] if (parsed := parse_filename(model_path.name)) else model_path.stem
+
+session = None
+
+def load_model():
+    # load onnx model, session options come from the DURIAN_ORT_* variables
+    global session, input_name
+    start = time.perf_counter()
+    try:
+        session = load_session(model_path)
+        input_name = session.get_inputs()[0].name
+        startup["session_seconds"] = round(time.perf_counter() - start, 3)
+    finally:
+        # a failed load fails the waiting requests instead of hanging them
+        session_loaded.set()
+
+def predict(x: np.ndarray) -> np.ndarray:
+    session_loaded.wait()
+    if session is None:
+        raise RuntimeError(f"The ONNX model {model_path.name} failed to load")
+    with tracing.span("inference", model_version=model_version):
+        return session.run(None, {input_name: x.astype(np.float32)})[0] # type: ignore
+
+def warm_up_in_process():
+    """First inference and first MFCC: ORT allocations, scipy.fft, the mel basis and DCT caches"""
+    start = time.perf_counter()
+    predict(np.zeros((1, n_mfcc, max_t, 1), dtype=np.float32))
+    # 2.5s of faint noise at the phones' 44.1 kHz, the MFCC caches are per sample rate
+    sample = audio_io.encode_wav(np.random.default_rng(0).normal(0, 0.01, 110250).astype(np.float32), 44100)
+    featurize_segments(sample)
+    if use_temp_files:
+        # librosa.load on the debugging path compiles its numba kernels on first use
+        import librosa
+        librosa.load(io.BytesIO(sample), sr=None)
+    startup["warmup_seconds"] = round(time.perf_counter() - start, 3)
+    return sample
+
+async def warm_up():
+    try:
+        if not session_loaded.is_set():
+            await asyncio.to_thread(load_model)
+        sample = await asyncio.to_thread(warm_up_in_process)
+    except Exception as e:
+        # /ready stays 503, /classify answers the error
+        print(f"❌ Warm-up failed: {e!r}")
+        raise
+    # the workers were forked cold, one job each pays their imports and fills their MFCC caches
+    start = time.perf_counter()
+    await asyncio.gather(*[pipeline.run("warmup", featurize_segments, sample) for _ in range(pipeline.workers)])
+    startup["pool_seconds"] = round(time.perf_counter() - start, 3)
+    startup["ready_seconds"] = round(time.perf_counter() - started_at, 3)
+    ready.set()
+    print(f"Ready in {startup['ready_seconds']}s: {startup}")
+
+if not fast_start:
+    load_model()
+
+batcher = MicroBatcher(predict)
+# fast first stage written by convert.py next to the model, answers the clear-cut recordings alone
+cascade_file = cascade_path(model_path)
+result_cache = ResultCache()
 
 # handle global server variables
-nb_tmp = 0
-max_t = 273 # value found in the data_preparation.py notebook
+# DURIAN_TEMP_FILES=1 keeps the old save -> convert -> librosa.load path on /classify (debugging)
+use_temp_files = os.environ.get("DURIAN_TEMP_FILES") == "1"
+# DURIAN_SEGMENT=0 classifies the first max_t frames only instead of the knock windows
+use_segments = os.environ.get("DURIAN_SEGMENT", "1") == "1"
+# recordings accepted by one /classify-batch call (parts or archive entries)
+max_batch_files = int(os.environ.get("DURIAN_BATCH_MAX_FILES", 100))
+# DURIAN_WORK_QUEUE=<sqlite file>: /classify and /classify-batch recordings are featurized
+# and classified by the inference_worker.py processes sharing that file, not in this process
+work_queue_path = os.environ.get("DURIAN_WORK_QUEUE")
+queue_client = QueueClient(WorkQueue(work_queue_path)) if work_queue_path else None
 
 app = Quart(__name__)
+tracing.install(app)
+startup["import_seconds"] = round(time.perf_counter() - started_at, 3)
+
+@app.before_serving
+async def start_workers():
+    pipeline.start()
+    await batcher.start()
+    await dedup.start(pipeline)
+    if queue_client is not None:
+        await queue_client.start()
+    if fast_start:
+        # kept referenced, the loop only holds weak references to tasks
+        app.warm_up_task = asyncio.create_task(warm_up()) # type: ignore
+    else:
+        await warm_up()
+
+@app.after_serving
+async def stop_workers():
+    if queue_client is not None:
+        await queue_client.stop()
+    await dedup.stop()
+    await batcher.stop()
+    pipeline.stop()
 
 class DateUtils:
     datetime_storage_pattern = "%Y-%m-%d_%H-%M-%S"
@@ -36,76 +160,137 @@ class DateUtils:
 class LabelUtils:
     type LabelType = Literal["mature", "immature", "overripe"] 
     allowed_labels = ["mature", "immature", "overripe"] 
+    threshold = 0.5
+    @staticmethod
+    def from_score(result: float) -> tuple[LabelType, float]:
+        """model output (probability of mature) -> label and confidence"""
+        durian_class: LabelUtils.LabelType = "mature" if (result > LabelUtils.threshold) else "overripe"
+        return durian_class, max(result, 1-result)
 
-def load_audio(path: str):
-    y, sr = librosa.load(path, sr=None)
-    return y, sr
-
-def compute_mfcc(y, sr):
-    n_mfcc     = 40        # number of coefficients
-    n_fft      = 2048      # window size STFT
-    hop_length = 512
-    mfcc_features = librosa.feature.mfcc(
-        y=y, sr=sr, 
-        n_mfcc=n_mfcc, 
-        n_fft=n_fft, 
-        hop_length=hop_length
-        )
-    return librosa.util.normalize(mfcc_features, axis=1)
-
-def get_mfcc_fixed(m: np.ndarray):
-    T_i = m.shape[1]
-    if T_i < max_t:
-        pad_width = max_t - T_i
-        m2 = np.pad(m,
-                    pad_width=((0,0),
-                    (0,pad_width)), 
-                    mode='constant',
-                    constant_values=0)
-    else:
-        m2 = m[:, :max_t]
-    return m2
+def submission_entry(path: Path) -> dict[str, typing.Any]:
+    """Catalog row of a stored training file, named <storage date>_<content hash>_<label>.wav (older ones without the hash)"""
+    infos = path.stem.split("_")
+    dt = datetime.datetime.strptime('_'.join(infos[:2]), DateUtils.datetime_storage_pattern).replace(tzinfo=timezone.utc)
+    return {
+        "name": path.name,
+        "date": dt.strftime(DateUtils.datetime_response_pattern),
+        "label": infos[-1],
+        "size": path.stat().st_size,
+        "link": str(path.relative_to(DATA_DIR)),
+        "phase": 0,
+    }
+
+if catalog.current_phase() is None:
+    # first start with a catalog: index the files the directory scan used to list
+    catalog.add([submission_entry(path) for path in train_submit_dir.glob("*.wav")])
+    catalog.add_phase(0)
+
+# files indexed without a fingerprint get one in the background once serving
+dedup = Deduplicator(catalog, DATA_DIR)
+
+def listing_query() -> tuple[dict[str, typing.Any], int | None, int]:
+    """?label=&since=&until= filters and ?limit=&offset= page of the listing, ValueError if malformed"""
+    filters: dict[str, typing.Any] = {}
+    if (label := request.args.get("label")) is not None:
+        if label not in LabelUtils.allowed_labels:
+            raise ValueError(f"label must be in : [{", ".join(LabelUtils.allowed_labels)}]")
+        filters["label"] = label
+    for bound in ("since", "until"):
+        if (value := request.args.get(bound)) is not None:
+            # same format as the "date" of the responses
+            filters[bound] = datetime.datetime.strptime(value, DateUtils.datetime_response_pattern).strftime(DateUtils.datetime_response_pattern)
+    limit = request.args.get("limit", type=int)
+    offset = request.args.get("offset", 0, type=int)
+    if (limit is not None and limit < 0) or offset < 0:
+        raise ValueError("limit and offset must be positive integers")
+    return filters, limit, offset
 
 def redim(mfcc_fixed):
     result =  np.stack([mfcc_fixed], axis=0)
     result = result[..., np.newaxis]
     return result
 
-async def exec_full_data_pipeline(file: str | FileStorage):
-    global nb_tmp
+@tracing.traced("exec_full_data_pipeline")
+async def exec_full_data_pipeline(file: str | FileStorage, file_type: str = "wav"):
     if (isinstance(file, str)):
         file_path = Path(file)
     else:
-        file_path = BASE_DIR / "tmp" / f"tmp_{nb_tmp}.wav"
+        file_path = tmp_dir / f"tmp_{uuid.uuid4().hex}.wav"
         await file.save(file_path)
         
-    y, sr = load_audio(str(file_path))
+    y, sr = await pipeline.run("decode", load_audio, str(file_path))
+    tracing.count_input(file_type, sr)
     os.remove(file_path)
-    nb_tmp+=1
-    mfcc = compute_mfcc(y, sr)
-    fixed = get_mfcc_fixed(mfcc)
-    return redim(fixed)
-
-async def save_conversion(file: FileStorage, out_dir: Path = tmp_dir, label: str = "") -> Path:
-    global nb_tmp
-    supported_file_types = ["wav", "m4a", "mp4", "wave", "x-m4a"]
-    file_type: str = file.content_type.split("/")[1] # type: ignore
-    if file_type not in supported_file_types:
-        raise Exception(f'File type {file_type} is not supported are supported. \nSupported types : [{', '.join(supported_file_types)}]')
+    return redim(await pipeline.run("mfcc", pcm_mfcc, y, sr))
+
+async def featurize_upload(data: bytes) -> tuple[np.ndarray, np.ndarray, int, str]:
+    """(n_windows, 40, max_t, 1) model inputs of a recording, the weights combining their scores, the sample rate and the digest of the decoded signal"""
+    if use_segments:
+        windows, weights, sr, digest = await pipeline.run("featurize", featurize_segments, data)
+        return windows[..., np.newaxis], weights, sr, digest
+    mfcc, sr, digest = await pipeline.run("featurize", featurize, data)
+    return redim(mfcc), np.ones(1), sr, digest
+
+async def classify_queued(data: bytes) -> tuple[dict[str, typing.Any], int, str]:
+    """Response computed by an inference worker, the sample rate and the digest of the decoded signal"""
+    if queue_client.pending >= max_pending: # type: ignore
+        raise Overloaded(f"Server busy, {queue_client.pending} jobs pending") # type: ignore
+    result = await queue_client.run("classify", data) # type: ignore
+    if "error" in result:
+        raise ValueError(result["error"])
+    durian_class, confidence = LabelUtils.from_score(result["score"])
+    tracing.count_prediction(durian_class, result["model_version"], result["stage"])
+    return {'type': durian_class, 'confidence': confidence, 'segments': result["segments"], 'stage': result["stage"]}, result["sr"], result["pcm"]
+
+def cache_version() -> tuple[str, int | None]:
+    """Results are cached per model and fast stage: a cascade file convert.py rewrites no longer serves its predecessor's answers"""
+    return model_version, cascade_mtime(cascade_file) if cascade_enabled else None
+
+def fast_result(x: np.ndarray, weights: np.ndarray, version: tuple[str, int | None]) -> dict[str, typing.Any] | None:
+    """Response of the fast stage of `version` (a cache_version), None when the recording needs the full model"""
+    _, mtime_ns = version
+    if mtime_ns is None or (cascade := load_cascade(cascade_file, mtime_ns)) is None or (score := cascade.decide(x, weights)) is None:
+        return None
+    durian_class, confidence = LabelUtils.from_score(score)
+    tracing.count_prediction(durian_class, model_version, "fast")
+    return {'type': durian_class, 'confidence': confidence, 'segments': len(weights), 'stage': 'fast'}
+
+def cached_result(kind: str, digest: str, file_type: str, version: tuple[str, int | None]) -> dict[str, typing.Any] | None:
+    """Response already sent for this recording by `version` (a cache_version), counted like a new one"""
+    if (cached := result_cache.get(kind, digest, version)) is None:
+        return None
+    resp, sr = cached
+    if kind == "upload":
+        tracing.count_input(file_type, sr)
+    tracing.count_prediction(resp['type'], model_version, resp.get('stage', 'full'))
+    return resp
+
+@tracing.traced("save_conversion")
+async def save_conversion(file: FileStorage, out_dir: Path = tmp_dir, label: str = "", digest: str = "") -> Path:
+    file_type = audio_io.file_type(file)
 
     now = datetime.datetime.now(datetime.UTC)
-    file_path: Path = (out_dir / f"{now.strftime(DateUtils.datetime_storage_pattern)}_{label}").with_suffix(f".{file_type}")
-    nb_tmp+=1
+    # temporary conversions have no label, a random suffix keeps concurrent requests apart,
+    # training files carry their content hash so two uploads in the same second keep their own name
+    suffix = f"{digest[:16]}_{label}" if label else uuid.uuid4().hex
+    file_path: Path = (out_dir / f"{now.strftime(DateUtils.datetime_storage_pattern)}_{suffix}").with_suffix(f".{file_type}")
     out_path = file_path.with_suffix(".wav")
     if file_type not in ["wav", "wave"]:
         await file.save(file_path)
-        sound = AudioSegment.from_file(file_path, format=file_type)
-        os.remove(file_path)
-        sound.export(out_path, format='wav')
+        await pipeline.run("conversion", convert_to_wav, str(file_path), str(out_path), file_type)
     else:
         await file.save(out_path)
     return out_path
 
+@tracing.traced("save_canonical")
+async def save_canonical(data: bytes, out_dir: Path, label: str, digest: str) -> Path:
+    """Training upload stored once as 16-bit WAV at the canonical rate, training reads it without resampling"""
+    wav = await pipeline.run("conversion", canonical_wav, data)
+    now = datetime.datetime.now(datetime.UTC)
+    out_path = out_dir / f"{now.strftime(DateUtils.datetime_storage_pattern)}_{digest[:16]}_{label}.wav"
+    await asyncio.to_thread(out_path.write_bytes, wav)
+    return out_path
+
 @app.route('/classify', methods=['POST'])
 async def upload():
     files = await request.files
@@ -113,28 +298,170 @@ async def upload():
         return jsonify({'error': 'No files received'}), 400
 
     file: FileStorage = files['audio']
+    version = cache_version()
+    # digests the result is cached under, the temporary files path has none
+    keys: dict[str, str] = {}
     try:
-        converted = await save_conversion(file)
+        file_type = audio_io.file_type(file)
+        if use_temp_files:
+            converted = await save_conversion(file)
+            x, weights = await exec_full_data_pipeline(str(converted), file_type=file_type), np.ones(1)
+        else:
+            data = file.read()
+            # a resend of the same bytes skips the decoding and the model
+            keys["upload"] = upload_digest(data)
+            if (resp := cached_result("upload", keys["upload"], file_type, version)) is not None:
+                return resp, 200
+            if queue_client is not None:
+                resp, sr, keys["pcm"] = await classify_queued(data)
+                tracing.count_input(file_type, sr)
+                result_cache.put(keys, version, (resp, sr))
+                return resp, 200
+            x, weights, sr, keys["pcm"] = await featurize_upload(data)
+            tracing.count_input(file_type, sr)
+            # the same audio in another container or with other tags skips the model
+            if (resp := cached_result("pcm", keys["pcm"], file_type, version)) is not None:
+                result_cache.put(keys, version, (resp, sr))
+                return resp, 200
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), 503
+    except QueueTimeout as e:
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
-        return jsonify({'error': e}), 400
-    
-    x = await exec_full_data_pipeline(str(converted))
-
-    pred: np.ndarray = session.run(None, {input_name: x.astype(np.float32)})[0] # type: ignore
-    result = float(pred[0][0])
+        return jsonify({'error': str(e)}), 400
 
-    durian_class: LabelUtils.LabelType | None = None
-    
-    durian_class = "mature" if (result > 0.5) else "overripe"    
+    if (resp := fast_result(x, weights, version)) is None:
+        pred: np.ndarray = await batcher.submit(x)
+        # one score per knock window
+        result = combine(pred[:, 0], weights)
 
-    confidence = max(result, 1-result)
+        durian_class, confidence = LabelUtils.from_score(result)
+        tracing.count_prediction(durian_class, model_version)
 
-    resp = {
-        'type': durian_class,
-        'confidence': confidence
-    }
+        resp = {
+            'type': durian_class,
+            'confidence': confidence,
+            'segments': len(weights),
+            'stage': 'full'
+        }
+    if keys:
+        result_cache.put(keys, version, (resp, sr))
     return resp, 200
 
+@app.post('/classify-batch')
+async def classify_batch():
+    files = await request.files
+    # (name, file type, content) of every recording, archives are unpacked in memory
+    items: list[tuple[str, str, bytes]] = []
+    try:
+        for file in files.getlist('audio'):
+            if audio_io.is_archive(file):
+                items += await asyncio.to_thread(audio_io.unpack_archive, file.read())
+            else:
+                items.append((file.filename or f"audio_{len(items)}", audio_io.file_type(file), file.read()))
+    except audio_io.AudioDecodeError as e:
+        return jsonify({'error': str(e)}), 400
+    if not items:
+        return jsonify({'error': 'No files received'}), 400
+    if len(items) > max_batch_files:
+        return jsonify({'error': f'At most {max_batch_files} recordings per batch, got {len(items)}'}), 413
+
+    # one crate keeps at most one job per worker in the pool, other requests still get in
+    slots = asyncio.Semaphore(pipeline.workers)
+    version = cache_version()
+
+    async def featurize_item(index: int, name: str, file_type: str, data: bytes):
+        """index, name, (inputs, weights, sample rate, cache keys) or the cached response, error"""
+        keys = {"upload": await asyncio.to_thread(upload_digest, data)}
+        if (resp := cached_result("upload", keys["upload"], file_type, version)) is not None:
+            return index, name, resp, None
+        if queue_client is not None:
+            # the workers share the queue with the other requests, no slots needed
+            try:
+                resp, sr, keys["pcm"] = await classify_queued(data)
+            except Exception as e:
+                return index, name, None, e
+            tracing.count_input(file_type, sr)
+            result_cache.put(keys, version, (resp, sr))
+            return index, name, resp, None
+        async with slots:
+            try:
+                x, weights, sr, keys["pcm"] = await featurize_upload(data)
+            except Exception as e:
+                return index, name, None, e
+        tracing.count_input(file_type, sr)
+        if (resp := cached_result("pcm", keys["pcm"], file_type, version)) is not None or (resp := fast_result(x, weights, version)) is not None:
+            result_cache.put(keys, version, (resp, sr))
+            return index, name, resp, None
+        return index, name, (x, weights, sr, keys), None
+
+    def ndjson(**fields: typing.Any) -> str:
+        return json.dumps(fields) + "\n"
+
+    async def results():
+        tasks = [asyncio.create_task(featurize_item(index, *item)) for index, item in enumerate(items)]
+        featurized: list[tuple[int, str, tuple[np.ndarray, np.ndarray, int, dict[str, str]]]] = []
+        errors = 0
+        try:
+            # failures, cached results and the fast stage's are known before the inference, they are sent first
+            for next_done in asyncio.as_completed(tasks):
+                index, name, inputs, error = await next_done
+                if isinstance(inputs, dict):
+                    yield ndjson(index=index, file=name, **inputs)
+                elif error is None:
+                    featurized.append((index, name, inputs))
+                else:
+                    errors += 1
+                    yield ndjson(index=index, file=name, error=str(error), status=503 if isinstance(error, Overloaded) else 504 if isinstance(error, QueueTimeout) else 400)
+            if featurized:
+                # a single inference call for the whole crate
+                preds: np.ndarray = await batcher.submit(np.concatenate([x for _, _, (x, *_) in featurized]))
+                splits = np.cumsum([len(weights) for _, _, (_, weights, *_) in featurized])[:-1]
+                for (index, name, (_, weights, sr, keys)), pred in zip(featurized, np.split(preds[:, 0], splits)):
+                    durian_class, confidence = LabelUtils.from_score(combine(pred, weights))
+                    tracing.count_prediction(durian_class, model_version)
+                    resp = {'type': durian_class, 'confidence': confidence, 'segments': len(weights), 'stage': 'full'}
+                    result_cache.put(keys, version, (resp, sr))
+                    yield ndjson(index=index, file=name, **resp)
+            yield ndjson(done=True, count=len(items), errors=errors)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return results(), 200, {"Content-Type": "application/x-ndjson"}
+
+@app.websocket('/classify-stream')
+async def classify_stream():
+    # binary messages: raw PCM as it is recorded, any text message (e.g. "end") ends the recording
+    encoding = websocket.args.get("encoding", "s16le")
+    try:
+        session = StreamSession(websocket.args.get("sample_rate", 44100, type=int), encoding, websocket.args.get("channels", 1, type=int))
+    except audio_io.AudioDecodeError as e:
+        await websocket.send(json.dumps({"event": "error", "error": str(e)}))
+        return
+    tracing.count_input(encoding, session.sr)
+
+    async def send_score(event: str):
+        x, weights = session.inputs()
+        pred: np.ndarray = await batcher.submit(x)
+        durian_class, confidence = LabelUtils.from_score(combine(pred[:, 0], weights))
+        if event == "final":
+            tracing.count_prediction(durian_class, model_version)
+        await websocket.send(json.dumps(dict(event=event, type=durian_class, confidence=confidence, knocks=session.knocks, segments=len(weights), seconds=round(session.seconds, 3))))
+
+    while not session.full:
+        message = await websocket.receive()
+        if isinstance(message, str):
+            break
+        # STFT of the new frames only, a few hundred microseconds per chunk
+        if session.feed(message):
+            await send_score("provisional")
+    session.finish()
+    if session.mfcc.n_samples == 0:
+        await websocket.send(json.dumps({"event": "error", "error": "No audio received"}))
+        return
+    await send_score("final")
+
 @app.post('/add-training-data')
 async def add_training_data():
     form: MultiDict[typing.Any, typing.Any] = await request.form
@@ -146,45 +473,68 @@ async def add_training_data():
     
     if label not in LabelUtils.allowed_labels:
         return {"error": f"label must be in : [{", ".join(LabelUtils.allowed_labels)}]"}, 400
-        
-    converted: Path = await save_conversion(content, out_dir = BASE_DIR / "train_submitted", label=label)
+
+    data = content.read()
+    # checked and stored under the lock, two copies sent together can't both get in
+    async with dedup.lock:
+        try:
+            digest, fingerprint, duplicate = await dedup.find(data, pipeline)
+        except Overloaded as e:
+            return {"error": str(e)}, 503
+        except audio_io.AudioDecodeError as e:
+            return {"error": str(e)}, 400
+        if duplicate is not None:
+            dedup.record(duplicate)
+            body = {"duplicate_of": duplicate.entry, "similarity": duplicate.similarity, "exact": duplicate.exact}
+            if duplicate_policy == "link":
+                return {"message": "duplicate of a stored file, linked to it", **body}, 200
+            return {"error": "duplicate of a stored file", **body}, 409
+
+        try:
+            converted: Path = await save_canonical(data, train_submit_dir, label, digest)
+        except Overloaded as e:
+            return {"error": str(e)}, 503
+        entry = submission_entry(converted)
+        catalog.add([{**entry, "digest": digest, "fingerprint": fingerprint.tobytes()}]) # type: ignore
+        dedup.add(entry["link"], fingerprint) # type: ignore
     return {"message": "file successfully created"}, 200
 
 @app.get('/submitted-training-data')
 async def get_submitted_data():
-    mature_files = train_submit_dir.glob("*_mature.wav")
-    overripe_files = train_submit_dir.glob("*_overripe.wav")
-    
-    def process_file(path: Path):
-        infos = path.stem.split("_")
-        dt = '_'.join(infos[:-1])
-        dt = datetime.datetime.strptime(dt, DateUtils.datetime_storage_pattern).replace(tzinfo=timezone.utc)
-        label = infos[-1]
-        return {
-            "name": path.name,
-            "date": dt.strftime(DateUtils.datetime_response_pattern),
-            "label": label,
-            "size": path.stat().st_size,
-            "link": str(path.relative_to(BASE_DIR))
-        }
-    return [process_file(file) for file in [*mature_files, *overripe_files]], 200
+    try:
+        filters, limit, offset = listing_query()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    entries, total = catalog.submissions(limit, offset, **filters)
+    return entries, 200, {"X-Total-Count": str(total)}
 
 @app.get("/get-audio")
 async def get_file():
     file_path: str | None = request.args.get("url")
     if file_path is None:
         return {"error": f"Missing query parameter \"url\""}, 400
-    full_path = BASE_DIR / Path(file_path)
+    full_path = DATA_DIR / Path(file_path)
     if not full_path.resolve().is_relative_to(train_submit_dir.resolve()):
         return {"error": f"Resource access not allowed for \"{file_path}\""}, 400
-    return await send_file(full_path)
+    # conditional: Range requests, the backoffice player seeks without downloading the whole file
+    return await send_file(full_path, conditional=True)
+
+@app.get("/ready")
+async def get_ready():
+    body = {"ready": ready.is_set(), "model_version": model_version, "startup": startup}
+    return body, 200 if ready.is_set() else 503
+
+@app.get("/metrics")
+async def get_metrics():
+    return tracing.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 @app.get("/")
 async def home():
     return await send_file(BASE_DIR / "front/index.html")
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    # the reloader would import and load everything twice, DURIAN_RELOAD=1 for development
+    app.run(host='0.0.0.0', port=int(os.environ.get("DURIAN_PORT", 5000)), use_reloader=os.environ.get("DURIAN_RELOAD") == "1")
 
 
 
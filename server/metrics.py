@@ -0,0 +1,110 @@
+import threading
+
+# Minimal Prometheus text exposition, the servers only need a handful of series
+# and we don't want another dependency in the lite image.
+# Labels are passed as keyword arguments: stage_seconds.observe(0.2, stage="decode")
+
+_registry: list["_Metric"] = []
+_lock = threading.Lock()
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        _registry.append(self)
+
+    def samples(self) -> list[tuple[str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+        lines += [f"{name} {_format(value)}" for name, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = _key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(_key(labels), 0.0)
+
+    def samples(self):
+        if not self.values:
+            return [(self.name, 0.0)]
+        return [(self.name + _labels(key), value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str):
+        self.values[_key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., sum, count]
+        self.values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = _key(labels)
+        with _lock:
+            series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        for key, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                out.append((f"{self.name}_bucket{_labels(key, le=_format(bound))}", cumulative))
+            out.append((f"{self.name}_bucket{_labels(key, le='+Inf')}", series[-1]))
+            out.append((f"{self.name}_sum{_labels(key)}", series[-2]))
+            out.append((f"{self.name}_count{_labels(key)}", series[-1]))
+        return out
+
+
+def _key(labels: dict[str, str]) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(key: tuple, **extra: str) -> str:
+    pairs = [*key, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def _format(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
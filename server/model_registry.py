@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import datetime
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Callable
+
+# model_v2_(0.51, 0.89)_.keras -> version 2, loss 0.51, accuracy 0.89
+filename_pattern = re.compile(r"model_v(\d+)_\(([\d.]*),\s*([\d.]*)\)_")
+
+def parse_filename(name: str) -> tuple[int, dict[str, float]] | None:
+    match = filename_pattern.match(name)
+    if match is None:
+        return None
+    version, loss, accuracy = match.groups()
+    metrics = {}
+    # freshly trained models are saved as "(0.,0.)", those are not real metrics
+    if loss not in ("", "0.") or accuracy not in ("", "0."):
+        metrics = {"loss": float(loss), "accuracy": float(accuracy)}
+    return int(version), metrics
+
+class ModelRegistry:
+    """
+    Versions of the model in `models_dir`, indexed in manifest.json, and the one
+    currently served. Activating a version loads and warms it up before swapping
+    the `active` reference, requests in flight finish on the previous model.
+    Other versions can be loaded on demand to pin a request to them.
+    """
+
+    def __init__(self, models_dir: Path, suffix: str, load: Callable[[Path], Any], warmup: Callable[[Any], None], max_loaded: int = 2):
+        self.models_dir = models_dir
+        self.suffix = suffix
+        self.manifest_path = models_dir / "manifest.json"
+        self._load = load
+        self._warmup = warmup
+        self._lock = threading.Lock()
+        self._loaded: OrderedDict[int, Any] = OrderedDict()
+        self.max_loaded = max_loaded
+        self.versions: dict[int, dict[str, Any]] = {}
+        # version the manifest marks as served, live once activate() loaded it
+        self.manifest_active: int | None = None
+        # (version, model) swapped as a single reference
+        self._current: tuple[int | None, Any] = (None, None)
+        self._read_manifest()
+
+    @property
+    def active_version(self) -> int | None:
+        return self._current[0]
+
+    @property
+    def active(self) -> Any:
+        return self._current[1]
+
+    def _read_manifest(self):
+        if self.manifest_path.exists():
+            manifest = json.loads(self.manifest_path.read_text())
+            self.versions = {entry["version"]: entry for entry in manifest["versions"]}
+            self.manifest_active = manifest.get("active")
+        # only at startup: index the files copied in by hand (or before the manifest existed)
+        known = {entry["file"] for entry in self.versions.values()}
+        for path in self.models_dir.glob(f"*{self.suffix}"):
+            parsed = parse_filename(path.name)
+            if path.name in known or parsed is None:
+                continue
+            version, metrics = parsed
+            self.versions[version] = self._entry(version, path, metrics)
+        if self.manifest_active not in self.versions:
+            self.manifest_active = self.latest_version()
+        self._write_manifest()
+
+    def _entry(self, version: int, path: Path, metrics: dict[str, float]) -> dict[str, Any]:
+        return {
+            "version": version,
+            "file": path.name,
+            "metrics": metrics,
+            "created_at": datetime.datetime.fromtimestamp(path.stat().st_mtime, datetime.UTC).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+    def _write_manifest(self):
+        manifest = {"active": self.manifest_active, "versions": [self.versions[v] for v in sorted(self.versions)]}
+        tmp_path = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, self.manifest_path)
+
+    def latest_version(self) -> int | None:
+        return max(self.versions) if self.versions else None
+
+    def path(self, version: int) -> Path:
+        return self.models_dir / self.versions[version]["file"]
+
+    def new_path(self) -> Path:
+        version = (self.latest_version() or 0) + 1
+        return self.models_dir / f"model_v{version}_(0.,0.)_{self.suffix}"
+
+    def register(self, path: Path, metrics: dict[str, float] | None = None) -> int:
+        parsed = parse_filename(path.name)
+        if parsed is None:
+            raise ValueError(f"Model file name {path.name} has no version")
+        version, file_metrics = parsed
+        with self._lock:
+            self.versions[version] = self._entry(version, path, metrics or file_metrics)
+            self._write_manifest()
+        return version
+
+    def activate(self, version: int, model: Any = None):
+        """Load (unless given) and warm up `version`, then make it the served model"""
+        if version not in self.versions:
+            raise KeyError(f"Unknown model version {version}")
+        if model is None:
+            model = self._loaded.get(version) or self._load(self.path(version))
+        self._warmup(model)
+        with self._lock:
+            self._current = (version, model)
+            self.manifest_active = version
+            self._write_manifest()
+
+    def get(self, version: int | None = None) -> tuple[int, Any]:
+        """The active model, or a specific version for pinned requests"""
+        active_version, active = self._current
+        if version is None or version == active_version:
+            return active_version, active # type: ignore
+        if version not in self.versions:
+            raise KeyError(f"Unknown model version {version}")
+        with self._lock:
+            if version in self._loaded:
+                self._loaded.move_to_end(version)
+                return version, self._loaded[version]
+        model = self._load(self.path(version))
+        self._warmup(model)
+        with self._lock:
+            self._loaded[version] = model
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return version, model
+
+    def describe(self) -> list[dict[str, Any]]:
+        return [{**self.versions[v], "active": v == self.active_version} for v in sorted(self.versions)]
@@ -0,0 +1,33 @@
+import os
+from pathlib import Path
+import onnxruntime as ort
+
+graph_optimization_levels = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+execution_modes = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+# 0 lets onnxruntime pick (one thread per physical core)
+intra_op_threads = int(os.environ.get("DURIAN_ORT_INTRA_THREADS", 0))
+inter_op_threads = int(os.environ.get("DURIAN_ORT_INTER_THREADS", 0))
+graph_optimization = os.environ.get("DURIAN_ORT_GRAPH_OPT", "all")
+# "parallel" only helps graphs with independent branches, the CNN is a single chain
+execution_mode = os.environ.get("DURIAN_ORT_EXECUTION_MODE", "sequential")
+
+def session_options(intra_op_threads: int = intra_op_threads, inter_op_threads: int = inter_op_threads, graph_optimization: str = graph_optimization, execution_mode: str = execution_mode) -> ort.SessionOptions:
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.graph_optimization_level = graph_optimization_levels[graph_optimization]
+    options.execution_mode = execution_modes[execution_mode]
+    return options
+
+def load_session(path: Path | str, options: ort.SessionOptions | None = None) -> ort.InferenceSession:
+    """.onnx or pre-optimized .ort file, both load the same way"""
+    return ort.InferenceSession(str(path), options or session_options(), providers=["CPUExecutionProvider"])
@@ -0,0 +1,35 @@
+from functools import lru_cache
+from math import gcd
+import os
+import numpy as np
+
+import audio_io
+
+# every recording is brought to this rate once, at decode time: the MFCC, the
+# fingerprints and the stored training files then all see the same rate
+canonical_sr = int(os.environ.get("DURIAN_CANONICAL_SR", 44100))
+
+@lru_cache
+def polyphase_filter(up: int, down: int) -> np.ndarray:
+    # the low-pass filter scipy.signal.resample_poly designs on every call (Kaiser, beta 5),
+    # a phone recording at 48 kHz -> 44.1 kHz needs a 3201 taps filter
+    from scipy.signal import firwin
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)).astype(np.float32)
+
+def resample(y: np.ndarray, sr: int, target: int = canonical_sr) -> np.ndarray:
+    if sr == target:
+        return y
+    from scipy.signal import resample_poly
+    g = gcd(sr, target)
+    up, down = target // g, sr // g
+    return resample_poly(y, up, down, window=polyphase_filter(up, down)).astype(np.float32, copy=False)
+
+def to_canonical(y: np.ndarray, sr: int) -> tuple[np.ndarray, int]:
+    """Mono float32 signal at canonical_sr, as is when it is already there"""
+    return resample(y.astype(np.float32, copy=False), sr), canonical_sr
+
+def load_canonical(data: bytes) -> tuple[np.ndarray, int]:
+    """uploaded bytes -> (mono float32 signal at canonical_sr, canonical_sr)"""
+    return to_canonical(*audio_io.decode(data))
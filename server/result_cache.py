@@ -0,0 +1,70 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import metrics
+
+# DURIAN_RESULT_CACHE_SIZE=0 disables the cache
+cache_size = int(os.environ.get("DURIAN_RESULT_CACHE_SIZE", 2048))
+cache_ttl  = float(os.environ.get("DURIAN_RESULT_CACHE_TTL", 600))  # seconds
+
+lookups_total = metrics.Counter("durian_result_cache_lookups_total", "Result cache lookups by key (upload bytes, decoded pcm) and result (hit, miss)")
+evictions_total = metrics.Counter("durian_result_cache_evictions_total", "Results dropped from the cache, by reason (size, ttl)")
+entries_gauge = metrics.Gauge("durian_result_cache_entries", "Keys held by the result cache")
+
+def upload_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class ResultCache:
+    """
+    Classification results of recently seen recordings, least recently used first
+    out, each kept at most `ttl` seconds. Keys hold the model version, a result is
+    never served by another model. A result is stored under the digest of the
+    decoded signal, which a re-encoded resend shares, and under the digest of the
+    uploaded bytes, which an identical resend hits before decoding anything.
+    Only used from the event loop.
+    """
+
+    def __init__(self, max_entries: int = cache_size, ttl: float = cache_ttl, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, kind: str, digest: str, version: Any) -> Any | None:
+        if self.max_entries <= 0:
+            return None
+        key = (kind, digest, version)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < self.clock():
+            del self._entries[key]
+            evictions_total.inc(reason="ttl")
+            entries_gauge.set(len(self._entries))
+            entry = None
+        lookups_total.inc(key=kind, result="miss" if entry is None else "hit")
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, keys: dict[str, str], version: Any, value: Any):
+        """`keys` maps a kind ("upload", "pcm") to its digest"""
+        if self.max_entries <= 0:
+            return
+        expires = self.clock() + self.ttl
+        for kind, digest in keys.items():
+            self._entries[(kind, digest, version)] = (expires, value)
+            self._entries.move_to_end((kind, digest, version))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            evictions_total.inc(reason="size")
+        entries_gauge.set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        entries_gauge.set(0)
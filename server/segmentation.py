@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from features import frame, get_mfcc_fixed, hop_length, log_mel_frames, max_t, mfcc_from_log_mel, top_db
+
+# DURIAN_SEGMENT_MODE=packed: as many consecutive knocks per window as the model's
+# max_t canvas holds, recordings that fit in it stay a single window (what the
+# models were trained on). knock: one window per knock, for models trained that way.
+segment_mode = os.environ.get("DURIAN_SEGMENT_MODE", "packed")
+
+min_gap_s      = 0.15   # knocks closer than this are the same knock
+mad_factor     = 8.0    # onset threshold: median + mad_factor * MAD of the onset strength...
+relative_floor = 0.3    # ...and at least this fraction of the strongest onset
+# the CNN ends in Flatten so it is position sensitive: the first knock of the
+# training clips comes 0.7-1.2s in, windows keep that much lead-in before a knock
+lead_in        = 64     # frames (~0.75s at 44.1 kHz)
+knock_frames   = 20     # decay of a knock, a knock is only packed if it fits whole
+
+def onset_strength(log_mel: np.ndarray) -> np.ndarray:
+    """Spectral flux: mean rise of the log-mel bands from one frame to the next"""
+    clipped = np.maximum(log_mel, log_mel.max() - top_db)
+    strength = np.zeros(len(clipped), dtype=np.float32)
+    strength[1:] = np.maximum(0, np.diff(clipped, axis=0)).mean(axis=1)
+    return strength
+
+def detect_onsets(strength: np.ndarray, sr: int) -> np.ndarray:
+    """Frame indices of the knocks: local maxima of the onset strength above an adaptive threshold"""
+    gap = max(1, int(min_gap_s * sr / hop_length))
+    local_max = sliding_window_view(np.pad(strength, gap, constant_values=-np.inf), 2 * gap + 1).max(axis=1)
+    median = np.median(strength)
+    threshold = max(median + mad_factor * np.median(np.abs(strength - median)), relative_floor * strength.max())
+    peaks = np.flatnonzero((strength == local_max) & (strength > threshold))
+    # the first frames rise from the zero padding of the centered STFT, not from a knock
+    peaks = peaks[peaks > 2]
+    # plateaus give several equal maxima, keep the first of each
+    return peaks[np.concatenate([[True], np.diff(peaks) > gap])] if len(peaks) else peaks
+
+def windows(onsets: np.ndarray, n_frames: int, mode: str = segment_mode, size: int = max_t) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(start, stop) frames of each window and its weight (number of knocks it holds)"""
+    if mode == "packed" and n_frames <= size:
+        return np.array([0]), np.array([n_frames]), np.array([max(1, len(onsets))])
+    if len(onsets) == 0:
+        # no knock found: tile the recording so nothing is dropped
+        starts = np.arange(0, n_frames, size)
+        return starts, np.minimum(starts + size, n_frames), np.ones(len(starts), dtype=np.int64)
+
+    if mode == "knock":
+        starts = np.maximum(onsets - lead_in, 0)
+        # a window never reaches back into the previous knock
+        starts[1:] = np.maximum(starts[1:], onsets[:-1] + knock_frames)
+        stops = np.minimum(np.append(onsets[1:], n_frames), starts + size)
+        return starts, stops, np.ones(len(onsets), dtype=np.int64)
+
+    starts, stops, weights = [], [], []
+    i = 0
+    while i < len(onsets):
+        start = max(int(onsets[i]) - lead_in, 0)
+        # knocks whose decay still fits in this window
+        j = max(i + 1, int(np.searchsorted(onsets, start + size - knock_frames)))
+        starts.append(start)
+        stops.append(min(start + size, n_frames))
+        weights.append(j - i)
+        i = j
+    return np.array(starts), np.array(stops), np.array(weights)
+
+def segment_mfcc(y: np.ndarray, sr: int, mode: str = segment_mode) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Signal -> (n_windows, n_mfcc, max_t) MFCC windows and their weights. The STFT
+    and mel spectrum are computed once for the whole recording, each window is
+    then clipped and normalized on its own like a separate clip.
+    """
+    return segment_log_mel(log_mel_frames([frame(y)], sr), sr, mode)
+
+def segment_log_mel(log_mel: np.ndarray, sr: int, mode: str = segment_mode, onsets: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """segment_mfcc from the (n_frames, n_mels) log-mel spectrum, e.g. a StreamingMfcc's"""
+    if onsets is None:
+        onsets = detect_onsets(onset_strength(log_mel), sr)
+    starts, stops, weights = windows(onsets, len(log_mel), mode)
+    counts = stops - starts
+    blocks = np.concatenate([log_mel[start:stop] for start, stop in zip(starts, stops)])
+    mfcc = mfcc_from_log_mel(blocks, counts)
+    out = np.stack([get_mfcc_fixed(np.ascontiguousarray(m.T)) for m in np.split(mfcc, np.cumsum(counts)[:-1])])
+    return out, weights
+
+def combine(scores: np.ndarray, weights: np.ndarray) -> float:
+    """One prediction for the recording: window scores weighted by their number of knocks"""
+    return float(np.average(np.asarray(scores, dtype=np.float64).ravel(), weights=weights))
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+
+import audio_io
+from features import StreamingMfcc
+from segmentation import detect_onsets, knock_frames, onset_strength, segment_log_mel
+
+# a stream is scored and closed once it is this long, even without an "end" message
+max_stream_seconds = float(os.environ.get("DURIAN_STREAM_MAX_SECONDS", 30))
+
+class StreamSession:
+    """
+    One /classify-stream connection: PCM chunks in, model inputs out. The log-mel
+    spectrum grows with every chunk, a provisional score is due each time a new
+    knock has been heard whole (onset + its decay), so the first result comes a
+    knock length after the knock instead of after the upload.
+    """
+
+    def __init__(self, sr: int, encoding: str = "s16le", channels: int = 1):
+        if not 8000 <= sr <= 192000:
+            raise audio_io.AudioDecodeError(f"Unsupported sample rate {sr}")
+        self.sr = sr
+        self.pcm = audio_io.PcmStream(encoding, channels)
+        self.mfcc = StreamingMfcc(sr)
+        self.knocks = 0
+
+    @property
+    def seconds(self) -> float:
+        return self.mfcc.n_samples / self.sr
+
+    @property
+    def full(self) -> bool:
+        return self.seconds >= max_stream_seconds
+
+    def feed(self, data: bytes) -> bool:
+        """Add a chunk, True when a knock completed since the last provisional score"""
+        if self.mfcc.feed(self.pcm.decode(data)) == 0:
+            return False
+        log_mel = self.mfcc.log_mel()
+        onsets = detect_onsets(onset_strength(log_mel), self.sr)
+        complete = int(np.count_nonzero(onsets + knock_frames <= len(log_mel)))
+        if complete <= self.knocks:
+            return False
+        self.knocks = complete
+        return True
+
+    def finish(self):
+        self.mfcc.finish()
+
+    def inputs(self) -> tuple[np.ndarray, np.ndarray]:
+        """(n_windows, 40, max_t, 1) model inputs of the audio so far and their weights, as /classify would cut them"""
+        windows, weights = segment_log_mel(self.mfcc.log_mel(), self.sr)
+        return windows[..., np.newaxis], weights
@@ -0,0 +1,94 @@
+import asyncio
+from contextlib import contextmanager
+import functools
+import inspect
+import os
+import time
+from typing import Any, Callable
+from quart import Quart, g, request
+
+import metrics
+
+# event loop lag is sampled by a task sleeping this long, the overshoot is the lag
+loop_lag_interval = float(os.environ.get("DURIAN_LOOP_LAG_INTERVAL", 0.5))
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 120, 600)
+
+span_seconds = metrics.Histogram("durian_span_seconds", "Duration of traced operations (conversion, pipeline, inference, training)", buckets=latency_buckets)
+request_seconds = metrics.Histogram("durian_request_seconds", "HTTP request duration until the response is returned", buckets=latency_buckets)
+inputs_total = metrics.Counter("durian_inputs_total", "Audio inputs received, by declared format and decoded sample rate")
+predictions_total = metrics.Counter("durian_predictions_total", "Classifications returned, by label, model version and cascade stage")
+loop_lag_seconds = metrics.Histogram("durian_event_loop_lag_seconds", "Delay of the event loop in waking a sleeping task", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+loop_lag_max = metrics.Gauge("durian_event_loop_lag_max_seconds", "Largest event loop lag since the last scrape")
+
+@contextmanager
+def span(name: str, **labels: Any):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        span_seconds.observe(time.perf_counter() - start, span=name, **labels)
+
+def traced(name: str):
+    """Time every call of the decorated function (sync or async) as span `name`"""
+    def decorator(fn: Callable):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_input(format: str, sample_rate: int):
+    inputs_total.inc(format=format, sample_rate=sample_rate)
+
+def count_prediction(label: str, model_version: Any, stage: str = "full"):
+    # stage: "fast" when the cascade's first stage answered alone, "full" for the model
+    predictions_total.inc(label=label, model_version=model_version, stage=stage)
+
+async def monitor_loop_lag(interval: float = loop_lag_interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        loop_lag_seconds.observe(lag)
+        loop_lag_max.set(max(lag, loop_lag_max.get()))
+
+def render() -> str:
+    body = metrics.render()
+    # the max is per scrape interval
+    loop_lag_max.set(0)
+    return body
+
+def install(app: Quart):
+    """Request timings and the event loop lag monitor, on top of the app's own spans"""
+    tasks: list[asyncio.Task] = []
+
+    @app.before_serving
+    async def start_loop_lag_monitor():
+        tasks.append(asyncio.create_task(monitor_loop_lag()))
+
+    @app.after_serving
+    async def stop_loop_lag_monitor():
+        for task in tasks:
+            task.cancel()
+
+    @app.before_request
+    async def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    async def observe_request(response):
+        start = g.get("request_start")
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            request_seconds.observe(time.perf_counter() - start, route=route, method=request.method, status=response.status_code)
+        return response
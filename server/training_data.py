@@ -0,0 +1,144 @@
+import json
+import math
+import os
+from pathlib import Path
+from typing import Callable, Protocol
+import keras
+import numpy as np
+
+batch_size      = int(os.environ.get("DURIAN_TRAIN_BATCH_SIZE", 32))
+# rows shuffled together, the rows of a block are read from a small region of the shards
+shuffle_buffer  = int(os.environ.get("DURIAN_TRAIN_SHUFFLE_BUFFER", 1024))
+loader_workers  = int(os.environ.get("DURIAN_TRAIN_WORKERS", 2))
+prefetch        = int(os.environ.get("DURIAN_TRAIN_PREFETCH", 4))  # batches queued ahead of the model
+augment_enabled = os.environ.get("DURIAN_TRAIN_AUGMENT", "0") == "1"
+
+Augment = Callable[[np.ndarray, np.random.Generator], np.ndarray]
+
+class Source(Protocol):
+    def __len__(self) -> int: ...
+    def read(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]: ...
+
+class ShardSource:
+    """X/y shard pair written by build_dataset.py, X (n, n_mfcc, max_t) stays on disk behind a memory map"""
+
+    def __init__(self, x_path: Path, y_path: Path):
+        self.x = np.load(x_path, mmap_mode="r")
+        self.y = np.load(y_path)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def read(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # only the pages of the requested rows are read
+        return self.x[rows].astype(np.float32), self.y[rows]
+
+class FileSource:
+    """One (n_mfcc, max_t) .npy per row, the feature store's layout"""
+
+    def __init__(self, paths: list[Path], labels: np.ndarray):
+        self.paths = paths
+        self.labels = np.asarray(labels)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def read(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return np.stack([np.load(self.paths[i]) for i in rows]).astype(np.float32), self.labels[rows]
+
+class RowsSource:
+    """Some rows of another source, e.g. the replayed sample of an older phase"""
+
+    def __init__(self, source: Source, rows: np.ndarray):
+        self.source = source
+        self.rows = np.sort(rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def read(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return self.source.read(self.rows[rows])
+
+def shard_sources(dataset_dir: Path, split: str) -> list[Source]:
+    """Shards of a build_dataset.py output directory"""
+    manifest = json.loads((dataset_dir / "manifest.json").read_text())
+    return [
+        ShardSource(dataset_dir / shard["x"], dataset_dir / shard["y"])
+        for shard in manifest["shards"] if shard["split"] == split
+    ]
+
+def augment_mfcc(x: np.ndarray, rng: np.random.Generator, max_shift: float = 0.1, max_noise: float = 0.015, p: float = 0.5) -> np.ndarray:
+    """
+    MFCC counterparts of the notebook's Shift and AddGaussianNoise, each applied
+    to a row with probability p. TimeStretch and PitchShift need the waveform,
+    build_dataset.py applies them before featurizing.
+    """
+    for row in x:
+        if rng.random() < p:
+            # audiomentations' Shift rolls the signal over as well
+            row[:] = np.roll(row, int(rng.uniform(-max_shift, max_shift) * row.shape[1]), axis=1)
+        if rng.random() < p:
+            row += rng.normal(0, rng.uniform(0.001, max_noise), row.shape).astype(row.dtype)
+    return x
+
+class MfccDataset(keras.utils.PyDataset):
+    """
+    Batches (batch, n_mfcc, max_t, 1) for model.fit, read from the sources on demand:
+    memory holds the batches queued by the loader workers, never the whole dataset.
+    Rows are shuffled within blocks of `shuffle_buffer` rows and the blocks are
+    visited in random order, reshuffled each epoch.
+    """
+
+    def __init__(
+        self,
+        sources: list[Source],
+        batch_size: int = batch_size,
+        shuffle_buffer: int = shuffle_buffer,
+        shuffle: bool = True,
+        augment: Augment | None = augment_mfcc if augment_enabled else None,
+        seed: int | None = None,
+        workers: int = loader_workers,
+        max_queue_size: int = prefetch,
+    ):
+        super().__init__(workers=workers, use_multiprocessing=False, max_queue_size=max_queue_size)
+        self.sources = sources
+        self.offsets = np.cumsum([0, *[len(source) for source in sources]])
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.shuffle = shuffle
+        self.augment = augment
+        self.seed = int(np.random.default_rng(seed).integers(2**31))
+        self.epoch = 0
+        self.order = self._order()
+        self.row_shape = sources[0].read(np.arange(1))[0].shape[1:] if len(self.order) else ()
+
+    def _order(self) -> np.ndarray:
+        n = int(self.offsets[-1])
+        if not self.shuffle:
+            return np.arange(n)
+        rng = np.random.default_rng((self.seed, self.epoch))
+        blocks = [np.arange(start, min(start + self.shuffle_buffer, n)) for start in range(0, n, self.shuffle_buffer)]
+        return np.concatenate([rng.permutation(blocks[i]) for i in rng.permutation(len(blocks))]) if blocks else np.arange(0)
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.order) / self.batch_size)
+
+    def __getitem__(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        rows = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        owners = np.searchsorted(self.offsets, rows, side="right") - 1
+        x = np.empty((len(rows), *self.row_shape), dtype=np.float32)
+        y = np.empty(len(rows), dtype=np.float32)
+        for owner in np.unique(owners):
+            positions = np.flatnonzero(owners == owner)
+            # sorted reads stay sequential in the memory map
+            local = np.sort(rows[positions] - self.offsets[owner])
+            positions = positions[np.argsort(rows[positions])]
+            x[positions], y[positions] = self.sources[owner].read(local)
+        if self.augment is not None:
+            # per batch generator: the loader threads never share one
+            x = self.augment(x, np.random.default_rng((self.seed, self.epoch, index)))
+        return x[..., np.newaxis], y
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.order = self._order()
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import json
+import threading
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Literal
+import keras
+
+JobStatus = Literal["queued", "running", "completed", "failed", "cancelled"]
+finished_statuses = ("completed", "failed", "cancelled")
+
+class JobCancelled(Exception):
+    pass
+
+class TrainingJob:
+    def __init__(self, phase: int, epochs: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.phase = phase
+        self.epochs = epochs
+        self.status: JobStatus = "queued"
+        self.epoch = 0
+        self.logs: dict[str, float] = {}
+        self.error: str | None = None
+        self.result: dict[str, Any] = {}
+        self.created_at = datetime.datetime.now(datetime.UTC)
+        self.finished_at: datetime.datetime | None = None
+        # set from the event loop, read by the training thread between batches
+        self.cancel_event = threading.Event()
+        self.events: list[dict[str, Any]] = []
+        self._listeners: list[asyncio.Queue] = []
+        self._loop = asyncio.get_running_loop()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "phase": self.phase,
+            "status": self.status,
+            "epoch": self.epoch,
+            "epochs": self.epochs,
+            "logs": self.logs,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "finished_at": self.finished_at.strftime("%Y-%m-%dT%H:%M:%SZ") if self.finished_at else None,
+        }
+
+    def publish(self, event: str, **data: Any):
+        """Record an event and wake the SSE listeners, callable from any thread"""
+        payload = {"event": event, **data, "job": self.to_dict()}
+        def deliver():
+            self.events.append(payload)
+            for queue in self._listeners:
+                queue.put_nowait(payload)
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            deliver()
+        else:
+            self._loop.call_soon_threadsafe(deliver)
+
+    def set_status(self, status: JobStatus, **data: Any):
+        self.status = status
+        if status in finished_statuses:
+            self.finished_at = datetime.datetime.now(datetime.UTC)
+        self.publish("status", **data)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Server-sent events: past events first, then live ones until the job ends"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for payload in self.events:
+            queue.put_nowait(payload)
+        self._listeners.append(queue)
+        try:
+            while True:
+                payload = await queue.get()
+                yield f"event: {payload['event']}\ndata: {json.dumps(payload)}\n\n"
+                if payload["event"] == "status" and payload["job"]["status"] in finished_statuses:
+                    return
+        finally:
+            self._listeners.remove(queue)
+
+class ProgressCallback(keras.callbacks.Callback):
+    def __init__(self, job: TrainingJob):
+        super().__init__()
+        self.job = job
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.job.cancel_event.is_set():
+            self.model.stop_training = True
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.job.epoch = epoch + 1
+        self.job.logs = {k: float(v) for k, v in (logs or {}).items()}
+        self.job.publish("epoch")
+
+class JobRunner:
+    """Runs one training job at a time in the background and keeps their history"""
+
+    def __init__(self):
+        self.jobs: dict[str, TrainingJob] = {}
+        self.current: TrainingJob | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def get(self, job_id: str) -> TrainingJob | None:
+        return self.jobs.get(job_id)
+
+    def start(self, job: TrainingJob, run: Callable[[TrainingJob], Awaitable[dict[str, Any]]]):
+        self.jobs[job.id] = job
+        self.current = job
+        task = asyncio.create_task(self._run(job, run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: TrainingJob, run: Callable[[TrainingJob], Awaitable[dict[str, Any]]]):
+        job.set_status("running")
+        try:
+            job.result = await run(job)
+        except JobCancelled:
+            job.set_status("cancelled")
+        except Exception as e:
+            job.error = str(e)
+            job.set_status("failed")
+        else:
+            job.set_status("completed")
+        finally:
+            if self.current is job:
+                self.current = None
+
+    def cancel(self, job: TrainingJob):
+        job.cancel_event.set()
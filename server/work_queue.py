@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import metrics
+
+# seconds a claimed job may run before another worker takes it over (its worker died)
+lease_seconds = float(os.environ.get("DURIAN_QUEUE_LEASE", 30))
+# seconds a request waits for its result before answering 504
+result_timeout = float(os.environ.get("DURIAN_QUEUE_TIMEOUT", 30))
+poll_interval = 0.002       # seconds between two reads of the results, or of the queue by a busy worker
+idle_poll_interval = 0.02   # an idle worker backs off up to this
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    -- ids are never reused: a new job must not take the id of one whose result was just read
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind       TEXT NOT NULL,
+    payload    BLOB NOT NULL,
+    status     TEXT NOT NULL DEFAULT 'queued',
+    worker     TEXT,
+    created    REAL NOT NULL,
+    claimed    REAL,
+    result     TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+queue_wait = metrics.Histogram("durian_queue_wait_seconds", "Time from enqueue to result, by kind", buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+queue_timeouts = metrics.Counter("durian_queue_timeouts_total", "Jobs that got no result in DURIAN_QUEUE_TIMEOUT seconds")
+
+class QueueTimeout(Exception):
+    pass
+
+class WorkQueue:
+    """
+    Jobs shared by the processes of one host through a SQLite file (WAL): the
+    HTTP servers put the uploads in, the inference workers claim them in batches
+    and write the results back. A job claimed by a worker that died is handed out
+    again once its lease expired. Rows are deleted when their result is read.
+    """
+
+    def __init__(self, db_path: Path | str):
+        # one connection per process, opened after any fork
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # results are cheap to recompute, a power loss may lose the last jobs
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(schema)
+
+    def put(self, kind: str, payload: bytes) -> int:
+        with self.lock:
+            return self.conn.execute("INSERT INTO jobs (kind, payload, created) VALUES (?, ?, ?)", (kind, payload, time.time())).lastrowid # type: ignore
+
+    def claim(self, worker: str, limit: int) -> list[tuple[int, str, bytes]]:
+        """Up to `limit` queued jobs, oldest first, marked as claimed by `worker`"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'claimed' AND claimed < ?", (now - lease_seconds,))
+                rows = self.conn.execute(
+                    "UPDATE jobs SET status = 'claimed', worker = ?, claimed = ? "
+                    "WHERE id IN (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT ?) RETURNING id, kind, payload",
+                    (worker, now, limit),
+                ).fetchall()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return sorted(rows)
+
+    def finish(self, results: list[tuple[int, dict[str, Any]]]):
+        """Results of claimed jobs, failures included (a result with an "error")"""
+        with self.lock:
+            self.conn.executemany("UPDATE jobs SET status = 'done', result = ?, payload = x'' WHERE id = ?", [(json.dumps(result), job_id) for job_id, result in results])
+
+    def take(self, ids: list[int]) -> dict[int, dict[str, Any]]:
+        """Results of the finished jobs among `ids`, their rows are deleted"""
+        if not ids:
+            return {}
+        marks = ", ".join("?" * len(ids))
+        with self.lock:
+            rows = self.conn.execute(f"DELETE FROM jobs WHERE status = 'done' AND id IN ({marks}) RETURNING id, result", ids).fetchall()
+        return {job_id: json.loads(result) for job_id, result in rows}
+
+    def cancel(self, ids: list[int]):
+        with self.lock:
+            self.conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+
+    def depth(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+class QueueClient:
+    """
+    Event loop side of the queue: `run` puts a job and waits for its result. A
+    single task polls the results of every waiting request, so the database is
+    read once per interval whatever the number of requests in flight.
+    """
+
+    def __init__(self, queue: WorkQueue, timeout: float = result_timeout):
+        self.queue = queue
+        self.timeout = timeout
+        self._waiting: dict[int, asyncio.Future] = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self.queue.cancel(list(self._waiting))
+        for future in self._waiting.values():
+            future.cancel()
+
+    @property
+    def pending(self) -> int:
+        return len(self._waiting)
+
+    async def run(self, kind: str, payload: bytes) -> dict[str, Any]:
+        start = time.perf_counter()
+        job_id = await asyncio.to_thread(self.queue.put, kind, payload)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[job_id] = future
+        self._wake.set()
+        try:
+            result = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            queue_timeouts.inc()
+            await asyncio.to_thread(self.queue.cancel, [job_id])
+            raise QueueTimeout(f"No inference worker answered in {self.timeout:g}s")
+        finally:
+            self._waiting.pop(job_id, None)
+        queue_wait.observe(time.perf_counter() - start, kind=kind)
+        return result
+
+    async def _poll(self):
+        while True:
+            if not self._waiting:
+                self._wake.clear()
+                await self._wake.wait()
+            results = await asyncio.to_thread(self.queue.take, list(self._waiting))
+            for job_id, result in results.items():
+                future = self._waiting.get(job_id)
+                if future is not None and not future.done():
+                    future.set_result(result)
+            await asyncio.sleep(poll_interval)
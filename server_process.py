@@ -0,0 +1,60 @@
+"""
+Server processes of benchmark.py, load_test.py and load_fleet.py: a script of
+server/ started in its own process group, waited for until it serves, then
+killed with the pool workers it forked.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+def launch(script: str, env: dict[str, str]) -> subprocess.Popen:
+    # own process group: the forked pool workers are killed with their parent
+    return subprocess.Popen([sys.executable, script], cwd="server", env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def port_open(port: int) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=0.05).close()
+        return True
+    except OSError:
+        return False
+
+def check_running(processes: list[subprocess.Popen]):
+    for process in processes:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[-1]} exited with {process.returncode} during start-up") # type: ignore
+
+def wait_port(port: int, processes: list[subprocess.Popen]):
+    while not port_open(port):
+        check_running(processes)
+        time.sleep(0.005)
+
+def wait_ready(base_url: str, processes: list[subprocess.Popen]):
+    """
+    Returns once /ready answers 200, the lite server answers 503 until its model
+    is loaded. A 404 is a server without /ready (the big server): it is ready as
+    soon as it answers.
+    """
+    while True:
+        check_running(processes)
+        try:
+            urllib.request.urlopen(f"{base_url}/ready").read()
+            return
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.01)
+
+def stop(processes: list[subprocess.Popen], port: int):
+    for process in processes:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    # the pool workers hold the listening socket until they are gone too
+    while port_open(port):
+        time.sleep(0.01)
@@ -0,0 +1,80 @@
+import asyncio
+import io
+import os
+import sys
+from pathlib import Path
+from typing import Iterator
+import pytest
+from quart.datastructures import FileStorage
+
+ROOT = Path(__file__).resolve().parent.parent
+# the server modules import each other by their bare name, like the root scripts do
+sys.path.insert(0, str(ROOT / "server"))
+# a small CPU pool, the servers fork it at import
+os.environ.setdefault("DURIAN_CPU_WORKERS", "2")
+
+clean_dir = ROOT / "clean" / "AUDIO_DATA"   # real WAV recordings
+phone_dir = ROOT / "AUDIO_DATA"             # phone mp4 saved under .wav names
+
+@pytest.fixture(scope="session")
+def clean_wavs() -> list[Path]:
+    paths = sorted(clean_dir.glob("*.wav"))
+    if not paths:
+        pytest.skip("clean/AUDIO_DATA is empty")
+    return paths
+
+@pytest.fixture(scope="session")
+def phone_clips() -> list[Path]:
+    paths = sorted(phone_dir.glob("*.wav"))
+    if not paths:
+        pytest.skip("AUDIO_DATA is empty")
+    return paths
+
+class AppClient:
+    """Test client of an app kept serving between tests, each call runs on the app's event loop"""
+
+    def __init__(self, app):
+        self.loop = asyncio.new_event_loop()
+        self.test_app = app.test_app()
+        self.loop.run_until_complete(self.test_app.startup())
+        self.client = self.test_app.test_client()
+
+    def request(self, method: str, path: str, **kwargs) -> tuple[int, str]:
+        response = self.loop.run_until_complete(self.client.open(path, method=method, **kwargs))
+        return response.status_code, self.loop.run_until_complete(response.get_data(as_text=True))
+
+    def post(self, path: str, **kwargs) -> tuple[int, str]:
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.loop.run_until_complete(self.test_app.shutdown())
+        self.loop.close()
+
+def upload(data: bytes, content_type: str = "audio/wav", filename: str = "a.wav") -> FileStorage:
+    return FileStorage(io.BytesIO(data), filename=filename, content_type=content_type)
+
+def multipart(files: list[FileStorage], name: str = "audio") -> dict:
+    """Request arguments sending several files under one field, the test client's `files` takes one per field"""
+    boundary = "durian-test-boundary"
+    body = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{file.filename}"\r\nContent-Type: {file.content_type}\r\n\r\n'.encode()
+        + file.read() + b"\r\n"
+        for file in files
+    ) + f"--{boundary}--\r\n".encode()
+    return {"data": body, "headers": {"Content-Type": f"multipart/form-data; boundary={boundary}"}}
+
+@pytest.fixture(scope="session")
+def lite(tmp_path_factory) -> Iterator[AppClient]:
+    """The lite server with its training storage in a temporary directory"""
+    model_path = ROOT / "server" / "server_models" / os.environ.get("DURIAN_MODEL", "model_v2_(0.51, 0.89)_.onnx")
+    if not model_path.exists():
+        pytest.skip(f"{model_path.name} is not in server/server_models")
+    # read at import: the catalog and the uploads are created there, not in the source tree
+    os.environ["DURIAN_DATA_DIR"] = str(tmp_path_factory.mktemp("lite"))
+    import lite_server
+    client = AppClient(lite_server.app)
+    # fast start: the tests begin once the model is loaded and the pool warm, like /ready
+    if (warm_up := getattr(lite_server.app, "warm_up_task", None)) is not None:
+        client.loop.run_until_complete(warm_up)
+    yield client
+    client.close()
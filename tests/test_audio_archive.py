@@ -0,0 +1,71 @@
+import asyncio
+import io
+import numpy as np
+import pytest
+
+import audio_io
+from audio_archive import clip_pcm, clip_ref, clip_wav, labels_name, load_source, mfcc_current, mfcc_name, pack_phase, read_index, wav_size
+from features import max_t, n_mfcc
+from resample import canonical_sr
+
+@pytest.fixture
+def phase(tmp_path) -> tuple:
+    """A closed phase of three stored WAV files with their feature store MFCCs, packed"""
+    rng = np.random.default_rng(0)
+    signals = [rng.uniform(-0.5, 0.5, n).astype(np.float32) for n in (4410, 8820, 2205)]
+    entries, paths, mfcc_paths, mfccs = [], [], [], []
+    for i, (y, label) in enumerate(zip(signals, ["mature", "overripe", "mature"])):
+        name = f"2024-01-01_00-00-0{i}_{i:016x}_{label}.wav"
+        (path := tmp_path / name).write_bytes(audio_io.encode_wav(y, canonical_sr))
+        mfccs.append(rng.uniform(-1, 1, (n_mfcc, max_t)).astype(np.float16))
+        np.save(mfcc_path := tmp_path / f"{i}.npy", mfccs[-1])
+        entries.append({"name": name, "link": f"train_submitted/phase_0/{name}", "label": label})
+        paths.append(path)
+        mfcc_paths.append(mfcc_path)
+    (phase_dir := tmp_path / "phase_0").mkdir()
+    clips = pack_phase(phase_dir, entries, paths, mfcc_paths)
+    return phase_dir, clips, signals, mfccs
+
+def test_clips_read_back_through_the_memmap(phase):
+    phase_dir, clips, signals, mfccs = phase
+    assert read_index(phase_dir) == clips
+    assert mfcc_current(phase_dir)
+    assert [clip["offset"] for clip in clips] == [0, 4410, 4410 + 8820]
+    for clip, y in zip(clips, signals):
+        ref = clip_ref(phase_dir, clip["offset"], clip["frames"])
+        assert ref.sr == canonical_sr and clip["size"] == wav_size(len(y))
+        # written once as int16 by encode_wav, once more by the archive
+        np.testing.assert_allclose(clip_pcm(ref) / 32767, y, atol=2 / 32767)
+        signal, sr = load_source(ref)
+        assert sr == canonical_sr and signal.dtype == np.float32
+        np.testing.assert_allclose(signal, y, atol=3 / 32767)
+    np.testing.assert_array_equal(np.load(phase_dir / mfcc_name), np.stack(mfccs))
+    np.testing.assert_array_equal(np.load(phase_dir / labels_name), [1, 0, 1])
+
+def test_archived_clip_is_a_wav_that_answers_range_requests(phase):
+    from quart import Quart, send_file
+    phase_dir, clips, signals, _ = phase
+    ref = clip_ref(phase_dir, clips[1]["offset"], clips[1]["frames"])
+    wav = clip_wav(ref)
+    assert len(wav) == clips[1]["size"]
+    y, sr = audio_io.decode(wav)
+    assert sr == canonical_sr
+    np.testing.assert_allclose(y, signals[1], atol=3 / 32767)
+
+    # what /get-audio of the big server answers for an archived submission
+    app = Quart(__name__)
+
+    @app.get("/clip")
+    async def clip():
+        return await send_file(io.BytesIO(clip_wav(ref)), mimetype="audio/wav", conditional=True)
+
+    async def fetch(**headers: str):
+        response = await app.test_client().get("/clip", headers=headers)
+        return response.status_code, response.headers, await response.get_data()
+
+    status, _, body = asyncio.run(fetch())
+    assert status == 200 and body == wav
+    status, headers, body = asyncio.run(fetch(Range="bytes=44-1043"))
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 44-1043/{len(wav)}"
+    assert body == wav[44:1044]
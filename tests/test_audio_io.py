@@ -0,0 +1,40 @@
+import shutil
+import numpy as np
+import pytest
+from quart.datastructures import FileStorage
+
+import audio_io
+from audio_io import AudioDecodeError
+
+def test_wav_round_trip():
+    y = np.sin(np.linspace(0, 200 * np.pi, 22050)).astype(np.float32) * 0.5
+    decoded, sr = audio_io.decode(audio_io.encode_wav(y, 22050))
+    assert sr == 22050
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, y, atol=2 / 32767)
+
+def test_decodes_the_phone_recordings_saved_as_wav(phone_clips):
+    if shutil.which(audio_io.ffmpeg_binary) is None:
+        pytest.skip("ffmpeg is not installed")
+    y, sr = audio_io.decode(phone_clips[0].read_bytes())
+    assert y.ndim == 1 and y.dtype == np.float32
+    assert sr > 0 and len(y) > sr // 10
+
+@pytest.mark.parametrize("data", [
+    b"RIFF\x00\x00\x00\x00WAVEjunkjunk",       # no data chunk
+    b"RIFF\x24\x00\x00\x00WAVEdata\x04\x00\x00\x00\x00\x00\x00\x00",  # data before fmt
+])
+def test_malformed_wav_is_rejected(data):
+    with pytest.raises(AudioDecodeError):
+        audio_io.decode(data)
+
+def test_garbage_is_rejected():
+    if shutil.which(audio_io.ffmpeg_binary) is None:
+        pytest.skip("ffmpeg is not installed")
+    with pytest.raises(AudioDecodeError):
+        audio_io.decode(b"definitely not audio" * 100)
+
+def test_unsupported_content_type_is_rejected():
+    with pytest.raises(AudioDecodeError):
+        audio_io.file_type(FileStorage(filename="a.ogg", content_type="audio/ogg"))
+    assert audio_io.file_type(FileStorage(filename="a.m4a", content_type="audio/x-m4a")) == "x-m4a"
@@ -0,0 +1,68 @@
+import asyncio
+import time
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+
+def run_batcher(predict_fn, scenario, **kwargs):
+    async def main():
+        batcher = MicroBatcher(predict_fn, **kwargs)
+        await batcher.start()
+        try:
+            return await scenario(batcher)
+        finally:
+            await batcher.stop()
+    return asyncio.run(main())
+
+def test_concurrent_inputs_share_one_call_and_get_their_own_rows():
+    calls = []
+    def predict(x):
+        calls.append(len(x))
+        return x[:, :1] * 2
+
+    async def scenario(batcher):
+        inputs = [np.full((n, 3), i, dtype=np.float32) for i, n in enumerate([1, 3, 2])]
+        return inputs, await asyncio.gather(*[batcher.submit(x) for x in inputs])
+
+    inputs, outputs = run_batcher(predict, scenario, max_batch_size=16, max_wait_ms=50)
+    assert calls == [6]
+    for x, out in zip(inputs, outputs):
+        assert out.shape == (len(x), 1)
+        np.testing.assert_array_equal(out, x[:, :1] * 2)
+
+def test_batch_is_sent_once_full():
+    calls = []
+    def predict(x):
+        calls.append(len(x))
+        return x
+
+    async def scenario(batcher):
+        return await asyncio.gather(*[batcher.submit(np.full((2, 1), i)) for i in range(4)])
+
+    outputs = run_batcher(predict, scenario, max_batch_size=4, max_wait_ms=1000)
+    assert calls == [4, 4]
+    assert [int(out[0, 0]) for out in outputs] == [0, 1, 2, 3]
+
+def test_lone_input_waits_at_most_max_wait():
+    async def scenario(batcher):
+        start = time.perf_counter()
+        await batcher.submit(np.zeros((1, 1)))
+        return time.perf_counter() - start
+
+    elapsed = run_batcher(lambda x: x, scenario, max_batch_size=16, max_wait_ms=50)
+    assert 0.04 <= elapsed < 0.5
+
+def test_prediction_error_reaches_every_request():
+    def predict(x):
+        raise ValueError("bad input")
+
+    async def scenario(batcher):
+        return await asyncio.gather(*[batcher.submit(np.zeros((1, 1))) for _ in range(3)], return_exceptions=True)
+
+    errors = run_batcher(predict, scenario, max_wait_ms=20)
+    assert all(isinstance(e, ValueError) for e in errors)
+
+def test_submit_before_start_raises():
+    with pytest.raises(RuntimeError):
+        asyncio.run(MicroBatcher(lambda x: x).submit(np.zeros((1, 1))))
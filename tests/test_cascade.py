@@ -0,0 +1,55 @@
+from pathlib import Path
+import numpy as np
+import pytest
+
+from cascade import Cascade, calibrate, cascade_path, fit_logistic, pooled_stats, predict_logistic
+
+def windows(rng: np.random.Generator, n: int, level: float) -> np.ndarray:
+    return rng.normal(level, 1.0, (n, 40, 273, 1)).astype(np.float32)
+
+@pytest.fixture(scope="module")
+def fitted() -> Cascade:
+    rng = np.random.default_rng(0)
+    x = np.concatenate([windows(rng, 20, -0.5), windows(rng, 20, 0.5)])
+    y = np.repeat([0, 1], 20)
+    return Cascade(fit_logistic(pooled_stats(x), y), threshold=0.9)
+
+def test_pooled_stats():
+    x = np.arange(2 * 3 * 4, dtype=np.float32).reshape(2, 3, 4, 1)
+    f = pooled_stats(x)
+    assert f.shape == (2, 6)
+    np.testing.assert_allclose(f[:, :3], x[..., 0].mean(axis=2))
+    np.testing.assert_allclose(f[:, 3:], x[..., 0].std(axis=2))
+
+def test_logistic_regression_separates_the_classes(fitted):
+    rng = np.random.default_rng(1)
+    assert (fitted.scores(windows(rng, 5, -0.5)) < 0.5).all()
+    assert (fitted.scores(windows(rng, 5, 0.5)) > 0.5).all()
+
+def test_calibrate_picks_the_lowest_confidence_meeting_the_target():
+    scores = np.array([0.99, 0.02, 0.95, 0.1, 0.8, 0.3, 0.6])
+    y = np.array([1, 0, 1, 0, 0, 0, 1])
+    # by confidence: 0.99 ok, 0.98 ok, 0.95 ok, 0.9 ok, 0.8 wrong, 0.7 ok, 0.6 ok
+    assert calibrate(scores, y, target=1.0) == pytest.approx(0.9)
+    assert calibrate(scores, y, target=0.8) == pytest.approx(0.6)
+    assert calibrate(np.array([0.9]), np.array([0]), target=0.97) == 1.0
+
+def test_decide_answers_only_above_the_threshold(fitted):
+    rng = np.random.default_rng(2)
+    clear = windows(rng, 3, 0.5)
+    assert fitted.decide(clear, np.ones(3)) == pytest.approx(float(fitted.scores(clear).mean()))
+    unsure = Cascade(fitted.params, threshold=1.0)
+    assert unsure.decide(clear, np.ones(3)) is None
+
+def test_save_and_load_round_trip(fitted, tmp_path):
+    path = tmp_path / "model.cascade.json"
+    fitted.save(path, exit_rate=0.5)
+    loaded = Cascade.load(path)
+    assert loaded is not None and loaded.threshold == fitted.threshold
+    f = pooled_stats(windows(np.random.default_rng(3), 4, 0.0))
+    np.testing.assert_allclose(predict_logistic(loaded.params, f), predict_logistic(fitted.params, f))
+    assert Cascade.load(tmp_path / "missing.cascade.json") is None
+
+@pytest.mark.parametrize("name", ["m_(0.5, 0.9)_.onnx", "m_(0.5, 0.9)_.int8-static.onnx", "m_(0.5, 0.9)_.int8-dynamic.onnx", "m_(0.5, 0.9)_.ort", "m_(0.5, 0.9)_.keras"])
+def test_every_variant_shares_one_cascade_file(name):
+    assert cascade_path(Path("models") / name) == Path("models") / "m_(0.5, 0.9)_.cascade.json"
@@ -0,0 +1,23 @@
+import numpy as np
+
+import audio_io
+from dedup import fingerprint, near_threshold, similarity
+
+def half_gain(data: bytes) -> bytes:
+    y, sr = audio_io.decode(data)
+    return audio_io.encode_wav(y * 0.5, sr)
+
+def test_same_recording_at_another_gain_is_a_near_duplicate(clean_wavs):
+    data = clean_wavs[0].read_bytes()
+    (v1, m1), (v2, m2) = fingerprint(data), fingerprint(half_gain(data))
+    assert similarity(m1, m2) >= near_threshold
+    assert float(v1 @ v2) > 0.99
+
+def test_distinct_recordings_are_not(clean_wavs):
+    _, m1 = fingerprint(clean_wavs[0].read_bytes())
+    for path in clean_wavs[1:6]:
+        assert similarity(m1, fingerprint(path.read_bytes())[1]) < near_threshold
+
+def test_similarity_tolerates_a_small_shift():
+    m = np.random.default_rng(0).normal(size=(200, 20))
+    assert similarity(m[3:], m) > 0.999
@@ -0,0 +1,44 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import pytest
+
+from executors import Overloaded, Pipeline
+
+def die():
+    os._exit(1)
+
+# the replacement pool is forked with threads running, on purpose (Pipeline.replace)
+@pytest.mark.filterwarnings("ignore:This process .* is multi-threaded:DeprecationWarning")
+def test_a_dead_worker_is_a_503_and_the_pool_is_forked_again():
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("process pools need fork")
+
+    async def main():
+        pipeline = Pipeline(workers=1, kind="process")
+        pipeline.start()
+        try:
+            assert await pipeline.run("test", os.getpid) != os.getpid()
+            with pytest.raises(Overloaded):
+                await pipeline.run("test", die)
+            assert await pipeline.run("test", os.getpid) != os.getpid()
+        finally:
+            pipeline.stop()
+
+    asyncio.run(main())
+
+def test_too_many_pending_jobs_is_a_503():
+    async def main():
+        pipeline = Pipeline(workers=1, max_pending=1, kind="thread")
+        pipeline.start()
+        try:
+            first = asyncio.create_task(pipeline.run("test", time.sleep, 0.1))
+            await asyncio.sleep(0)
+            with pytest.raises(Overloaded):
+                await pipeline.run("test", os.getpid)
+            await first
+        finally:
+            pipeline.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import asyncio
+import numpy as np
+import pytest
+
+from feature_store import FeatureStore
+from features import max_t, n_mfcc
+
+class Pipeline:
+    """Counts the files sent to be featurized, each gets its own constant MFCC"""
+
+    def __init__(self):
+        self.featurized: list[str] = []
+
+    async def featurize_files(self, paths: list[str]) -> list[np.ndarray]:
+        self.featurized += paths
+        return [np.full((n_mfcc, max_t), len(self.featurized) / 100, dtype=np.float32) for _ in paths]
+
+@pytest.fixture
+def store(tmp_path) -> FeatureStore:
+    return FeatureStore(tmp_path / "store")
+
+def write(path, data: bytes):
+    path.write_bytes(data)
+    return path
+
+def test_only_new_audio_is_featurized(store, tmp_path):
+    a, b = write(tmp_path / "a.wav", b"a"), write(tmp_path / "b.wav", b"b")
+    # same audio under another name
+    copy = write(tmp_path / "copy.wav", b"a")
+    pipeline = Pipeline()
+    digest = asyncio.run(store.add(a, pipeline))
+    assert store.path(digest).exists()
+    stored = asyncio.run(store.ensure([a, b, copy], pipeline))
+    assert pipeline.featurized == [str(a), str(b)]
+    assert stored[0] == stored[2] != stored[1]
+
+def test_features_are_read_back_from_the_store(store, tmp_path):
+    a = write(tmp_path / "a.wav", b"a")
+    first = asyncio.run(store.features_for([a], Pipeline()))
+    again = asyncio.run(store.features_for([a], Pipeline()))
+    assert first[0].shape == (n_mfcc, max_t)
+    assert again[0].dtype == np.float32
+    np.testing.assert_allclose(again[0], first[0], atol=5e-4)
+
+def test_known_digests_are_not_hashed_again(store, tmp_path):
+    a = write(tmp_path / "a.wav", b"a")
+    pipeline = Pipeline()
+    asyncio.run(store.add(a, pipeline, "d" * 64))
+    a.unlink()
+    # a stored entry is found by the catalog's digest alone, the file is never read
+    assert asyncio.run(store.ensure([a], pipeline, ["d" * 64])) == [store.path("d" * 64)]
+    assert pipeline.featurized == [str(a)]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import audio_io
+from features import compute_mfcc, compute_mfcc_batch, get_mfcc_fixed, librosa_mfcc, max_t, n_mfcc, tolerance
+
+pytest.importorskip("librosa")
+
+@pytest.fixture(scope="module")
+def clips(clean_wavs) -> list[tuple[np.ndarray, int]]:
+    return [audio_io.decode(path.read_bytes()) for path in clean_wavs[:4]]
+
+def test_matches_librosa(clips):
+    for y, sr in clips:
+        reference = librosa_mfcc(y, sr)
+        mfcc = compute_mfcc(y, sr)
+        assert mfcc.shape == reference.shape
+        assert np.abs(mfcc - reference).max() < tolerance
+
+@pytest.mark.parametrize("sr", [16000, 48000])
+def test_matches_librosa_at_other_rates(sr):
+    y = np.random.default_rng(sr).normal(0, 0.1, sr).astype(np.float32)
+    assert np.abs(compute_mfcc(y, sr) - librosa_mfcc(y, sr)).max() < tolerance
+
+def test_batch_equals_one_clip_at_a_time(clips):
+    mixed = [*clips, (clips[0][0][:30000], 22050)]
+    for batched, (y, sr) in zip(compute_mfcc_batch(mixed), mixed):
+        np.testing.assert_allclose(batched, compute_mfcc(y, sr), atol=1e-6)
+
+def test_fixed_width():
+    short, long = np.ones((n_mfcc, 10)), np.ones((n_mfcc, max_t + 50))
+    assert get_mfcc_fixed(short).shape == (n_mfcc, max_t)
+    assert get_mfcc_fixed(short)[:, 10:].sum() == 0
+    assert get_mfcc_fixed(long).shape == (n_mfcc, max_t)
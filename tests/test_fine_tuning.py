@@ -0,0 +1,44 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pytest
+
+from features import max_t, n_mfcc
+
+pytest.importorskip("keras")
+
+def fine_tune_against_the_holdout(tmp_path: Path) -> tuple[dict[str, list[float]], dict[str, float], float]:
+    """
+    Fine-tunes a small model on a phase whose held-out set has the opposite labels:
+    every epoch makes the held-out loss worse, the first epoch is the best one.
+    Returns the history, the metrics reported and the held-out loss of the weights kept.
+    """
+    import keras
+    import fine_tuning
+    from training_data import MfccDataset, ShardSource
+
+    keras.utils.set_random_seed(0)
+    fine_tuning.learning_rate = 1e-2
+    x = np.random.default_rng(0).normal(size=(64, n_mfcc, max_t)).astype(np.float32)
+    y = (x[:, 0, 0] > 0).astype(np.int8)
+    np.save(tmp_path / "x.npy", x)
+    np.save(tmp_path / "y.npy", y)
+    np.save(tmp_path / "holdout_y.npy", 1 - y)
+    train, holdout = ShardSource(tmp_path / "x.npy", tmp_path / "y.npy"), ShardSource(tmp_path / "x.npy", tmp_path / "holdout_y.npy")
+    model = keras.Sequential([keras.Input((n_mfcc, max_t, 1)), keras.layers.Flatten(), keras.layers.Dense(1, activation="sigmoid")])
+    history = fine_tuning.fine_tune(model, [train], [holdout], epochs=10, callbacks=[])
+    kept_loss, _ = model.evaluate(MfccDataset([holdout], shuffle=False), verbose=0)
+    return history.history, fine_tuning.restored_metrics(history), kept_loss
+
+def test_reports_the_metrics_of_the_restored_epoch(tmp_path):
+    # TensorFlow's threads must not be started here: the lite server forks its pool in this process
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as child:
+        history, metrics, kept_loss = child.submit(fine_tune_against_the_holdout, tmp_path).result()
+    val_loss = history["val_loss"]
+    best = int(np.argmin(val_loss))
+    # stopped early, on an epoch later than the best one
+    assert len(val_loss) < 10 and best < len(val_loss) - 1
+    assert metrics == {k: pytest.approx(history[k][best]) for k in ("loss", "accuracy", "val_loss", "val_accuracy")}
+    # the weights saved are those the metrics describe
+    assert kept_loss == pytest.approx(metrics["val_loss"], rel=1e-4)
@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import zipfile
+import numpy as np
+import pytest
+
+import audio_io
+from conftest import multipart, upload
+from dedup import near_threshold
+from result_cache import upload_digest
+
+def test_classify(lite, clean_wavs):
+    status, body = lite.post("/classify", files={"audio": upload(clean_wavs[0].read_bytes())})
+    assert status == 200
+    result = json.loads(body)
+    assert result["type"] in ("mature", "overripe")
+    assert 0.5 <= result["confidence"] <= 1
+    assert result["segments"] >= 1
+
+def test_classify_rejects_unsupported_type(lite, clean_wavs):
+    status, body = lite.post("/classify", files={"audio": upload(clean_wavs[0].read_bytes(), "audio/ogg", "a.ogg")})
+    assert status == 400
+    assert "not supported" in json.loads(body)["error"]
+
+def test_classify_rejects_undecodable_upload(lite):
+    status, body = lite.post("/classify", files={"audio": upload(b"RIFF\x00\x00\x00\x00WAVEjunkjunk")})
+    assert status == 400
+    assert "error" in json.loads(body)
+
+def test_classify_without_file(lite):
+    status, _ = lite.post("/classify", form={"label": "mature"})
+    assert status == 400
+
+def ndjson(body: str) -> list[dict]:
+    return [json.loads(line) for line in body.splitlines()]
+
+def test_classify_batch_streams_one_line_per_recording(lite, clean_wavs):
+    files = [upload(clean_wavs[1].read_bytes(), filename="first.wav"), upload(b"RIFF\x00\x00\x00\x00WAVEjunkjunk", filename="broken.wav"), upload(clean_wavs[2].read_bytes(), filename="third.wav")]
+    status, body = lite.post("/classify-batch", **multipart(files))
+    assert status == 200
+    *results, done = ndjson(body)
+    assert done == {"done": True, "count": 3, "errors": 1}
+    by_index = {line["index"]: line for line in results}
+    assert sorted(by_index) == [0, 1, 2]
+    assert [by_index[i]["file"] for i in range(3)] == ["first.wav", "broken.wav", "third.wav"]
+    assert by_index[1]["status"] == 400 and "error" in by_index[1]
+    for i in (0, 2):
+        assert by_index[i]["type"] in ("mature", "overripe")
+
+def test_classify_batch_unpacks_archives(lite, clean_wavs):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("crate/a.wav", clean_wavs[3].read_bytes())
+        zf.writestr("crate/notes.txt", "not audio")
+        zf.writestr("__MACOSX/crate/._a.wav", b"resource fork")
+    status, body = lite.post("/classify-batch", files={"audio": upload(archive.getvalue(), "application/zip", "crate.zip")})
+    assert status == 200
+    result, done = ndjson(body)
+    assert result["index"] == 0 and result["file"] == "crate/a.wav" and "type" in result
+    assert done == {"done": True, "count": 1, "errors": 0}
+
+def test_classify_batch_without_file(lite):
+    status, _ = lite.post("/classify-batch", form={})
+    assert status == 400
+
+def add_training_data(lite, data: bytes, label: str = "mature") -> tuple[int, dict]:
+    status, body = lite.post("/add-training-data", form={"label": label}, files={"audio": upload(data)})
+    return status, json.loads(body)
+
+def test_duplicate_training_uploads_are_rejected(lite, clean_wavs):
+    data = clean_wavs[5].read_bytes()
+    assert add_training_data(lite, data)[0] == 200
+
+    status, body = add_training_data(lite, data)
+    assert status == 409
+    assert body["exact"] is True and body["duplicate_of"]["label"] == "mature"
+
+    y, sr = audio_io.decode(data)
+    status, body = add_training_data(lite, audio_io.encode_wav(y * 0.5, sr))
+    assert status == 409
+    assert body["exact"] is False and body["similarity"] >= near_threshold
+
+    assert add_training_data(lite, clean_wavs[6].read_bytes())[0] == 200
+
+def test_results_are_cached_by_upload_and_by_decoded_audio(lite, clean_wavs, monkeypatch):
+    import lite_server
+    data = clean_wavs[7].read_bytes()
+    status, body = lite.post("/classify", files={"audio": upload(data)})
+    assert status == 200
+    cached, _ = lite_server.result_cache.get("upload", upload_digest(data), lite_server.cache_version())
+    assert cached == json.loads(body)
+
+    def no_inference(x):
+        raise AssertionError("the model ran for a cached recording")
+    monkeypatch.setattr(lite_server.batcher, "predict_fn", no_inference)
+    assert lite.post("/classify", files={"audio": upload(data)}) == (200, body)
+    # the same samples with a metadata chunk added: other bytes, same decoded audio
+    chunk = b"LIST\x04\x00\x00\x00INFO"
+    rewrapped = data[:4] + (int.from_bytes(data[4:8], "little") + len(chunk)).to_bytes(4, "little") + data[8:12] + chunk + data[12:]
+    np.testing.assert_array_equal(audio_io.decode(rewrapped)[0], audio_io.decode(data)[0])
+    status, body = lite.post("/classify", files={"audio": upload(rewrapped)})
+    assert status == 200 and json.loads(body) == cached
+
+def test_cached_results_are_not_served_by_another_model(lite, clean_wavs, monkeypatch):
+    import lite_server
+    data = clean_wavs[8].read_bytes()
+    assert lite.post("/classify", files={"audio": upload(data)})[0] == 200
+    monkeypatch.setattr(lite_server, "model_version", "other")
+    monkeypatch.setattr(lite_server.batcher, "predict_fn", lambda x: np.full((len(x), 1), 0.9, dtype=np.float32))
+    status, body = lite.post("/classify", files={"audio": upload(data)})
+    assert status == 200 and json.loads(body)["confidence"] == pytest.approx(0.9)
+
+def save_cascade(path, threshold: float):
+    from cascade import Cascade
+    params = {"mean": np.zeros(80), "scale": np.ones(80), "weights": np.zeros(80), "bias": np.array(3.0)}
+    Cascade(params, threshold).save(path)
+    # a rewrite within the filesystem's timestamp resolution still counts as one
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + int(threshold * 1e9)))
+
+def test_confident_fast_stage_answers_without_the_model(lite, clean_wavs, monkeypatch, tmp_path):
+    import lite_server
+    monkeypatch.setattr(lite_server, "cascade_enabled", True)
+    monkeypatch.setattr(lite_server, "cascade_file", tmp_path / "model.cascade.json")
+    save_cascade(lite_server.cascade_file, threshold=0.9)
+    monkeypatch.setattr(lite_server.result_cache, "max_entries", 0)
+    def no_inference(x):
+        raise AssertionError("the full model ran for a confident recording")
+    monkeypatch.setattr(lite_server.batcher, "predict_fn", no_inference)
+    status, body = lite.post("/classify", files={"audio": upload(clean_wavs[9].read_bytes())})
+    result = json.loads(body)
+    assert status == 200 and result["stage"] == "fast" and result["type"] == "mature"
+    assert result["confidence"] == pytest.approx(1 / (1 + np.exp(-3.0)))
+
+    # below the threshold the recording goes to the full model
+    save_cascade(lite_server.cascade_file, threshold=0.99)
+    monkeypatch.setattr(lite_server.batcher, "predict_fn", lambda x: np.full((len(x), 1), 0.2, dtype=np.float32))
+    status, body = lite.post("/classify", files={"audio": upload(clean_wavs[9].read_bytes())})
+    result = json.loads(body)
+    assert status == 200 and result["stage"] == "full" and result["type"] == "overripe"
+
+def test_rewritten_cascade_is_reloaded_and_its_predecessor_answers_not_served(lite, clean_wavs, monkeypatch, tmp_path):
+    import lite_server
+    monkeypatch.setattr(lite_server, "cascade_enabled", True)
+    monkeypatch.setattr(lite_server, "cascade_file", tmp_path / "model.cascade.json")
+    monkeypatch.setattr(lite_server, "result_cache", lite_server.ResultCache(max_entries=16))
+    data = clean_wavs[11].read_bytes()
+    save_cascade(lite_server.cascade_file, threshold=0.9)
+    assert json.loads(lite.post("/classify", files={"audio": upload(data)})[1])["stage"] == "fast"
+    assert json.loads(lite.post("/classify", files={"audio": upload(data)})[1])["stage"] == "fast"
+    save_cascade(lite_server.cascade_file, threshold=0.99)
+    assert json.loads(lite.post("/classify", files={"audio": upload(data)})[1])["stage"] == "full"
+    lite_server.cascade_file.unlink()
+    assert json.loads(lite.post("/classify", files={"audio": upload(data)})[1])["stage"] == "full"
+
+def test_classify_through_temporary_files(lite, clean_wavs, monkeypatch):
+    import lite_server
+    monkeypatch.setattr(lite_server, "use_temp_files", True)
+    for _ in range(2):
+        status, body = lite.post("/classify", files={"audio": upload(clean_wavs[10].read_bytes())})
+        assert status == 200 and json.loads(body)["segments"] == 1
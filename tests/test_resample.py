@@ -0,0 +1,48 @@
+import struct
+import numpy as np
+import pytest
+
+import audio_io
+from resample import canonical_sr, load_canonical, polyphase_filter, resample, to_canonical
+
+scipy_signal = pytest.importorskip("scipy.signal")
+
+def tone(sr: int, seconds: float = 1.0, hz: float = 440.0) -> np.ndarray:
+    t = np.arange(int(sr * seconds)) / sr
+    return (0.5 * np.sin(2 * np.pi * hz * t)).astype(np.float32)
+
+def test_same_as_scipy_default():
+    y = np.random.default_rng(0).normal(0, 0.1, 48000).astype(np.float32)
+    np.testing.assert_allclose(resample(y, 48000, 44100), scipy_signal.resample_poly(y, 147, 160), atol=1e-6)
+
+def test_round_trip_keeps_the_signal():
+    y = tone(48000)
+    back = resample(resample(y, 48000, 44100), 44100, 48000)
+    assert back.shape == y.shape and back.dtype == np.float32
+    # the filter's edge effects aside
+    assert np.abs(back - y)[1000:-1000].max() < 1e-3
+
+def test_canonical_rate_is_left_as_is():
+    y = tone(canonical_sr)
+    out, sr = to_canonical(y, canonical_sr)
+    assert sr == canonical_sr and out is y
+
+@pytest.mark.parametrize("sr", [16000, 22050, 48000])
+def test_every_rate_lands_on_the_canonical_rate(sr):
+    y, out_sr = load_canonical(audio_io.encode_wav(tone(sr), sr))
+    assert out_sr == canonical_sr
+    assert abs(len(y) - canonical_sr) <= 1
+    assert y.dtype == np.float32
+
+def test_filters_are_built_once_per_rate_pair():
+    polyphase_filter.cache_clear()
+    resample(tone(48000), 48000, 44100)
+    resample(tone(48000), 48000, 44100)
+    info = polyphase_filter.cache_info()
+    assert info.misses == 1 and info.hits == 1
+
+def test_training_files_are_stored_as_16_bit_at_the_canonical_rate():
+    from executors import canonical_wav
+    wav = canonical_wav(audio_io.encode_wav(tone(48000), 48000))
+    audio_format, channels, sr, _, _, bits = struct.unpack_from("<HHIIHH", wav, 20)
+    assert (audio_format, channels, sr, bits) == (1, 1, canonical_sr, 16)
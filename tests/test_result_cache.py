@@ -0,0 +1,48 @@
+from result_cache import ResultCache
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_results_are_kept_per_model_version():
+    cache = ResultCache(max_entries=10, ttl=60)
+    cache.put({"upload": "u1", "pcm": "p1"}, 2, "v2 result")
+    assert cache.get("upload", "u1", 2) == "v2 result"
+    assert cache.get("pcm", "p1", 2) == "v2 result"
+    assert cache.get("upload", "u1", 3) is None
+    cache.put({"upload": "u1"}, 3, "v3 result")
+    assert cache.get("upload", "u1", 2) == "v2 result"
+    assert cache.get("upload", "u1", 3) == "v3 result"
+
+def test_kinds_do_not_collide():
+    cache = ResultCache(max_entries=10, ttl=60)
+    cache.put({"upload": "same"}, 1, "upload result")
+    assert cache.get("pcm", "same", 1) is None
+
+def test_least_recently_used_goes_first():
+    cache = ResultCache(max_entries=2, ttl=60)
+    cache.put({"upload": "a"}, 1, "a")
+    cache.put({"upload": "b"}, 1, "b")
+    cache.get("upload", "a", 1)
+    cache.put({"upload": "c"}, 1, "c")
+    assert len(cache) == 2
+    assert cache.get("upload", "b", 1) is None
+    assert cache.get("upload", "a", 1) == "a"
+
+def test_entries_expire():
+    clock = Clock()
+    cache = ResultCache(max_entries=10, ttl=60, clock=clock)
+    cache.put({"upload": "a"}, 1, "a")
+    clock.now = 59
+    assert cache.get("upload", "a", 1) == "a"
+    clock.now = 61
+    assert cache.get("upload", "a", 1) is None
+    assert len(cache) == 0
+
+def test_size_zero_disables_the_cache():
+    cache = ResultCache(max_entries=0)
+    cache.put({"upload": "a"}, 1, "a")
+    assert cache.get("upload", "a", 1) is None
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+
+import work_queue
+from work_queue import QueueClient, QueueTimeout, WorkQueue
+
+@pytest.fixture
+def queue(tmp_path) -> WorkQueue:
+    return WorkQueue(tmp_path / "queue.sqlite3")
+
+def test_claims_oldest_first_up_to_the_limit(queue):
+    ids = [queue.put("classify", bytes([i])) for i in range(5)]
+    claimed = queue.claim("w1", 3)
+    assert [job_id for job_id, *_ in claimed] == ids[:3]
+    assert [payload for *_, payload in claimed] == [b"\x00", b"\x01", b"\x02"]
+    assert queue.depth() == 2
+    # a claimed job is not handed out twice
+    assert [job_id for job_id, *_ in queue.claim("w2", 10)] == ids[3:]
+    assert queue.claim("w3", 10) == []
+
+def test_results_are_taken_once(queue):
+    job_id = queue.put("classify", b"x")
+    queue.claim("w1", 1)
+    assert queue.take([job_id]) == {}
+    queue.finish([(job_id, {"score": 0.7})])
+    assert queue.take([job_id]) == {job_id: {"score": 0.7}}
+    assert queue.take([job_id]) == {}
+
+def test_job_of_a_dead_worker_is_handed_out_again(queue, monkeypatch):
+    job_id = queue.put("classify", b"x")
+    queue.claim("dead", 1)
+    assert queue.claim("w2", 1) == []
+    monkeypatch.setattr(work_queue, "lease_seconds", -1)
+    assert [job_id for job_id, *_ in queue.claim("w2", 1)] == [job_id]
+
+def test_cancelled_jobs_are_not_claimed(queue):
+    job_id = queue.put("classify", b"x")
+    queue.cancel([job_id])
+    assert queue.claim("w1", 1) == []
+
+def test_client_gets_the_worker_result(queue):
+    async def worker():
+        # the two jobs may be put on either side of a claim
+        done = 0
+        while done < 2:
+            jobs = queue.claim("w1", 10)
+            queue.finish([(job_id, {"echo": payload.decode()}) for job_id, _, payload in jobs])
+            done += len(jobs)
+            await asyncio.sleep(0.001)
+
+    async def main():
+        client = QueueClient(queue, timeout=5)
+        await client.start()
+        try:
+            results = await asyncio.gather(client.run("classify", b"a"), client.run("classify", b"b"), worker())
+        finally:
+            await client.stop()
+        return results[:2]
+
+    assert asyncio.run(main()) == [{"echo": "a"}, {"echo": "b"}]
+
+def test_client_times_out_and_cancels_the_job(queue):
+    async def main():
+        client = QueueClient(queue, timeout=0.05)
+        await client.start()
+        try:
+            with pytest.raises(QueueTimeout):
+                await client.run("classify", b"a")
+        finally:
+            await client.stop()
+
+    asyncio.run(main())
+    assert queue.depth() == 0